@@ -1,21 +1,68 @@
 # app.py (Complete and Corrected)
 
-from flask import Flask, request, jsonify, send_file, Response
+from flask import Flask, Request, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
 import os
+if __name__ == '__main__':
+    # python app.py: spawn / forkserver render processes re-run the main script, which would
+    # set up a second copy of the job queues in each of them, so the dev server forks them
+    os.environ.setdefault("RENDER_START_METHOD", "fork")
+import hashlib
 import uuid
 import io
-import subprocess # To run ocrmypdf command
-import img2pdf # To convert images to PDF
+import json
+import time
+import functools
 import fitz # PyMuPDF - For getting page count and extracting text/images later
-import cv2 # For image cropping
-import numpy as np
 from werkzeug.utils import secure_filename
 # Import GOT-OCR callers
-from utils.ocr import call_got_ocr_area, call_got_ocr_format_text
+from utils.ocr import call_got_ocr_area, call_got_ocr_areas, get_ocr_result_cache, get_default_client, REQUEST_TIMEOUT
+# Concurrent page analysis (render pool + bounded GOT-OCR calls)
+from utils.pipeline import (analyze_page, run_on_render_pool, map_on_render_pool, render_page_png, render_page_clips, shutdown_render_pool,
+                            ANALYZE_MAX_IN_FLIGHT, ANALYZE_PAGE_RETRIES, ANALYZE_DPI,
+                            ANALYZE_SKIP_BLANK, ANALYZE_REUSE_DUPLICATES)
+from utils.tiling import TILING_MODES, ANALYZE_TILING
+# Per-document analysis manifests: finished pages persist, reruns resume
+from utils.analysis import (open_manifest, analysis_params, iter_document_analysis, load_analysis, remove_analysis, store_page_result,
+                            analysis_in_use, analysis_size, manifest_path, searchable_export_path, PAGE_FAILED)
+# Document model (blocks, tables, cells) parsed from Format Text output, and its exports
+from utils.docmodel import parse_formatted_text, block_tables, table_csv, blocks_text, write_searchable_pdf
+# Background job queues for ocrmypdf runs and batch analysis
+from utils.jobs import (JobQueue, QueueFullError, STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED,
+                        STATUS_CANCELLED, ACTIVE_STATUSES, PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_NAMES)
+from utils.cache import create_page_image_cache
+from utils.docpool import DocumentPool
+# ocrmypdf orchestration (page-range splitting, text-layer inspection)
+from utils.ingest import ocr_pdf, ocr_options, HashingSpoolFile, count_input_pages, images_to_pdf
+# Processed PDFs shared by every upload of the same content
+from utils.docstore import DocumentStore, make_content_key, ARTIFACT_READY
+# Thumbnails, viewer images and deep-zoom tiles rendered once per processed PDF
+from utils.renditions import (generate_renditions, load_manifest, remove_renditions, renditions_size, rendition_path, tile_path,
+                              render_page_rendition, RENDITION_SIZES, RENDITION_FORMAT, RENDITION_MIMETYPES)
+# Persisted text layer / word boxes with full-text search
+from utils.textindex import TextIndex
+# Stage timing spans, counters and the /metrics exposition
+from utils.metrics import metrics
+# Deadlines and cancellation of analysis requests and jobs
+from utils.cancel import CancelToken, CancelRegistry, OperationCancelled
 
 # --- Flask App Setup ---
+class StreamingUploadRequest(Request):
+    """
+    Writes uploaded file parts straight to UPLOAD_FOLDER, hashing them on
+    the way. Every spool file is remembered so discard_upload_spool_files
+    can delete the ones not moved into place, including those of a
+    truncated or aborted multipart body that never reached the view.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool_file = HashingSpoolFile(UPLOAD_FOLDER)
+        if not hasattr(self, "spool_files"):
+            self.spool_files = []
+        self.spool_files.append(spool_file)
+        return spool_file
+
 app = Flask(__name__)
+app.request_class = StreamingUploadRequest
 CORS(app)
 
 # --- Configuration ---
@@ -24,15 +71,95 @@ UPLOAD_FOLDER = 'uploads' # Temporary storage for uploads before processing
 PROCESSED_PDF_DIR = 'processed_pdfs' # Storage for final OCR'd PDFs
 TEMP_IMG_DIR = 'temp_images' # Temporary storage for images passed to GOT-OCR
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'tiff', 'bmp', 'gif'}
+UPLOAD_CHUNK_SIZE = 1024 * 1024 # Read size when hashing files on disk
 # DPI for extracting images for display/analysis
 EXTRACT_DPI = 200 # Use this DPI for display and coordinate calculations
-# Path to ocrmypdf executable if not in system PATH
-OCRMYPDF_PATH = os.getenv("OCRMYPDF_EXEC", "ocrmypdf") # Use env var or default
+# Page image serving
+IMAGE_MIMETYPES = {'png': 'image/png', 'jpeg': 'image/jpeg'}
+MIN_IMAGE_DPI, MAX_IMAGE_DPI = 36, 600 # Accepted range for the ?dpi= override
+IMAGE_CACHE_MAX_AGE = 3600 # Seconds browsers may reuse a page image without revalidating
+# Area OCR renders only the selection; small selections get a higher DPI up to this limit
+AREA_TARGET_LONG_EDGE = 1024 # Pixels along the longer side of the rendered selection
+AREA_MAX_DPI = 600
+MAX_AREAS_PER_REQUEST = 100 # Regions accepted by one /ocr_areas call
+# Batch processing (/batches)
+BATCH_RESULTS_DIR = 'batch_results' # GOT-OCR results of batch documents, one JSON file each
+BATCH_ANALYZE_WORKERS = int(os.getenv("BATCH_ANALYZE_WORKERS", "2")) # Batch documents analyzed with GOT-OCR at once
+BATCH_POLL_INTERVAL = 2 # Seconds between checks while a batch document waits for an identical upload's ocrmypdf run
+BATCH_STAGE_OCRMYPDF, BATCH_STAGE_FORMAT, BATCH_STAGE_AREAS = 'ocrmypdf', 'format', 'areas'
+BATCH_STAGES = (BATCH_STAGE_OCRMYPDF, BATCH_STAGE_FORMAT, BATCH_STAGE_AREAS)
+RENDITION_WORKERS = int(os.getenv("RENDITION_WORKERS", "1")) # Documents rendered at once (pages fan out to the render pool)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "240")) # Seconds a graceful stop waits for queued/running jobs
+ANALYZE_DEADLINE = float(os.getenv("ANALYZE_DEADLINE", "0")) # Default seconds an analysis request may take (0 = no limit)
+STATUS_CLIENT_CLOSED = 499 # Response status of a request cancelled through /cancel
 
 # Ensure directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Spool files of uploads a previous process was receiving when it stopped
+for stale_name in os.listdir(UPLOAD_FOLDER):
+    if stale_name.endswith(".upload"):
+        os.remove(os.path.join(UPLOAD_FOLDER, stale_name))
 os.makedirs(PROCESSED_PDF_DIR, exist_ok=True)
 os.makedirs(TEMP_IMG_DIR, exist_ok=True)
+os.makedirs(BATCH_RESULTS_DIR, exist_ok=True)
+
+# Bounded worker pool for ocrmypdf (size via OCR_WORKERS / OCR_MAX_PENDING env vars)
+job_queue = JobQueue()
+# GOT-OCR stages of batch documents; never used by interactive requests, so no reserved worker
+analysis_queue = JobQueue(max_workers=BATCH_ANALYZE_WORKERS, reserved_workers=0, name="batch-analyze")
+# Rendered page images keyed by (doc_id, page, dpi, format); see utils/cache.py for sizing
+page_image_cache = create_page_image_cache()
+# Open fitz.Document handles shared across endpoints (DOC_POOL_MAX_HANDLES / DOC_POOL_IDLE_TIMEOUT)
+doc_pool = DocumentPool()
+# Page text and word boxes extracted once per processed PDF (TEXT_INDEX_DB_PATH)
+text_index = TextIndex()
+
+def discard_derived_files(pdf_path):
+    """Removes renditions, index entries and stored analysis of a processed PDF the document store deleted."""
+    remove_renditions(pdf_path)
+    text_index.remove(pdf_path)
+    remove_analysis(pdf_path)
+
+def derived_files_size(pdf_path):
+    """Bytes of the renditions, index entries and stored analysis of a processed PDF, counted against the store quota."""
+    return renditions_size(pdf_path) + text_index.source_size(pdf_path) + analysis_size(pdf_path)
+
+def processed_pdf_in_use(pdf_path):
+    """True while a pooled handle, an analysis run or a queued/running rendition or batch job needs a processed PDF."""
+    if doc_pool.in_use(pdf_path) or analysis_in_use(pdf_path):
+        return True
+    doc_ids = [job_id.rsplit(":", 1)[0] for job_id in rendition_queue.active_job_ids()] # {doc_id}:renditions
+    doc_ids += [job_id.split(":", 1)[1] for job_id in analysis_queue.active_job_ids()] # {batch_id}:{doc_id}
+    return any(get_processed_pdf_path(doc_id) == pdf_path for doc_id in doc_ids)
+
+# Content-addressed processed PDFs; identical uploads share one (DOC_STORE_QUOTA_MB)
+doc_store = DocumentStore(PROCESSED_PDF_DIR, on_discard=discard_derived_files, derived_size=derived_files_size,
+                          in_use=processed_pdf_in_use)
+# Background rendition generation after ocrmypdf, interactive uploads first
+rendition_queue = JobQueue(max_workers=RENDITION_WORKERS, reserved_workers=0, name="renditions")
+# Cancel tokens of running analysis requests, by request_id (see /cancel)
+active_requests = CancelRegistry()
+
+def shutdown_background_work(timeout=SHUTDOWN_DRAIN_TIMEOUT):
+    """
+    Graceful stop (called by gunicorn.conf.py when the worker exits): new
+    jobs are refused, queued and running ones get up to timeout seconds to
+    finish, then the render pool is stopped. The ocrmypdf queue drains
+    first because finishing uploads still queue batch analysis and
+    renditions. Jobs that miss the deadline are marked failed on restart;
+    batch analysis jobs are then submitted again and resume from their
+    analysis manifests.
+
+    Returns:
+        bool: True if every job finished.
+    """
+    deadline = time.time() + timeout
+    drained = True
+    for queue in (job_queue, analysis_queue, rendition_queue):
+        drained = queue.shutdown(wait=True, timeout=max(0.0, deadline - time.time())) and drained
+    shutdown_render_pool(wait=drained)
+    print("Background work drained" if drained else f"Shutdown left unfinished jobs after {timeout:.0f}s")
+    return drained
 
 # --- Helper Functions ---
 def allowed_file(filename):
@@ -41,9 +168,12 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def get_processed_pdf_path(doc_id):
-     """Constructs the path to the processed PDF."""
+     """Returns the path to the processed PDF, looked up in the document store."""
      safe_doc_id = secure_filename(doc_id)
-     # Use a consistent naming convention
+     stored_path = doc_store.resolve(safe_doc_id)
+     if stored_path:
+         return stored_path
+     # Documents processed before the store existed use the per-doc_id naming
      return os.path.join(PROCESSED_PDF_DIR, f"{safe_doc_id}_ocr.pdf")
 
 def cleanup_file(filepath):
@@ -60,171 +190,876 @@ def ensure_dir(directory):
     if not os.path.exists(directory):
         os.makedirs(directory, exist_ok=True)
 
-# --- API Endpoints ---
+def count_pdf_pages(pdf_path, doc_id=None):
+    """
+    Returns the page count of a PDF, or None if it cannot be opened.
+    Processed PDFs (doc_id given) are opened through the shared handle pool.
+    """
+    pdf_doc = None
+    try:
+        if doc_id:
+            with doc_pool.checkout(doc_id, pdf_path) as pooled_doc:
+                return len(pooled_doc)
+        pdf_doc = fitz.open(pdf_path)
+        return len(pdf_doc)
+    except Exception as count_err:
+        print(f"Error getting page count from {pdf_path}: {count_err}")
+        return None
+    finally:
+        if pdf_doc: pdf_doc.close()
 
-@app.route('/upload', methods=['POST'])
-def upload_and_process_ocrmypdf():
+def run_ocrmypdf_job(doc_id, input_paths, content_key, on_done=None, rendition_priority=PRIORITY_INTERACTIVE):
+    """
+    Background job: converts uploaded images to one PDF if needed, runs
+    ocrmypdf and moves the result into the document store under
+    content_key. Progress is reported through job_queue. Once the
+    processed PDF is in place, rendition generation is queued and
+    on_done(doc_id) is called.
     """
-    Handles uploads (PDF/Image), converts image to PDF if needed,
-    runs ocrmypdf for cleaning, deskewing, OCR,
-    and returns doc_id and page count.
-    """
-    if 'file' not in request.files:
-        return jsonify({"error": "No file part"}), 400
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
-    if not file or not allowed_file(file.filename):
-        return jsonify({"error": "File type not allowed"}), 400
-
-    original_filename = secure_filename(file.filename)
-    file_ext = os.path.splitext(original_filename)[1].lower()
-    doc_id = str(uuid.uuid4())
-    temp_input_path = os.path.join(UPLOAD_FOLDER, f"{doc_id}_input{file_ext}")
-    processed_pdf_path = get_processed_pdf_path(doc_id) # Final output path
+    processed_pdf_path = doc_store.artifact_path(content_key) # Final output path
+    # ocrmypdf writes here first so readers never see a half-written PDF
+    partial_pdf_path = os.path.join(PROCESSED_PDF_DIR, f".{secure_filename(doc_id)}_ocr.partial.pdf")
     temp_pdf_for_ocrmypdf = None # Path to the PDF that ocrmypdf will process
 
     try:
-        file.save(temp_input_path)
-        print(f"File uploaded to temporary path: {temp_input_path}")
-
-        # --- Convert Image to PDF if necessary ---
-        if file_ext != ".pdf":
+        # --- Convert Images to PDF if necessary ---
+        if not input_paths[0].lower().endswith(".pdf"):
             temp_pdf_for_ocrmypdf = os.path.join(UPLOAD_FOLDER, f"{doc_id}_temp.pdf")
-            print(f"Converting image {original_filename} to PDF...")
-            try:
-                with open(temp_pdf_for_ocrmypdf, "wb") as f_pdf:
-                    # Pass image file path directly to img2pdf
-                    f_pdf.write(img2pdf.convert(temp_input_path))
-                print(f"Image converted to PDF: {temp_pdf_for_ocrmypdf}")
-                input_to_ocr = temp_pdf_for_ocrmypdf
-            except Exception as img_conv_err:
-                 print(f"Error converting image to PDF: {img_conv_err}")
-                 raise # Re-raise to be caught by the main try-except
-        else:
-            input_to_ocr = temp_input_path # Use original PDF directly
-
-        # --- Run ocrmypdf ---
-        ocrmypdf_command = [
-            OCRMYPDF_PATH,
-            "--output-type", "pdf",
-            "--deskew",
-            "--clean",
-            "--rotate-pages",
-            "--jobs", "4", # Adjust based on CPU cores
-            # "-l", "eng", # Add language if needed
-            input_to_ocr,
-            processed_pdf_path
-        ]
-        print(f"Running ocrmypdf: {' '.join(ocrmypdf_command)}")
-        result = subprocess.run(ocrmypdf_command, capture_output=True, text=True, check=False) # check=False
-
-        print("ocrmypdf stdout:\n", result.stdout)
-        if result.returncode != 0:
-             print("ocrmypdf stderr:\n", result.stderr)
-             # Attempt to read the ocrmypdf log file if specified
-             # log_path = processed_pdf_path + ".log" # Example log path convention
-             # if os.path.exists(log_path):
-             #     with open(log_path, 'r') as log_f: print("ocrmypdf log:\n", log_f.read())
-             raise Exception(f"ocrmypdf failed with return code {result.returncode}. Check logs.")
+            print(f"Converting {len(input_paths)} image(s) to PDF...")
+            with metrics.span("images_to_pdf"):
+                images_to_pdf(input_paths, temp_pdf_for_ocrmypdf)
+            print(f"Image(s) converted to PDF: {temp_pdf_for_ocrmypdf}")
+            input_to_ocr = temp_pdf_for_ocrmypdf
         else:
-             print("ocrmypdf completed successfully.")
+            input_to_ocr = input_paths[0] # Use original PDF directly
+
+        # --- Run ocrmypdf (adaptive --jobs, searchable pages skipped, big files split) ---
+        with metrics.span("ocrmypdf"):
+            summary = ocr_pdf(
+                input_to_ocr, partial_pdf_path, UPLOAD_FOLDER,
+                queue_depth=min(job_queue.pending_count(), job_queue.max_workers), # Documents sharing the CPU
+                progress=lambda pages_done: job_queue.update(doc_id, pages_done=pages_done),
+                cancel=job_queue.cancel_token(doc_id), # /cancel/<doc_id> or JOB_TIMEOUT stops ocrmypdf
+            )
+        job_queue.update(doc_id, page_count=summary["page_count"], ocr_jobs=summary["jobs"],
+                         skipped_pages=summary["skipped_pages"], ocr_ranges=len(summary["ranges"]))
+        print("ocrmypdf completed successfully.")
+        os.replace(partial_pdf_path, processed_pdf_path)
+        page_image_cache.invalidate(doc_id) # Drop renders of any earlier version
+        doc_pool.invalidate(doc_id) # and handles opened on it
 
         # --- Get Page Count from Processed PDF ---
-        page_count = 0
-        if os.path.exists(processed_pdf_path):
-            pdf_doc = None # Define before try
-            try:
-                pdf_doc = fitz.open(processed_pdf_path)
-                page_count = len(pdf_doc)
-                print(f"Processed PDF has {page_count} pages.")
-            except Exception as count_err:
-                 print(f"Error getting page count from processed PDF: {count_err}")
-                 # Proceed but page count might be 0
-            finally:
-                 if pdf_doc: pdf_doc.close() # Ensure close even on error
-
-        # --- Return Success ---
-        return jsonify({
-            "message": "File processed successfully by ocrmypdf",
-            "doc_id": doc_id,
-            "page_count": page_count,
-        }), 200
+        page_count = count_pdf_pages(processed_pdf_path, doc_id) or 0 # Also warms the handle pool
+        print(f"Processed PDF has {page_count} pages.")
+        job_queue.update(doc_id, page_count=page_count, pages_done=page_count)
 
-    except Exception as e:
-        print(f"Error during upload/ocrmypdf processing: {e}")
-        cleanup_file(processed_pdf_path) # Clean up potentially failed output
-        return jsonify({"error": f"Processing failed: {e}"}), 500
+        # --- Persist the text layer and word boxes for bulk reads and search ---
+        try:
+            with metrics.span("text_index_build"):
+                text_index.build(processed_pdf_path)
+        except Exception as index_err: # Not fatal: the text endpoints index on first use
+            print(f"Error indexing text layer of {processed_pdf_path}: {index_err}")
+        doc_store.mark_ready(content_key, page_count)
+
+        # --- Keep the store within its quota (least recently used artifacts go first) ---
+        for removed_doc_id in doc_store.gc(keep={content_key}):
+            page_image_cache.invalidate(removed_doc_id)
+            doc_pool.invalidate(removed_doc_id)
+
+    except Exception:
+        doc_store.discard(content_key) # Also removes the potentially failed output
+        raise
     finally:
-        # --- Cleanup Temporary Input Files ---
-        cleanup_file(temp_input_path)
+        # --- Cleanup Temporary Files ---
+        cleanup_file(partial_pdf_path)
+        for path in input_paths: cleanup_file(path)
         if temp_pdf_for_ocrmypdf: # If intermediate PDF was created
              cleanup_file(temp_pdf_for_ocrmypdf)
 
+    schedule_renditions(doc_id, rendition_priority)
+    if on_done: on_done(doc_id)
+
+def run_renditions_job(job_id, doc_id):
+    """Background job: renders the thumbnails, viewer images and tiles of a processed document."""
+    pdf_path = get_processed_pdf_path(doc_id)
+    if load_manifest(pdf_path):
+        return # Shared with an identical upload that was already rendered
+    with metrics.span("renditions"):
+        manifest = generate_renditions(pdf_path, EXTRACT_DPI,
+                                       progress=lambda pages_done: rendition_queue.update(job_id, pages_done=pages_done))
+    rendition_queue.update(job_id, page_count=manifest["page_count"])
+
+def schedule_renditions(doc_id, priority=PRIORITY_BATCH):
+    """Queues rendition generation for a processed document unless it is already queued or running."""
+    job_id = f"{doc_id}:renditions"
+    job = rendition_queue.get(job_id)
+    if job and job["status"] in ACTIVE_STATUSES:
+        return
+    try:
+        rendition_queue.submit(job_id, "renditions", run_renditions_job, doc_id, priority=priority)
+    except QueueFullError as qe:
+        print(f"Could not queue renditions for {doc_id}: {qe}")
+
+def store_upload_parts(doc_id, files):
+    """
+    Moves the streamed parts of one document's upload to
+    UPLOAD_FOLDER/{doc_id}_input{index}{ext}.
+
+    Returns:
+        tuple: (input paths, hex SHA-256 over the parts' digests)
+    """
+    input_paths = []
+    content_hash = hashlib.sha256()
+    try:
+        for index, f in enumerate(files):
+            file_ext = os.path.splitext(secure_filename(f.filename))[1].lower()
+            temp_input_path = os.path.join(UPLOAD_FOLDER, f"{doc_id}_input{index}{file_ext}")
+            input_paths.append(temp_input_path)
+            if isinstance(f.stream, HashingSpoolFile):
+                f.stream.move_to(temp_input_path) # Already on disk: rename, no copy
+                content_hash.update(f.stream.hexdigest().encode("ascii"))
+            else: # Parts not created by our stream factory
+                f.save(temp_input_path)
+                part_hash = hashlib.sha256()
+                with open(temp_input_path, "rb") as saved:
+                    for chunk in iter(lambda: saved.read(UPLOAD_CHUNK_SIZE), b""):
+                        part_hash.update(chunk)
+                content_hash.update(part_hash.hexdigest().encode("ascii"))
+    except Exception:
+        for path in input_paths: cleanup_file(path) # Parts stored before the failure
+        raise
+    print(f"Upload stored at: {', '.join(input_paths)}")
+    return input_paths, content_hash.hexdigest()
+
+def register_upload(doc_id, input_paths, content_sha256, input_page_count, priority=PRIORITY_INTERACTIVE, on_done=None):
+    """
+    Queues stored upload files for ocrmypdf, or points doc_id at the stored
+    result of an identical earlier upload (the input files are then removed).
+
+    Returns:
+        dict: {"status": queued/done, "page_count": int or None,
+               "deduplicated_from": origin doc_id or None}
+
+    Raises:
+        QueueFullError: If the queue for this priority is full.
+        RuntimeError: If an identical upload failed while this one was registered.
+    """
+    content_key = make_content_key(content_sha256, ocr_options())
+    if not doc_store.create(doc_id, content_key):
+        artifact = doc_store.find(content_key)
+        for path in input_paths: cleanup_file(path)
+        if artifact is None: # Discarded between create() and find(); the client can simply retry
+            raise RuntimeError("Identical upload failed while this one arrived. Retry.")
+        doc_store.alias(doc_id, content_key)
+        print(f"Upload {doc_id} matches stored document {artifact['origin_doc_id']}, skipping ocrmypdf")
+        if artifact["status"] == ARTIFACT_READY:
+            job_queue.add_record(doc_id, "ocrmypdf", page_count=artifact["page_count"],
+                                 content_sha256=content_sha256, deduplicated_from=artifact["origin_doc_id"])
+            return {"status": STATUS_DONE, "page_count": artifact["page_count"], "deduplicated_from": artifact["origin_doc_id"]}
+        # Still being processed for the earlier upload; /jobs/<doc_id> follows that job
+        return {"status": STATUS_QUEUED, "page_count": input_page_count, "deduplicated_from": artifact["origin_doc_id"]}
+
+    def discard_cancelled_upload(job_id):
+        # Cancelled before run_ocrmypdf_job started: release what its cleanup would have
+        doc_store.discard(content_key)
+        for path in input_paths: cleanup_file(path)
+
+    try:
+        job_queue.submit(doc_id, "ocrmypdf", run_ocrmypdf_job, input_paths, content_key, on_done=on_done,
+                         rendition_priority=priority, page_count=input_page_count, priority=priority,
+                         on_cancel=discard_cancelled_upload)
+        job_queue.update(doc_id, content_sha256=content_sha256)
+    except Exception:
+        doc_store.discard(content_key)
+        for path in input_paths: cleanup_file(path)
+        raise
+    return {"status": STATUS_QUEUED, "page_count": input_page_count, "deduplicated_from": None}
+
+def cached_page_image_response(doc_id, pdf_path, page_num, variant, mimetype, render):
+    """
+    Serves a page image rendered on demand, through page_image_cache and
+    with ETag/Last-Modified so browsers can revalidate or skip the request.
+
+    Args:
+        variant (tuple): What distinguishes this image of the page (dpi/size, format).
+        mimetype (str): Content type of the rendered bytes.
+        render (callable): Returns the encoded image bytes of the page (called
+            with no arguments after the page number was checked; renders on the render pool).
+    """
+    # The ETag changes whenever the processed PDF is replaced
+    pdf_stat = os.stat(pdf_path)
+    etag = "-".join(str(part) for part in (doc_id, page_num, *variant, pdf_stat.st_mtime_ns, pdf_stat.st_size))
+    if request.if_none_match.contains(etag):
+        not_modified = Response(status=304)
+        not_modified.set_etag(etag)
+        return not_modified
+
+    cache_key = (doc_id, page_num, *variant)
+    with metrics.span("page_cache_lookup"):
+        img_bytes = page_image_cache.get(cache_key)
+    if img_bytes is None:
+        try:
+            with doc_pool.checkout(doc_id, pdf_path) as doc:
+                page_count = len(doc)
+            if page_num < 0 or page_num >= page_count:
+                return jsonify({"error": "Page number out of range"}), 404
+            img_bytes = render()
+            page_image_cache.put(cache_key, img_bytes)
+        except Exception as e:
+            print(f"Error extracting page image {page_num} for doc {doc_id}: {e}")
+            return jsonify({"error": "Failed to extract page image"}), 500
+
+    response = Response(img_bytes, mimetype=mimetype)
+    response.set_etag(etag)
+    response.last_modified = pdf_stat.st_mtime
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+    return response.make_conditional(request)
+
+def parse_box_coordinates(box_coords):
+    """
+    Parses a selection box given as a JSON string or list "[x1,y1,x2,y2]".
+    Raises ValueError if it is not four numbers.
+    """
+    try:
+        coords = json.loads(box_coords) if isinstance(box_coords, str) else box_coords
+        if not isinstance(coords, list) or len(coords) != 4: raise ValueError("Coords must be list of 4")
+        return tuple(map(int, coords))
+    except Exception as e_parse:
+        raise ValueError(f"Invalid box_coordinates format: {box_coords}. Error: {e_parse}")
+
+def area_clip(page_rect, box, render_dpi=None):
+    """
+    Maps a selection box onto the part of a page to render.
+
+    Args:
+        page_rect (fitz.Rect): The page's rect in PDF points.
+        box (tuple): (x1, y1, x2, y2) in pixels at EXTRACT_DPI, as shown in the viewer.
+        render_dpi (int, optional): Output resolution. If None, chosen so the
+            selection's long edge is about AREA_TARGET_LONG_EDGE pixels,
+            within [EXTRACT_DPI, AREA_MAX_DPI].
+
+    Returns:
+        tuple: ((x0, y0, x1, y1) clip in PDF points, dpi), as taken by render_page_clips.
+
+    Raises:
+        ValueError: If the box does not overlap the page.
+    """
+    scale = 72 / EXTRACT_DPI # Viewer pixels -> PDF points
+    clip = fitz.Rect(box[0] * scale, box[1] * scale, box[2] * scale, box[3] * scale) & page_rect
+    if clip.is_empty or clip.width <= 0 or clip.height <= 0:
+        raise ValueError("Invalid crop dimensions after clamping (width/height is zero or negative)")
+    if render_dpi is None:
+        long_edge_inches = max(clip.width, clip.height) / 72
+        render_dpi = int(min(AREA_MAX_DPI, max(EXTRACT_DPI, AREA_TARGET_LONG_EDGE / long_edge_inches)))
+    return (clip.x0, clip.y0, clip.x1, clip.y1), render_dpi
+
+def ocr_regions(doc_id, pdf_path, regions, render_dpi=None, use_cache=True, priority=PRIORITY_INTERACTIVE, cancel=None):
+    """
+    Renders and OCRs many regions of a document. Pages are rendered in
+    parallel on the render pool; each page's content is interpreted once
+    (a display list) and every region rasterized from it as a clip. The
+    crops then go to GOT-OCR in one burst.
+
+    Args:
+        regions (list of dict): {"id", "page" (0-based), "box" (x1, y1, x2, y2 at EXTRACT_DPI)}.
+
+    Returns:
+        dict: region id -> {"extracted_text": str} or {"error": str}
+    """
+    results = {}
+    page_nums = sorted({region["page"] for region in regions})
+    with doc_pool.checkout(doc_id, pdf_path) as doc: # Page rects only; rendering happens on the render pool
+        page_rects = {page_num: doc.load_page(page_num).rect for page_num in page_nums if 0 <= page_num < len(doc)}
+
+    render_tasks = [] # (region ids, (pdf_path, page_num, clips)) per page
+    for page_num in page_nums:
+        page_regions = [region for region in regions if region["page"] == page_num]
+        if page_num not in page_rects:
+            for region in page_regions: results[region["id"]] = {"error": "Page number out of range"}
+            continue
+        region_ids, clips = [], []
+        for region in page_regions:
+            try:
+                clips.append(area_clip(page_rects[page_num], region["box"], render_dpi))
+                region_ids.append(region["id"])
+            except ValueError as ve:
+                results[region["id"]] = {"error": f"{ve}"}
+        if clips:
+            render_tasks.append((region_ids, (pdf_path, page_num, clips)))
+
+    page_pngs = map_on_render_pool(render_page_clips, [args for _, args in render_tasks], stage="area_render_pool")
+    crops = [crop for (region_ids, _), pngs in zip(render_tasks, page_pngs) for crop in zip(region_ids, pngs)] # (region id, PNG bytes)
+    print(f"Rendered {len(crops)} area(s) of doc {doc_id} for batched OCR")
+
+    texts = call_got_ocr_areas([png for _, png in crops], use_cache=use_cache, priority=priority, cancel=cancel)
+    for (region_id, _), text in zip(crops, texts):
+        if text is None or "Error:" in text:
+            results[region_id] = {"error": text or "GOT-OCR Area call failed"}
+        else:
+            results[region_id] = {"extracted_text": text}
+    return results
+
+def parse_tiling(data):
+    """Reads the optional tiling mode ("off", "grid", "blocks"). Raises ValueError for other values."""
+    tiling = str(data.get('tiling', ANALYZE_TILING) or "off").lower()
+    if tiling not in TILING_MODES:
+        raise ValueError(f"tiling must be one of: {', '.join(TILING_MODES)}")
+    return tiling
+
+def parse_analyze_options(data):
+    """
+    Reads the optional concurrency, page-skipping and tiling settings of the
+    document analysis endpoints. Raises ValueError for non-numeric values.
+    """
+    tiling = parse_tiling(data)
+    try:
+        return {
+            "tiling": tiling,
+            "max_in_flight": int(data.get('max_in_flight', ANALYZE_MAX_IN_FLIGHT)),
+            "page_timeout": float(data.get('page_timeout', REQUEST_TIMEOUT)),
+            "retries": int(data.get('retries', ANALYZE_PAGE_RETRIES)),
+            "use_cache": bool(data.get('use_cache', True)),
+            "skip_blank": bool(data.get('skip_blank', ANALYZE_SKIP_BLANK)),
+            "reuse_duplicates": bool(data.get('reuse_duplicates', ANALYZE_REUSE_DUPLICATES)),
+        }
+    except (TypeError, ValueError):
+        raise ValueError("max_in_flight, page_timeout and retries must be numbers")
+
+def open_document_analysis(pdf_path, page_count, data, analyze_options):
+    """
+    Opens the analysis manifest of a processed PDF for the request's
+    options, to be passed straight to iter_document_analysis (which
+    releases it). The optional 'force' param (default: on when use_cache is off)
+    discards the stored pages and analyzes the whole document again.
+    """
+    params = analysis_params(ANALYZE_DPI, analyze_options["tiling"], analyze_options["skip_blank"],
+                             analyze_options["reuse_duplicates"])
+    return open_manifest(pdf_path, page_count, params, reset=bool(data.get('force', not analyze_options["use_cache"])))
+
+def start_cancellable_request(data):
+    """
+    Creates the CancelToken of an analysis request: deadline from the
+    optional 'deadline' param (seconds, default ANALYZE_DEADLINE), registered
+    under the optional 'request_id' param (or a new id) so /cancel/<request_id>
+    can stop it. The caller discards it from active_requests when done.
+
+    Returns:
+        tuple: (request_id, CancelToken)
+
+    Raises:
+        ValueError: If deadline is not a number.
+    """
+    try:
+        deadline = float(data.get('deadline', ANALYZE_DEADLINE) or 0)
+    except (TypeError, ValueError):
+        raise ValueError("deadline must be a number of seconds")
+    request_id = secure_filename(str(data.get('request_id') or '')) or str(uuid.uuid4())
+    return request_id, active_requests.register(request_id, CancelToken(timeout=deadline or None))
+
+def cancelled_response(request_id, cancel, **partial):
+    """Error response of a cancelled analysis request: 504 past its deadline, 499 when cancelled."""
+    status = 504 if cancel.reason == "deadline exceeded" else STATUS_CLIENT_CLOSED
+    return jsonify({"error": f"Analysis {cancel.reason}", "request_id": request_id, **partial}), status
+
+def parse_list_param(value):
+    """Reads a list given as a JSON array, a JSON string of one, or a comma-separated string."""
+    if value is None or isinstance(value, list):
+        return value or []
+    value = str(value).strip()
+    if value.startswith('['):
+        return json.loads(value)
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+def parse_batch_areas(value):
+    """
+    Validates the areas of a batch: a list (or JSON string) of
+    {"page": int, "box": [x1,y1,x2,y2]} applied to every document.
+    Raises ValueError if malformed.
+    """
+    try:
+        areas = json.loads(value) if isinstance(value, str) else (value or [])
+        if not isinstance(areas, list): raise ValueError("areas must be a list")
+        return [{"page": int(area["page"]), "box": list(parse_box_coordinates(area["box"]))} for area in areas]
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError(f"Invalid areas: {e}")
+
+def batch_results_path(batch_id, doc_id):
+    """Path of the JSON file holding a batch document's GOT-OCR results."""
+    return os.path.join(BATCH_RESULTS_DIR, secure_filename(batch_id), f"{secure_filename(doc_id)}.json")
+
+def wait_for_processed_pdf(doc_id, cancel=None):
+    """
+    Blocks until doc_id's ocrmypdf job (or that of the identical upload it
+    was deduplicated against) has finished, and returns the processed PDF path.
+    Raises an exception if that job failed or was cancelled, or the PDF is
+    missing, and OperationCancelled if cancel is cancelled while waiting.
+    """
+    while True:
+        job = job_queue.get(doc_id)
+        if job is None:
+            origin_doc_id = doc_store.origin_doc_id(doc_id)
+            job = job_queue.get(origin_doc_id) if origin_doc_id else None
+        if job is None or job["status"] == STATUS_DONE:
+            break
+        if job["status"] in (STATUS_FAILED, STATUS_CANCELLED):
+            raise Exception(f"ocrmypdf {job['status']} for {doc_id}: {job['error']}")
+        if cancel is not None:
+            cancel.sleep(BATCH_POLL_INTERVAL)
+        else:
+            time.sleep(BATCH_POLL_INTERVAL)
+    pdf_path = get_processed_pdf_path(doc_id)
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"Processed PDF not found for {doc_id}")
+    return pdf_path
+
+def run_batch_analysis(job_id, doc_id, stages, areas, results_path):
+    """
+    Background job: runs the GOT-OCR stages of a batch document at batch
+    priority and writes the results to results_path as JSON. Format Text
+    pages go through the document's analysis manifest, so the job submitted
+    again after a restart (resume_interrupted_batch_analysis) only analyzes
+    the pages still missing or failed.
+    """
+    cancel = analysis_queue.cancel_token(job_id)
+    pdf_path = wait_for_processed_pdf(doc_id, cancel)
+    page_count = count_pdf_pages(pdf_path, doc_id)
+    if page_count is None: raise IOError("Could not open processed PDF")
+    analysis_queue.update(job_id, page_count=page_count)
+    results = {"doc_id": doc_id, "page_count": page_count}
+
+    if BATCH_STAGE_FORMAT in stages:
+        page_results, errors = {}, {}
+        skipped_pages = {"blank": [], "duplicates": {}}
+        stored_pages = 0 # Answered from the manifest of an earlier, interrupted run
+        manifest = open_manifest(pdf_path, page_count, analysis_params())
+        for page_result in iter_document_analysis(pdf_path, range(page_count), manifest, priority=PRIORITY_BATCH, cancel=cancel):
+            page_results[str(page_result["page"])] = page_result["formatted_text"]
+            if page_result["error"]:
+                errors[str(page_result["page"])] = page_result["error"]
+            if page_result["skipped"] == "blank":
+                skipped_pages["blank"].append(page_result["page"])
+            elif page_result["duplicate_of"] is not None:
+                skipped_pages["duplicates"][str(page_result["page"])] = page_result["duplicate_of"]
+            stored_pages += page_result["stored"]
+            analysis_queue.update(job_id, pages_done=len(page_results))
+        results["page_results"], results["errors"], results["skipped_pages"] = page_results, errors, skipped_pages
+        analysis_queue.update(job_id, error_pages=len(errors), stored_pages=stored_pages)
+
+    if BATCH_STAGE_AREAS in stages:
+        area_results = ocr_regions(doc_id, pdf_path, [{"id": index, **area} for index, area in enumerate(areas)],
+                                   priority=PRIORITY_BATCH, cancel=cancel)
+        results["areas"] = [{**area, **area_results[index]} for index, area in enumerate(areas)]
+
+    ensure_dir(os.path.dirname(results_path))
+    with open(f"{results_path}.tmp", "w", encoding="utf-8") as f_out:
+        json.dump(results, f_out)
+    os.replace(f"{results_path}.tmp", results_path)
+
+def submit_batch_analysis(batch_id, stages, areas, doc_id):
+    """Queues the GOT-OCR stages of one batch document. Failures are recorded on the analysis job."""
+    job_id = f"{batch_id}:{doc_id}"
+    try:
+        analysis_queue.submit(job_id, "batch_analysis", run_batch_analysis, doc_id, stages, areas,
+                              batch_results_path(batch_id, doc_id), priority=PRIORITY_BATCH)
+        # Enough to submit it again if the server restarts before it finishes
+        analysis_queue.update(job_id, batch_id=batch_id, doc_id=doc_id, stages=stages, areas=areas)
+    except QueueFullError as qe:
+        print(f"Could not queue batch analysis {job_id}: {qe}")
+        analysis_queue.add_record(job_id, "batch_analysis", status=STATUS_FAILED, reason=f"{qe}")
+
+def resume_interrupted_batch_analysis():
+    """
+    Submits the batch analysis jobs a previous server process left queued or
+    running again. Their Format Text pages resume from the analysis
+    manifest, so only pages that were not finished go to GOT-OCR.
+    """
+    for job in analysis_queue.interrupted:
+        meta = job["meta"]
+        if job["kind"] == "batch_analysis" and "stages" in meta:
+            print(f"Resuming batch analysis {job['job_id']} interrupted by the restart")
+            submit_batch_analysis(meta["batch_id"], meta["stages"], meta["areas"], meta["doc_id"])
+
+resume_interrupted_batch_analysis()
+
+# --- API Endpoints ---
+
+# --- Metrics ---
+@app.before_request
+def start_request_metrics():
+    """Starts the request's latency clock and its per-stage trace."""
+    g.metrics_started = time.perf_counter()
+    g.metrics_trace = metrics.start_trace()
+
+@app.teardown_request
+def discard_upload_spool_files(exc):
+    """Deletes the request's upload spool files that were not moved into place (a no-op for moved ones)."""
+    for spool_file in getattr(request, "spool_files", ()):
+        spool_file.discard()
+
+@app.after_request
+def record_request_metrics(response):
+    """
+    Records the request in the per-endpoint histogram and reports its stages
+    as a Server-Timing header. Streamed responses are measured up to the
+    first byte, since their body is generated after this hook runs.
+    """
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched' # Route rule, never the raw path
+    metrics.observe("http_request_duration_seconds", time.perf_counter() - started, endpoint=endpoint, method=request.method)
+    metrics.inc("http_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+    stages = metrics.end_trace(g.pop('metrics_trace'))
+    if stages:
+        response.headers['Server-Timing'] = ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages.items())
+    return response
+
+def collect_app_metrics():
+    """Reports queue depth, cache hit counts and GOT-OCR client state when /metrics is scraped."""
+    samples = []
+    for queue_name, queue in (("ocrmypdf", job_queue), ("batch_analyze", analysis_queue), ("renditions", rendition_queue)):
+        for priority in (PRIORITY_INTERACTIVE, PRIORITY_BATCH):
+            samples.append(("job_queue_pending", "gauge", {"queue": queue_name, "priority": PRIORITY_NAMES[priority]},
+                            queue.pending_count(priority)))
+    ocr_cache = get_ocr_result_cache()
+    for cache_name, stats in (("page_image", page_image_cache.stats()), ("doc_pool", doc_pool.stats()),
+                              ("ocr_result", ocr_cache.stats() if ocr_cache else None)):
+        if stats is None:
+            continue
+        samples.append(("cache_hits_total", "counter", {"cache": cache_name}, stats["hits"]))
+        samples.append(("cache_misses_total", "counter", {"cache": cache_name}, stats["misses"]))
+        lookups = stats["hits"] + stats["misses"]
+        samples.append(("cache_hit_ratio", "gauge", {"cache": cache_name}, stats["hits"] / lookups if lookups else None))
+    samples.append(("page_image_cache_bytes", "gauge", {"tier": "memory"}, page_image_cache.stats()["memory_bytes"]))
+    samples.append(("page_image_cache_bytes", "gauge", {"tier": "disk"}, page_image_cache.stats()["disk_bytes"]))
+    store_stats = doc_store.stats()
+    samples.append(("doc_store_bytes", "gauge", {}, store_stats["bytes"]))
+    samples.append(("doc_store_documents", "gauge", {}, store_stats["documents"]))
+    client = get_default_client()
+    slots = client.limiter.stats()
+    for priority_name in slots["active"]:
+        samples.append(("got_ocr_slots_active", "gauge", {"priority": priority_name}, slots["active"][priority_name]))
+        samples.append(("got_ocr_slots_waiting", "gauge", {"priority": priority_name}, slots["waiting"][priority_name]))
+    circuit = client.circuit_state()
+    samples.append(("got_ocr_circuit_open", "gauge", {}, circuit["state"] == "open"))
+    samples.append(("got_ocr_consecutive_failures", "gauge", {}, circuit["consecutive_failures"]))
+    return samples
+
+metrics.add_collector(collect_app_metrics)
+
+
+@app.route('/upload', methods=['POST'])
+def upload_and_process_ocrmypdf():
+    """
+    Accepts an upload and queues it for ocrmypdf processing (image
+    conversion, cleaning, deskewing, OCR). The 'file' field may hold one
+    PDF or one or more images (pages in upload order; multi-frame TIFFs
+    expand to several pages). Parts are streamed to disk and hashed as they
+    arrive. Returns the doc_id and input page count immediately; poll
+    /jobs/<doc_id> for progress.
+    """
+    # Refuse early rather than buffering an upload we cannot schedule
+    if job_queue.is_full(PRIORITY_INTERACTIVE):
+        return jsonify({"error": "Server busy, too many documents queued. Retry later."}), 503, {"Retry-After": "30"}
+
+    files = request.files.getlist('file')
+    try:
+        if not files:
+            return jsonify({"error": "No file part"}), 400
+        if any(f.filename == '' for f in files):
+            return jsonify({"error": "No selected file"}), 400
+        if not all(allowed_file(f.filename) for f in files):
+            return jsonify({"error": "File type not allowed"}), 400
+        file_exts = [os.path.splitext(secure_filename(f.filename))[1].lower() for f in files]
+        if ".pdf" in file_exts and len(files) > 1:
+            return jsonify({"error": "Upload a single PDF, or one or more images"}), 400
+
+        doc_id = str(uuid.uuid4())
+        with metrics.span("upload_store"):
+            input_paths, content_sha256 = store_upload_parts(doc_id, files)
+            input_page_count = count_input_pages(input_paths)
+    except Exception as e:
+        print(f"Error storing upload: {e}")
+        return jsonify({"error": f"Failed to store upload: {e}"}), 500
+    finally:
+        for f in files:
+            if isinstance(f.stream, HashingSpoolFile): f.stream.discard() # No-op for moved spool files
+
+    try:
+        registered = register_upload(doc_id, input_paths, content_sha256, input_page_count)
+    except QueueFullError as qe:
+        return jsonify({"error": f"Server busy: {qe}. Retry later."}), 503, {"Retry-After": "30"}
+    except RuntimeError as re_err:
+        return jsonify({"error": f"{re_err}"}), 503, {"Retry-After": "1"}
+    except Exception as e:
+        print(f"Error queueing upload for ocrmypdf processing: {e}")
+        return jsonify({"error": f"Processing failed: {e}"}), 500
+
+    if registered["deduplicated_from"]:
+        message = "Identical file already processed" if registered["status"] == STATUS_DONE else "Identical file is already being processed"
+    else:
+        message = "File accepted for ocrmypdf processing"
+    return jsonify({
+        "message": message,
+        "doc_id": doc_id,
+        "page_count": registered["page_count"],
+        "status": registered["status"],
+        "status_url": f"/jobs/{doc_id}",
+    }), 200 if registered["status"] == STATUS_DONE else 202
+
+
+@app.route('/jobs/<doc_id>', methods=['GET'])
+def get_job_status(doc_id):
+    """
+    Returns the processing status of an uploaded document. Duplicate uploads
+    still being processed report the status of the original upload's job.
+    """
+    safe_doc_id = secure_filename(doc_id)
+    job = job_queue.get(safe_doc_id)
+    if job is None:
+        origin_doc_id = doc_store.origin_doc_id(safe_doc_id)
+        job = job_queue.get(origin_doc_id) if origin_doc_id else None
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    job.pop("job_id")
+    job["doc_id"] = safe_doc_id
+    return jsonify(job), 200
+
+
+@app.route('/cancel/<work_id>', methods=['POST'])
+def cancel_work(work_id):
+    """
+    Cancels long-running work so its capacity goes to live users:
+    - an analysis request, by the request_id it reported (/analyze_page,
+      /analyze_document and its stream stop within seconds),
+    - a queued or running job: an upload's ocrmypdf run by doc_id (the
+      ocrmypdf processes are terminated), a batch analysis or rendition job
+      by its job id,
+    - a batch by batch_id: every document job of it.
+    Queued jobs are cancelled at once; running ones report "cancelling"
+    until they have stopped (poll /jobs/<doc_id>).
+    """
+    reason = "cancelled by client"
+    if active_requests.cancel(work_id, reason):
+        return jsonify({"id": work_id, "kind": "request", "status": "cancelling"}), 202
+
+    batch = job_queue.get(work_id)
+    if batch is not None and batch["kind"] == "batch":
+        cancelled = []
+        for entry in batch["meta"].get("documents", []):
+            for queue, job_id in ((job_queue, entry.get("doc_id")), (analysis_queue, entry.get("analysis_job"))):
+                if job_id and queue.cancel(job_id, reason):
+                    cancelled.append(job_id)
+        print(f"Batch {work_id} cancelled: {len(cancelled)} job(s) stopped")
+        return jsonify({"id": work_id, "kind": "batch", "status": "cancelling", "jobs": cancelled}), 202
+
+    for queue in (job_queue, analysis_queue, rendition_queue):
+        previous_status = queue.cancel(work_id, reason)
+        if previous_status:
+            status = STATUS_CANCELLED if previous_status == STATUS_QUEUED else "cancelling"
+            return jsonify({"id": work_id, "kind": "job", "status": status}), 200 if status == STATUS_CANCELLED else 202
+    return jsonify({"error": "No running request or active job with this id"}), 404
+
 
 @app.route('/processed_image/<doc_id>/page/<int:page_num>', methods=['GET'])
 def get_processed_pdf_page_image(doc_id, page_num):
-    """Opens the OCR'd PDF and returns the requested page as a PNG image."""
+    """
+    Returns the requested page of the OCR'd PDF as an image.
+    Optional query params: dpi (default EXTRACT_DPI), format (png|jpeg).
+    Renders are cached (memory + disk LRU) and sent with ETag/Last-Modified
+    so browsers can revalidate or skip the request entirely.
+    """
+    doc_id = secure_filename(doc_id)
     pdf_path = get_processed_pdf_path(doc_id)
     if not os.path.exists(pdf_path):
         return jsonify({"error": "Processed PDF not found"}), 404
 
-    doc = None
-    try:
-        doc = fitz.open(pdf_path)
-        if page_num < 0 or page_num >= len(doc):
+    dpi = request.args.get('dpi', EXTRACT_DPI, type=int)
+    if dpi < MIN_IMAGE_DPI or dpi > MAX_IMAGE_DPI:
+        return jsonify({"error": f"dpi must be between {MIN_IMAGE_DPI} and {MAX_IMAGE_DPI}"}), 400
+    img_format = request.args.get('format', 'png').lower()
+    if img_format == 'jpg': img_format = 'jpeg'
+    if img_format not in IMAGE_MIMETYPES:
+        return jsonify({"error": f"format must be one of {sorted(IMAGE_MIMETYPES)}"}), 400
+
+    return cached_page_image_response(
+        doc_id, pdf_path, page_num, (dpi, img_format), IMAGE_MIMETYPES[img_format],
+        lambda: run_on_render_pool(render_page_png, pdf_path, page_num, dpi, img_format, stage="page_render_pool"),
+    )
+
+
+@app.route('/page_image/<doc_id>/page/<int:page_num>/<size>', methods=['GET'])
+def get_page_rendition(doc_id, page_num, size):
+    """
+    Returns a page's thumbnail ("thumb") or viewer image ("viewer", at
+    EXTRACT_DPI so selection coordinates match) in RENDITION_FORMAT.
+    These are rendered in the background after ocrmypdf and served as
+    static files. Until they exist the page is rendered on demand (and
+    cached), and generation is queued for documents that have none yet.
+    """
+    doc_id = secure_filename(doc_id)
+    if size not in RENDITION_SIZES:
+        return jsonify({"error": f"size must be one of {', '.join(RENDITION_SIZES)}"}), 400
+    pdf_path = get_processed_pdf_path(doc_id)
+    if not os.path.exists(pdf_path):
+        return jsonify({"error": "Processed PDF not found"}), 404
+
+    manifest = load_manifest(pdf_path)
+    if manifest:
+        if page_num < 0 or page_num >= manifest["page_count"]:
             return jsonify({"error": "Page number out of range"}), 404
+        return send_file(os.path.abspath(rendition_path(pdf_path, page_num, size, manifest["format"])),
+                         mimetype=RENDITION_MIMETYPES[manifest["format"]], max_age=IMAGE_CACHE_MAX_AGE)
 
-        page = doc.load_page(page_num)
-        pix = page.get_pixmap(dpi=EXTRACT_DPI) # Use configured DPI for display
-        img_buffer = io.BytesIO(pix.tobytes("png")) # Directly convert to bytes
-        img_buffer.seek(0)
+    schedule_renditions(doc_id) # e.g. documents processed before renditions existed
+    return cached_page_image_response(
+        doc_id, pdf_path, page_num, (size, RENDITION_FORMAT), RENDITION_MIMETYPES[RENDITION_FORMAT],
+        lambda: run_on_render_pool(render_page_rendition, pdf_path, page_num, size, EXTRACT_DPI, stage="page_render_pool"),
+    )
 
-        return send_file(img_buffer, mimetype='image/png', as_attachment=False)
-    except Exception as e:
-        print(f"Error extracting page image {page_num} for doc {doc_id}: {e}")
-        return jsonify({"error": "Failed to extract page image"}), 500
-    finally:
-        if doc: doc.close()
+
+@app.route('/page_image/<doc_id>/page/<int:page_num>/tiles/<int:level>/<int:col>/<int:row>', methods=['GET'])
+def get_page_tile(doc_id, page_num, level, col, row):
+    """Returns one deep-zoom tile; levels and grid sizes are listed by /page_image/<doc_id>/manifest."""
+    doc_id = secure_filename(doc_id)
+    pdf_path = get_processed_pdf_path(doc_id)
+    manifest = load_manifest(pdf_path) if os.path.exists(pdf_path) else None
+    if manifest is None:
+        return jsonify({"error": "Tiles not available (yet)"}), 404
+    if page_num < 0 or page_num >= manifest["page_count"] or level < 0 or level >= len(manifest["tile_levels"]):
+        return jsonify({"error": "Tile not found"}), 404
+    cols, rows = manifest["pages"][page_num]["tiles"][level]
+    if not (0 <= col < cols and 0 <= row < rows):
+        return jsonify({"error": "Tile not found"}), 404
+    return send_file(os.path.abspath(tile_path(pdf_path, page_num, level, col, row, manifest["format"])),
+                     mimetype=RENDITION_MIMETYPES[manifest["format"]], max_age=IMAGE_CACHE_MAX_AGE)
+
+
+@app.route('/page_image/<doc_id>/manifest', methods=['GET'])
+def get_page_image_manifest(doc_id):
+    """
+    Describes the generated renditions: format, viewer size per page and
+    the tile grid (cols, rows) of every deep-zoom level.
+    """
+    doc_id = secure_filename(doc_id)
+    pdf_path = get_processed_pdf_path(doc_id)
+    if not os.path.exists(pdf_path):
+        return jsonify({"error": "Processed PDF not found"}), 404
+    manifest = load_manifest(pdf_path)
+    if manifest is None:
+        schedule_renditions(doc_id)
+        return jsonify({"error": "Renditions are being generated"}), 404, {"Retry-After": "5"}
+    return jsonify({k: v for k, v in manifest.items() if not k.startswith("source_")}), 200
 
 
 @app.route('/text/<doc_id>/page/<int:page_num>', methods=['GET'])
 def get_ocr_text(doc_id, page_num):
     """Extracts the text layer embedded by ocrmypdf."""
+    doc_id = secure_filename(doc_id)
     pdf_path = get_processed_pdf_path(doc_id)
     if not os.path.exists(pdf_path):
         return jsonify({"error": "Processed PDF not found"}), 404
 
-    doc = None
     try:
-        doc = fitz.open(pdf_path)
-        if page_num < 0 or page_num >= len(doc):
-            return jsonify({"error": "Page number out of range"}), 404
-
-        page = doc.load_page(page_num)
-        text = page.get_text("text") # Extract plain text layer
+        if text_index.is_current(pdf_path): # Extracted at ingest, no need to open the PDF
+            text = text_index.page_text(pdf_path, page_num)
+            if text is None:
+                return jsonify({"error": "Page number out of range"}), 404
+            return jsonify({"page_text": text}), 200
+
+        with doc_pool.checkout(doc_id, pdf_path) as doc:
+            if page_num < 0 or page_num >= len(doc):
+                return jsonify({"error": "Page number out of range"}), 404
+
+            page = doc.load_page(page_num)
+            text = page.get_text("text") # Extract plain text layer
         return jsonify({"page_text": text}), 200
     except Exception as e:
         print(f"Error extracting text for page {page_num} doc {doc_id}: {e}")
         return jsonify({"error": "Failed to extract text layer"}), 500
-    finally:
-         if doc: doc.close()
+
+
+@app.route('/text/<doc_id>', methods=['GET'])
+def get_document_text(doc_id):
+    """
+    Streams the whole text layer as NDJSON: a "start" record with the page
+    count, then one "page" record per page with its text, or with its word
+    boxes ([x0, y0, x1, y1, word, block, line, word_no] in PDF points) when
+    ?format=words. Served from the index built at ingest.
+    """
+    doc_id = secure_filename(doc_id)
+    text_format = request.args.get('format', 'text')
+    if text_format not in ('text', 'words'):
+        return jsonify({"error": "format must be text or words"}), 400
+    pdf_path = get_processed_pdf_path(doc_id)
+    if not os.path.exists(pdf_path):
+        return jsonify({"error": "Processed PDF not found"}), 404
+    try:
+        text_index.ensure(pdf_path) # Documents processed before the index existed
+    except Exception as e:
+        print(f"Error indexing text layer for doc {doc_id}: {e}")
+        return jsonify({"error": "Failed to extract text layer"}), 500
+
+    def generate():
+        yield json.dumps({"type": "start", "doc_id": doc_id, "page_count": text_index.page_count(pdf_path)}) + "\n"
+        for page in text_index.iter_pages(pdf_path, words=text_format == 'words'):
+            yield json.dumps({"type": "page", **page}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/search/<doc_id>', methods=['GET'])
+def search_document_text(doc_id):
+    """
+    Full-text search over a document's text layer. ?q= holds the terms
+    (all must be on the page; a trailing * matches a prefix), ?limit= caps
+    the pages returned, ?units=px returns boxes in viewer pixels
+    (EXTRACT_DPI) instead of PDF points.
+    """
+    doc_id = secure_filename(doc_id)
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing q"}), 400
+    limit = request.args.get('limit', 50, type=int)
+    units = request.args.get('units', 'pt')
+    if units not in ('pt', 'px'):
+        return jsonify({"error": "units must be pt or px"}), 400
+    pdf_path = get_processed_pdf_path(doc_id)
+    if not os.path.exists(pdf_path):
+        return jsonify({"error": "Processed PDF not found"}), 404
+
+    try:
+        started = time.time()
+        text_index.ensure(pdf_path)
+        hits = text_index.search(pdf_path, query, limit=max(1, min(limit, 500)))
+    except Exception as e:
+        print(f"Error searching doc {doc_id} for {query!r}: {e}")
+        return jsonify({"error": "Search failed"}), 500
+    if units == 'px':
+        scale = EXTRACT_DPI / 72
+        for hit in hits:
+            hit["boxes"] = [[round(v * scale) for v in box] for box in hit["boxes"]]
+    return jsonify({"query": query, "units": units, "hits": hits, "elapsed_ms": round((time.time() - started) * 1000, 2)}), 200
 
 
 @app.route('/analyze_page', methods=['POST'])
 def analyze_page_layout_got_ocr():
-    """Extracts page image from OCR'd PDF and sends to GOT-OCR Format task."""
+    """
+    Extracts page image from OCR'd PDF and sends to GOT-OCR Format task.
+    Optional JSON params: use_cache, tiling ("grid" or "blocks" OCR a dense
+    page in full-resolution tiles and stitch the text), deadline (seconds),
+    request_id (to stop it through /cancel/<request_id>).
+    The result is parsed into the document model once here: "tables" holds
+    the page's tables, and the page is stored in the document's analysis
+    manifest (for /tables and /export) when that was made with the same settings.
+    """
     data = request.get_json()
     if not data or 'doc_id' not in data or 'page_num' not in data: return jsonify({"error": "Missing params"}), 400
 
     doc_id = secure_filename(data['doc_id'])
     page_num = data['page_num'] # Keep as string for now, convert to int later
     pdf_path = get_processed_pdf_path(doc_id)
-    # Create a unique temp image path
-    temp_img_dir = os.path.join(TEMP_IMG_DIR, doc_id) # Subdir for temp images
-    ensure_dir(temp_img_dir)
-    temp_img_path = os.path.join(temp_img_dir, f"page{page_num}_analyze_{uuid.uuid4()}.png")
-    doc = None # Define outside try
 
     try:
         page_num_int = int(page_num) # Validate page number
@@ -233,24 +1068,29 @@ def analyze_page_layout_got_ocr():
 
     if not os.path.exists(pdf_path): return jsonify({"error": "Processed PDF not found"}), 404
 
+    request_id = cancel = None
     try:
-        # 1. Extract page image at suitable DPI for analysis (e.g., 300)
-        doc = fitz.open(pdf_path)
-        if page_num_int < 0 or page_num_int >= len(doc): raise ValueError("Page number out of range")
-        page = doc.load_page(page_num_int)
-        pix = page.get_pixmap(dpi=300) # Use 300 DPI for analysis? Adjust if needed
-        pix.save(temp_img_path) # Save temporarily for GOT-OCR call
-        doc.close(); doc = None # Close PDF now
-
-        # 2. Call GOT-OCR Format Text
-        formatted_text = call_got_ocr_format_text(temp_img_path)
-
-        if formatted_text is None or "Error:" in formatted_text:
-            # Return error but still attempt cleanup
-            return jsonify({"error": formatted_text or "GOT-OCR Format call failed"}), 500
-
-        return jsonify({"formatted_text": formatted_text}), 200
-
+        tiling = parse_tiling(data)
+        request_id, cancel = start_cancellable_request(data)
+        with doc_pool.checkout(doc_id, pdf_path) as doc: # Handle goes back to the pool before rendering
+            if page_num_int < 0 or page_num_int >= len(doc): raise ValueError("Page number out of range")
+            page_count = len(doc)
+
+        # Render the page (whole and preprocessed for the model, or in tiles) off the request thread and call GOT-OCR Format Text
+        page_result = analyze_page(pdf_path, page_num_int, ANALYZE_DPI, retries=0, use_cache=bool(data.get('use_cache', True)),
+                                   tiling=tiling, cancel=cancel)
+        if page_result["error"]:
+            return jsonify({"error": page_result["error"]}), 500
+
+        params = analysis_params(ANALYZE_DPI, tiling, ANALYZE_SKIP_BLANK, ANALYZE_REUSE_DUPLICATES)
+        entry = store_page_result(pdf_path, page_count, params, page_result)
+        blocks = entry["blocks"] if entry else parse_formatted_text(page_result["formatted_text"])
+        return jsonify({"formatted_text": page_result["formatted_text"], "tables": block_tables(blocks),
+                        "image": page_result["image"]}), 200
+
+    except OperationCancelled:
+        print(f"/analyze_page for doc {doc_id}, page {page_num} stopped: {cancel.reason}")
+        return cancelled_response(request_id, cancel)
     except ValueError as ve: # Catch page number range error specifically
          print(f"Value Error in /analyze_page: {ve}")
          return jsonify({"error": f"{ve}"}), 400
@@ -258,13 +1098,18 @@ def analyze_page_layout_got_ocr():
         print(f"Error in /analyze_page for doc {doc_id}, page {page_num}: {e}")
         return jsonify({"error": f"Internal error during page analysis: {e}"}), 500
     finally:
-        if doc: doc.close() # Ensure close if error happened before explicit close
-        cleanup_file(temp_img_path) # Clean up temp image
+        if request_id: active_requests.discard(request_id)
 
 
 @app.route('/ocr_area', methods=['POST'])
 def ocr_selected_area_got_ocr():
-    """Extracts page at correct DPI, crops based on coords, sends crop to GOT-OCR Box task."""
+    """
+    Rasterizes only the selected area of the page and sends it to GOT-OCR.
+    box_coordinates are pixels at EXTRACT_DPI (what the viewer displays);
+    they are mapped to PDF points and rendered as a clip rect. The render
+    DPI is taken from the optional render_dpi param, or picked so the
+    selection comes out around AREA_TARGET_LONG_EDGE pixels.
+    """
     data = request.get_json()
     if not data or 'doc_id' not in data or 'page_num' not in data or 'box_coordinates' not in data:
         return jsonify({"error": "Missing required parameters"}), 400
@@ -274,60 +1119,31 @@ def ocr_selected_area_got_ocr():
     box_coords_str = data['box_coordinates']
     pdf_path = get_processed_pdf_path(doc_id)
 
-    uuid_str = str(uuid.uuid4())
-    temp_img_dir = os.path.join(TEMP_IMG_DIR, doc_id) # Subdir for temp images
-    ensure_dir(temp_img_dir)
-    temp_full_img_path = os.path.join(temp_img_dir, f"page{page_num}_full_{uuid_str}.png")
-    temp_crop_img_path = os.path.join(temp_img_dir, f"page{page_num}_crop_{uuid_str}.png")
-
-    doc = None # Initialize doc outside try block for finally
     try:
         page_num_int = int(page_num)
-    except ValueError:
-        return jsonify({"error": "page_num must be an integer"}), 400
+        render_dpi = int(data['render_dpi']) if data.get('render_dpi') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "page_num and render_dpi must be integers"}), 400
+    if render_dpi is not None and not (MIN_IMAGE_DPI <= render_dpi <= MAX_IMAGE_DPI):
+        return jsonify({"error": f"render_dpi must be between {MIN_IMAGE_DPI} and {MAX_IMAGE_DPI}"}), 400
 
     if not os.path.exists(pdf_path): return jsonify({"error": "Processed PDF not found"}), 404
 
     try:
-        # 1. Extract full page image *** USING CONSISTENT DPI ***
-        doc = fitz.open(pdf_path) # Open PDF
-        if page_num_int < 0 or page_num_int >= len(doc): raise ValueError("Page number out of range")
-        page = doc.load_page(page_num_int)
-        # !!! USE EXTRACT_DPI (e.g., 200) TO MATCH FRONTEND !!!
-        pix = page.get_pixmap(dpi=EXTRACT_DPI)
-        # --- doc.close() MOVED TO FINALLY ---
-        pix.save(temp_full_img_path) # Save temporarily
-        print(f"Extracted page {page_num_int} at {EXTRACT_DPI} DPI for cropping.")
-
-        # 2. Parse coordinates
-        try:
-            import json
-            coords = json.loads(box_coords_str)
-            if not isinstance(coords, list) or len(coords) != 4: raise ValueError("Coords must be list of 4")
-            x1, y1, x2, y2 = map(int, coords)
-            print(f"Parsed coordinates: [{x1},{y1},{x2},{y2}]")
-        except Exception as e_parse:
-             raise ValueError(f"Invalid box_coordinates format: {box_coords_str}. Error: {e_parse}")
-
-        # 3. Load with OpenCV and Crop
-        img_full = cv2.imread(temp_full_img_path)
-        if img_full is None: raise IOError("Could not read temporary page image")
-        h_img, w_img = img_full.shape[:2]
-        print(f"Full image dimensions loaded by OpenCV: W={w_img}, H={h_img}")
-        # Clamp coordinates
-        x1_c, y1_c = max(0, x1), max(0, y1)
-        x2_c, y2_c = min(w_img, x2), min(h_img, y2)
-        print(f"Clamped coordinates: [{x1_c},{y1_c},{x2_c},{y2_c}]")
-        if x2_c <= x1_c or y2_c <= y1_c: raise ValueError("Invalid crop dimensions after clamping (width/height is zero or negative)")
-        cropped_img = img_full[y1_c:y2_c, x1_c:x2_c]
-        print(f"Cropped image dimensions: W={cropped_img.shape[1]}, H={cropped_img.shape[0]}")
-
-        # 4. Save cropped image temporarily
-        save_success = cv2.imwrite(temp_crop_img_path, cropped_img)
-        if not save_success: raise IOError("Could not save temporary cropped image")
-
-        # 5. Call GOT-OCR Area task (passing None for box_coordinates as image is cropped)
-        extracted_text = call_got_ocr_area(temp_crop_img_path, None)
+        # 1. Parse coordinates
+        x1, y1, x2, y2 = parse_box_coordinates(box_coords_str)
+        print(f"Parsed coordinates: [{x1},{y1},{x2},{y2}]")
+
+        # 2. Render just the selected region (on the render pool)
+        with doc_pool.checkout(doc_id, pdf_path) as doc: # Pooled handle, only for the page rect
+            if page_num_int < 0 or page_num_int >= len(doc): raise ValueError("Page number out of range")
+            page_rect = doc.load_page(page_num_int).rect
+        clip, used_dpi = area_clip(page_rect, (x1, y1, x2, y2), render_dpi)
+        png_bytes = run_on_render_pool(render_page_clips, pdf_path, page_num_int, [(clip, used_dpi)], stage="area_render_pool")[0]
+        print(f"Rendered area of page {page_num_int} at {used_dpi} DPI ({len(png_bytes)} bytes)")
+
+        # 3. Call GOT-OCR Area task with the in-memory clip (passing None for box_coordinates as image is cropped)
+        extracted_text = call_got_ocr_area(png_bytes, None, use_cache=bool(data.get('use_cache', True)))
 
         if extracted_text is None or "Error:" in extracted_text:
             # Check if it was the specific error we added in ocr.py for missing coords
@@ -350,23 +1166,75 @@ def ocr_selected_area_got_ocr():
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"Internal error during area OCR: {e}"}), 500
-    finally:
-        # --- ENSURE PDF IS CLOSED HERE ---
-        if doc:
-            try:
-                doc.close()
-                print(f"Closed PDF document handle for /ocr_area doc {doc_id}")
-            except Exception as close_err:
-                 print(f"Error closing PDF handle for /ocr_area doc {doc_id}: {close_err}")
-        # Clean up temporary image files regardless of success/failure
-        cleanup_file(temp_full_img_path)
-        cleanup_file(temp_crop_img_path)
+
+
+@app.route('/ocr_areas', methods=['POST'])
+def ocr_selected_areas_got_ocr():
+    """
+    Batched /ocr_area: OCRs many regions, possibly on several pages, in
+    one request.
+
+    JSON params: doc_id, regions: [{"id": ..., "page_num": n,
+    "box_coordinates": [x1,y1,x2,y2]}, ...] (id defaults to the list
+    index), optional render_dpi and use_cache. Each page is loaded and its
+    content interpreted once (a display list); every region is rasterized
+    from it as a clip at its own DPI. The crops go to GOT-OCR concurrently,
+    or in one multi-image request if GOT_OCR_MULTI_IMAGE is set.
+    Returns {"results": {id: {"extracted_text": ...} or {"error": ...}}}.
+    """
+    data = request.get_json()
+    if not data or 'doc_id' not in data or not isinstance(data.get('regions'), list) or not data['regions']:
+        return jsonify({"error": "Missing doc_id or regions"}), 400
+    if len(data['regions']) > MAX_AREAS_PER_REQUEST:
+        return jsonify({"error": f"At most {MAX_AREAS_PER_REQUEST} regions per request"}), 400
+
+    doc_id = secure_filename(data['doc_id'])
+    pdf_path = get_processed_pdf_path(doc_id)
+    try:
+        render_dpi = int(data['render_dpi']) if data.get('render_dpi') is not None else None
+        regions = []
+        for index, region in enumerate(data['regions']):
+            region_id = str(region.get('id', index))
+            regions.append({"id": region_id, "page": int(region['page_num']), "box": parse_box_coordinates(region['box_coordinates'])})
+    except (TypeError, KeyError, AttributeError, ValueError) as e:
+        return jsonify({"error": f"Each region needs page_num and box_coordinates: {e}"}), 400
+    if len({region["id"] for region in regions}) != len(regions):
+        return jsonify({"error": "Region ids must be unique"}), 400
+    if render_dpi is not None and not (MIN_IMAGE_DPI <= render_dpi <= MAX_IMAGE_DPI):
+        return jsonify({"error": f"render_dpi must be between {MIN_IMAGE_DPI} and {MAX_IMAGE_DPI}"}), 400
+
+    if not os.path.exists(pdf_path): return jsonify({"error": "Processed PDF not found"}), 404
+
+    try:
+        results = ocr_regions(doc_id, pdf_path, regions, render_dpi, use_cache=bool(data.get('use_cache', True)))
+    except Exception as e:
+        print(f"Error in /ocr_areas for doc {doc_id}: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"Internal error during area OCR: {e}"}), 500
+
+    errors = sum(1 for result in results.values() if "error" in result)
+    return jsonify({"results": results, "errors": errors}), 200
 
 
 @app.route('/analyze_document', methods=['POST'])
 def analyze_full_document():
     """
-    Iterates through pages, extracts image, calls GOT-OCR Format Text for layout analysis.
+    Calls GOT-OCR Format Text for layout analysis on every page. Pages are
+    rendered on a process pool and OCR'd concurrently (bounded by
+    max_in_flight); results are collected in page order. Blank pages are
+    skipped and repeated pages reuse the first occurrence's result; both are
+    listed in skipped_pages.
+    Every finished page is stored in the document's analysis manifest, so a
+    later request (after a cancellation, deadline or restart) only analyzes the
+    pages still missing, plus failed ones unless retry_failed is false;
+    stored_pages lists the pages answered from it. page_tables holds the
+    parsed tables of every page that has any.
+    Optional JSON params: max_in_flight, page_timeout, retries, use_cache,
+    skip_blank, reuse_duplicates, tiling, deadline (seconds), request_id,
+    retry_failed, force (analyze every page again).
+    POST /cancel/<request_id> (or the deadline) stops the page loop within
+    seconds; the pages finished by then are returned with a 499 (504).
     """
     data = request.get_json()
     if not data or 'doc_id' not in data: return jsonify({"error": "Missing doc_id"}), 400
@@ -374,56 +1242,435 @@ def analyze_full_document():
     pdf_path = get_processed_pdf_path(doc_id)
     if not os.path.exists(pdf_path): return jsonify({"error": "Processed PDF not found"}), 404
 
+    try:
+        analyze_options = parse_analyze_options(data)
+        request_id, cancel = start_cancellable_request(data)
+    except ValueError as ve:
+        return jsonify({"error": f"{ve}"}), 400
+
     results = {}
     errors = {}
-    page_count = 0
-    temp_img_dir = os.path.join(TEMP_IMG_DIR, doc_id, "analyze_doc") # Temp dir for this run
-    ensure_dir(temp_img_dir)
-    doc = None # Define outside loop for finally
 
     try:
-        doc = fitz.open(pdf_path)
-        page_count = len(doc)
-        print(f"Analyzing document {doc_id} with {page_count} pages...")
-
-        for page_num in range(page_count):
-            page_num_str = str(page_num)
-            temp_img_path = None # Reset for each page
-            print(f"  - Analyzing page {page_num + 1}/{page_count}...")
-            try:
-                page = doc.load_page(page_num)
-                pix = page.get_pixmap(dpi=300) # Use 300 DPI for analysis
-                temp_img_path = os.path.join(temp_img_dir, f"page_{page_num}.png")
-                pix.save(temp_img_path)
-
-                formatted_text = call_got_ocr_format_text(temp_img_path)
-
-                if formatted_text is None or "Error:" in formatted_text:
-                     errors[page_num_str] = formatted_text or "Unknown OCR error"
-                     results[page_num_str] = "" # Store empty string for failed pages
-                     print(f"    - Error analyzing page {page_num}: {errors[page_num_str]}")
-                else:
-                     results[page_num_str] = formatted_text
-                     print(f"    - Success analyzing page {page_num} (Length: {len(formatted_text)})")
-
-            except Exception as page_err:
-                errors[page_num_str] = f"Unexpected error processing page: {page_err}"
-                results[page_num_str] = ""
-                print(f"    - Unexpected error for page {page_num}: {page_err}")
-            finally:
-                 cleanup_file(temp_img_path) # Clean up this page's temp image
+        page_count = count_pdf_pages(pdf_path, doc_id)
+        if page_count is None: raise IOError("Could not open processed PDF")
+        print(f"Analyzing document {doc_id} with {page_count} pages ({analyze_options['max_in_flight']} in flight)...")
+
+        manifest = open_document_analysis(pdf_path, page_count, data, analyze_options)
+        image_bytes = {"sent": 0, "saved": 0}
+        skipped_pages = {"blank": [], "duplicates": {}} # duplicates: page -> page whose result was reused
+        stored_pages = []
+        page_tables = {}
+        for page_result in iter_document_analysis(pdf_path, range(page_count), manifest, retry_failed=bool(data.get('retry_failed', True)),
+                                                  cancel=cancel, **analyze_options):
+            page_num_str = str(page_result["page"])
+            results[page_num_str] = page_result["formatted_text"] # Empty string for failed pages
+            if page_result["skipped"] == "blank":
+                skipped_pages["blank"].append(page_result["page"])
+            elif page_result["duplicate_of"] is not None:
+                skipped_pages["duplicates"][page_num_str] = page_result["duplicate_of"]
+            tables = block_tables(page_result["blocks"])
+            if tables:
+                page_tables[page_num_str] = tables
+            if page_result["stored"]:
+                stored_pages.append(page_result["page"])
+            elif page_result["image"]:
+                image_bytes["sent"] += page_result["image"]["bytes"]
+                image_bytes["saved"] += page_result["image"]["bytes_saved"]
+            if page_result["error"]:
+                errors[page_num_str] = page_result["error"]
+                print(f"    - Error analyzing page {page_num_str}: {page_result['error']}")
+            else:
+                print(f"    - Success analyzing page {page_num_str} (Length: {len(page_result['formatted_text'])}, {page_result['elapsed']}s)")
 
         print(f"Finished analyzing document {doc_id}. Success pages: {len(results) - len(errors)}, Errors: {len(errors)}")
-        return jsonify({"page_results": results, "errors": errors}), 200
+        return jsonify({"page_results": results, "errors": errors, "image_bytes": image_bytes, "skipped_pages": skipped_pages,
+                        "page_tables": page_tables, "stored_pages": stored_pages, "request_id": request_id}), 200
 
+    except OperationCancelled:
+        print(f"Analysis of document {doc_id} stopped after {len(results)} page(s): {cancel.reason}")
+        return cancelled_response(request_id, cancel, page_results=results, errors=errors)
     except Exception as e:
         print(f"Error during full document analysis for doc {doc_id}: {e}")
         return jsonify({"error": "Failed to analyze document"}), 500
     finally:
-         if doc: doc.close()
-         # Clean up temp directory after loop (optional)
-         # import shutil
-         # shutil.rmtree(temp_img_dir, ignore_errors=True)
+        active_requests.discard(request_id)
+
+
+@app.route('/analyze_document/stream', methods=['POST'])
+def analyze_full_document_stream():
+    """
+    Streaming variant of /analyze_document. Emits NDJSON, one object per line:
+    a "start" record with the page count, one "page" record per page as soon
+    as it (and every page before it) is done, then a "done" summary.
+    Page records carry "skipped" / "duplicate_of" for pages answered
+    without GOT-OCR, and "stored": true when they come from the analysis
+    manifest of an earlier run (see /analyze_document; retry_failed and
+    force apply here too) and "tables" with the page's parsed tables.
+    Page results are written out and dropped, so
+    memory stays flat. When the client disconnects (tab closed, fetch aborted) the
+    analysis is cancelled; /cancel/<request_id> (request_id is in the
+    "start" record) or the deadline end the stream with a "cancelled" record.
+    """
+    data = request.get_json()
+    if not data or 'doc_id' not in data: return jsonify({"error": "Missing doc_id"}), 400
+    doc_id = secure_filename(data['doc_id'])
+    pdf_path = get_processed_pdf_path(doc_id)
+    if not os.path.exists(pdf_path): return jsonify({"error": "Processed PDF not found"}), 404
+    try:
+        analyze_options = parse_analyze_options(data)
+    except ValueError as ve:
+        return jsonify({"error": f"{ve}"}), 400
+
+    page_count = count_pdf_pages(pdf_path, doc_id)
+    if page_count is None: return jsonify({"error": "Failed to analyze document"}), 500
+    try:
+        request_id, cancel = start_cancellable_request(data)
+    except ValueError as ve:
+        return jsonify({"error": f"{ve}"}), 400
+
+    def generate():
+        error_pages = blank_pages = duplicate_pages = stored_pages = 0
+        try:
+            yield json.dumps({"type": "start", "doc_id": doc_id, "page_count": page_count, "request_id": request_id}) + "\n"
+            manifest = open_document_analysis(pdf_path, page_count, data, analyze_options) # Released by iter_document_analysis
+            for page_result in iter_document_analysis(pdf_path, range(page_count), manifest, retry_failed=bool(data.get('retry_failed', True)),
+                                                      cancel=cancel, **analyze_options):
+                if page_result["error"]:
+                    error_pages += 1
+                blank_pages += page_result["skipped"] == "blank"
+                duplicate_pages += page_result["duplicate_of"] is not None
+                stored_pages += page_result["stored"]
+                blocks = page_result.pop("blocks")
+                yield json.dumps({"type": "page", **page_result, "tables": block_tables(blocks)}) + "\n"
+        except OperationCancelled:
+            print(f"Streamed analysis of {doc_id} stopped: {cancel.reason}")
+            yield json.dumps({"type": "cancelled", "reason": cancel.reason}) + "\n"
+            return
+        except Exception as e:
+            print(f"Error during streamed document analysis for doc {doc_id}: {e}")
+            yield json.dumps({"type": "error", "error": f"Failed to analyze document: {e}"}) + "\n"
+            return
+        print(f"Finished streaming analysis of {doc_id}. Success pages: {page_count - error_pages}, Errors: {error_pages}")
+        yield json.dumps({"type": "done", "page_count": page_count, "error_pages": error_pages,
+                          "blank_pages": blank_pages, "duplicate_pages": duplicate_pages, "stored_pages": stored_pages}) + "\n"
+
+    def close():
+        # Runs when the response is closed: after the last record, or early when
+        # writing to a disconnected client failed. Either way nothing reads further pages.
+        cancel.cancel("client disconnected")
+        active_requests.discard(request_id)
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(close)
+    return response
+
+
+@app.route('/analysis/<doc_id>', methods=['GET'])
+def get_stored_analysis(doc_id):
+    """
+    Returns the Format Text results stored in the document's analysis
+    manifest, in the /analyze_document shape, without calling GOT-OCR: the
+    pages done so far, missing_pages still to analyze and the state of the
+    last run ("running", "finished" or "stopped"), plus page_tables.
+    """
+    doc_id = secure_filename(doc_id)
+    pdf_path = get_processed_pdf_path(doc_id)
+    if not os.path.exists(pdf_path): return jsonify({"error": "Processed PDF not found"}), 404
+    stored = load_analysis(pdf_path)
+    if stored is None: return jsonify({"error": "Document has not been analyzed"}), 404
+
+    page_count = stored["header"]["page_count"]
+    results, errors = {}, {}
+    skipped_pages = {"blank": [], "duplicates": {}}
+    page_tables = {}
+    for page_num, entry in sorted(stored["pages"].items()):
+        results[str(page_num)] = entry["formatted_text"]
+        tables = block_tables(entry["blocks"])
+        if tables:
+            page_tables[str(page_num)] = tables
+        if entry["status"] == PAGE_FAILED:
+            errors[str(page_num)] = entry["error"]
+        if entry["skipped"] == "blank":
+            skipped_pages["blank"].append(page_num)
+        elif entry["duplicate_of"] is not None:
+            skipped_pages["duplicates"][str(page_num)] = entry["duplicate_of"]
+    return jsonify({"doc_id": doc_id, "page_count": page_count, "page_results": results, "errors": errors,
+                    "skipped_pages": skipped_pages, "page_tables": page_tables, "missing_pages": [page for page in range(page_count) if page not in stored["pages"]],
+                    "params": stored["header"]["params"], "run": stored["run"]}), 200
+
+
+def load_stored_analysis(doc_id):
+    """
+    The stored analysis of a document for the model endpoints.
+
+    Returns:
+        tuple: (pdf_path, stored analysis, None), or (None, None, error response) if there is none.
+    """
+    pdf_path = get_processed_pdf_path(doc_id)
+    if not os.path.exists(pdf_path): return None, None, (jsonify({"error": "Processed PDF not found"}), 404)
+    stored = load_analysis(pdf_path)
+    if stored is None: return None, None, (jsonify({"error": "Document has not been analyzed"}), 404)
+    return pdf_path, stored, None
+
+@app.route('/tables/<doc_id>', methods=['GET'])
+def get_document_tables(doc_id):
+    """
+    Streams the tables parsed from a document's stored analysis, without
+    reparsing or calling GOT-OCR. ?format=json (default) emits NDJSON: a
+    "start" record, then one "table" record per table with page, index
+    (within the page), header and rows of {"text", "colspan", "rowspan"}
+    cells. ?format=csv emits one CSV; with ?page= and ?table= it is that
+    table alone, otherwise every row starts with its page and table index.
+    """
+    doc_id = secure_filename(doc_id)
+    table_format = request.args.get('format', 'json')
+    if table_format not in ('json', 'csv'):
+        return jsonify({"error": "format must be json or csv"}), 400
+    page_filter = request.args.get('page', type=int)
+    table_filter = request.args.get('table', type=int)
+    pdf_path, stored, error_response = load_stored_analysis(doc_id)
+    if error_response: return error_response
+
+    tables = [(page_num, index, table) for page_num, entry in sorted(stored["pages"].items())
+              if page_filter is None or page_num == page_filter
+              for index, table in enumerate(block_tables(entry["blocks"]))
+              if table_filter is None or index == table_filter]
+    if table_format == 'csv':
+        single = page_filter is not None and table_filter is not None
+        if single and not tables: return jsonify({"error": "Table not found"}), 404
+
+        def generate_csv():
+            if not single:
+                yield "page,table\n" # Leading columns; the table's own columns follow
+            for page_num, index, table in tables:
+                yield table_csv(table, () if single else (page_num, index))
+
+        filename = f"{doc_id}_tables.csv" if not single else f"{doc_id}_page_{page_filter}_table_{table_filter}.csv"
+        return Response(stream_with_context(generate_csv()), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment;filename={filename}'})
+
+    def generate():
+        yield json.dumps({"type": "start", "doc_id": doc_id, "page_count": stored["header"]["page_count"], "table_count": len(tables)}) + "\n"
+        for page_num, index, table in tables:
+            yield json.dumps({"type": "table", "page": page_num, "index": index, **{k: v for k, v in table.items() if k != "type"}}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/export/<doc_id>', methods=['GET'])
+def export_document(doc_id):
+    """
+    Exports a document's stored analysis. ?format=json (default) streams the
+    document model: {"doc_id", "page_count", "pages": [{"page", "blocks",
+    "error", "skipped", "duplicate_of"}, ...], "missing_pages"}.
+    ?format=pdf returns the processed PDF with each analyzed page's text
+    laid over it invisibly, so the export is searchable with GOT-OCR's
+    reading; it is generated on the render pool and reused until the
+    analysis changes. Pages never analyzed are exported as they are.
+    """
+    doc_id = secure_filename(doc_id)
+    export_format = request.args.get('format', 'json')
+    if export_format not in ('json', 'pdf'):
+        return jsonify({"error": "format must be json or pdf"}), 400
+    pdf_path, stored, error_response = load_stored_analysis(doc_id)
+    if error_response: return error_response
+
+    if export_format == 'pdf':
+        export_path = searchable_export_path(pdf_path)
+        try:
+            if not os.path.exists(export_path) or os.path.getmtime(export_path) < os.path.getmtime(manifest_path(pdf_path)):
+                page_texts = {page_num: blocks_text(entry["blocks"]) for page_num, entry in stored["pages"].items()}
+                run_on_render_pool(write_searchable_pdf, pdf_path, page_texts, f"{export_path}.tmp", stage="searchable_export", timeout=None)
+                os.replace(f"{export_path}.tmp", export_path)
+        except Exception as e:
+            print(f"Error exporting searchable PDF for doc {doc_id}: {e}")
+            cleanup_file(f"{export_path}.tmp")
+            return jsonify({"error": "Failed to export searchable PDF"}), 500
+        return send_file(os.path.abspath(export_path), mimetype='application/pdf', as_attachment=True,
+                         download_name=f"{doc_id}_searchable.pdf")
+
+    page_count = stored["header"]["page_count"]
+
+    def generate():
+        yield json.dumps({"doc_id": doc_id, "page_count": page_count})[:-1] + ', "pages": ['
+        for position, (page_num, entry) in enumerate(sorted(stored["pages"].items())):
+            page = {"page": page_num, "blocks": entry["blocks"], "error": entry["error"],
+                    "skipped": entry.get("skipped"), "duplicate_of": entry.get("duplicate_of")}
+            yield ("," if position else "") + json.dumps(page)
+        yield '], "missing_pages": ' + json.dumps([page for page in range(page_count) if page not in stored["pages"]]) + "}"
+
+    return Response(stream_with_context(generate()), mimetype='application/json',
+                    headers={'Content-Disposition': f'attachment;filename={doc_id}_document.json'})
+
+
+@app.route('/batches', methods=['POST'])
+def submit_batch():
+    """
+    Submits many documents at batch priority, so interactive requests are
+    scheduled ahead of them in both the ocrmypdf queue and the GOT-OCR
+    concurrency budget.
+
+    Multipart form (or JSON without files):
+        file: zero or more files, each one document (PDF or image).
+        doc_ids: already processed documents to include (JSON list or comma-separated).
+        pipeline: stages to run: "ocrmypdf" (always), "format" (GOT-OCR
+            Format Text on every page), "areas" (GOT-OCR on the given areas).
+        areas: [{"page": n, "box": [x1,y1,x2,y2]}, ...] for the "areas" stage,
+            box in viewer pixels at EXTRACT_DPI.
+
+    Returns the batch_id right away; poll /batches/<batch_id> for progress.
+    """
+    if job_queue.is_full(PRIORITY_BATCH):
+        return jsonify({"error": "Server busy, too many batch documents queued. Retry later."}), 503, {"Retry-After": "60"}
+
+    files = [] if request.is_json else request.files.getlist('file')
+    try:
+        data = request.get_json(silent=True) or request.form
+        try:
+            doc_ids = [secure_filename(str(d)) for d in parse_list_param(data.get('doc_ids'))]
+            stages = parse_list_param(data.get('pipeline')) or [BATCH_STAGE_OCRMYPDF]
+            areas = parse_batch_areas(data.get('areas'))
+        except ValueError as ve:
+            return jsonify({"error": f"{ve}"}), 400
+        if not files and not doc_ids:
+            return jsonify({"error": "Provide files and/or doc_ids"}), 400
+        if any(stage not in BATCH_STAGES for stage in stages):
+            return jsonify({"error": f"pipeline stages must be among {', '.join(BATCH_STAGES)}"}), 400
+        if BATCH_STAGE_AREAS in stages and not areas:
+            return jsonify({"error": "The areas stage needs a non-empty areas list"}), 400
+
+        batch_id = str(uuid.uuid4())
+        analyze = BATCH_STAGE_FORMAT in stages or BATCH_STAGE_AREAS in stages
+        on_done = functools.partial(submit_batch_analysis, batch_id, stages, areas) if analyze else None
+        documents = []
+
+        # --- New files: one document each, queued for ocrmypdf at batch priority ---
+        for f in files:
+            entry = {"source": f.filename}
+            if not f.filename or not allowed_file(f.filename):
+                entry["error"] = "File type not allowed"
+                documents.append(entry)
+                continue
+            doc_id = str(uuid.uuid4())
+            try:
+                input_paths, content_sha256 = store_upload_parts(doc_id, [f])
+                registered = register_upload(doc_id, input_paths, content_sha256, count_input_pages(input_paths),
+                                             priority=PRIORITY_BATCH, on_done=on_done)
+            except Exception as e:
+                print(f"Error queueing batch file {f.filename}: {e}")
+                entry["error"] = f"{e}"
+                documents.append(entry)
+                continue
+            entry["doc_id"] = doc_id
+            if on_done and registered["deduplicated_from"]: # No ocrmypdf job of ours to chain onto
+                on_done(doc_id)
+            documents.append(entry)
+    finally:
+        for f in files:
+            if isinstance(f.stream, HashingSpoolFile): f.stream.discard() # No-op for moved spool files
+
+    # --- Existing documents: only the GOT-OCR stages run ---
+    for doc_id in doc_ids:
+        entry = {"source": "doc_id", "doc_id": doc_id}
+        if job_queue.get(doc_id) is None and not os.path.exists(get_processed_pdf_path(doc_id)):
+            entry["error"] = "Document not found"
+            entry.pop("doc_id")
+        elif on_done:
+            on_done(doc_id)
+        documents.append(entry)
+
+    for entry in documents:
+        if analyze and entry.get("doc_id"): entry["analysis_job"] = f"{batch_id}:{entry['doc_id']}"
+    job_queue.add_record(batch_id, "batch", status=STATUS_RUNNING, pipeline=stages, areas=areas, documents=documents)
+    print(f"Batch {batch_id}: {len(documents)} document(s), pipeline {stages}")
+    return jsonify({
+        "batch_id": batch_id,
+        "documents": documents,
+        "status_url": f"/batches/{batch_id}",
+    }), 202
+
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    """
+    Reports the state of every document in a batch (ocrmypdf job and, if
+    requested, the GOT-OCR stage) plus overall counts.
+    """
+    batch = job_queue.get(secure_filename(batch_id))
+    if batch is None or batch["kind"] != "batch":
+        return jsonify({"error": "Batch not found"}), 404
+
+    counts = {STATUS_QUEUED: 0, STATUS_RUNNING: 0, STATUS_DONE: 0, STATUS_FAILED: 0, STATUS_CANCELLED: 0}
+    documents = []
+    for entry in batch["meta"].get("documents", []):
+        document = dict(entry)
+        if entry.get("error"):
+            document["status"] = STATUS_FAILED
+        else:
+            ocr_job = job_queue.get(entry["doc_id"])
+            if ocr_job is None:
+                origin_doc_id = doc_store.origin_doc_id(entry["doc_id"])
+                ocr_job = job_queue.get(origin_doc_id) if origin_doc_id else None
+            document["ocrmypdf"] = ocr_job["status"] if ocr_job else STATUS_DONE # No job: processed before jobs existed
+            document["status"] = document["ocrmypdf"]
+            if ocr_job and ocr_job["error"]: document["error"] = ocr_job["error"]
+            if entry.get("analysis_job") and document["status"] == STATUS_DONE:
+                analysis = analysis_queue.get(entry["analysis_job"])
+                # Not recorded yet: submitted right after ocrmypdf finishes
+                document["status"] = analysis["status"] if analysis else STATUS_QUEUED
+                if analysis:
+                    document["pages_done"] = analysis["pages_done"]
+                    document["page_count"] = analysis["page_count"]
+                    if analysis["error"] or analysis["meta"].get("reason"):
+                        document["error"] = analysis["error"] or analysis["meta"]["reason"]
+                if document["status"] == STATUS_DONE:
+                    document["results_url"] = f"/batches/{batch['job_id']}/results/{entry['doc_id']}"
+        counts[document["status"]] += 1
+        documents.append(document)
+
+    active = counts[STATUS_QUEUED] + counts[STATUS_RUNNING]
+    return jsonify({
+        "batch_id": batch["job_id"],
+        "status": STATUS_RUNNING if active else STATUS_DONE,
+        "pipeline": batch["meta"].get("pipeline"),
+        "counts": counts,
+        "documents": documents,
+    }), 200
+
+
+@app.route('/batches/<batch_id>/results/<doc_id>', methods=['GET'])
+def get_batch_results(batch_id, doc_id):
+    """Returns the GOT-OCR results (page_results/errors and/or areas) of one batch document."""
+    results_path = batch_results_path(batch_id, doc_id)
+    if not os.path.exists(results_path):
+        return jsonify({"error": "Results not found"}), 404
+    return send_file(os.path.abspath(results_path), mimetype='application/json')
+
+
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """Reports hit/miss counts of the page caches, the OCR result cache and document store usage."""
+    ocr_cache = get_ocr_result_cache()
+    return jsonify({
+        "page_image_cache": page_image_cache.stats(),
+        "doc_pool": doc_pool.stats(),
+        "doc_store": doc_store.stats(),
+        "text_index": text_index.stats(),
+        "ocr_result_cache": ocr_cache.stats() if ocr_cache else None,
+        "got_ocr_circuit": get_default_client().circuit_state(),
+        "got_ocr_slots": get_default_client().limiter.stats(),
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus text exposition: per-endpoint and per-stage latency
+    histograms, GOT-OCR attempt outcomes, queue depth and cache hit counts
+    (the /cache_stats numbers, as scrapeable series).
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/export_text', methods=['POST'])
@@ -446,4 +1693,5 @@ def export_text_file():
 
 # --- Run the App ---
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True) # Set debug=False for production
\ No newline at end of file
+    # Development server; for production run: gunicorn -c gunicorn.conf.py app:app
+    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,107 @@
+# bench/fake_got_ocr.py
+"""
+Local stand-in for the GOT-OCR service, for benchmarks.
+
+Speaks the /process contract utils/ocr.py parses: a multipart POST with
+one or more 'images' parts and a 'task' field, answered with
+{"result": [{"text": ...}, ...]} (one entry per image), plus
+"formatted_text" for the Format Text task. Latency, jitter and the share
+of 500 responses are configurable.
+
+    python bench/fake_got_ocr.py --port 3000 --latency-ms 300 --error-rate 0.02
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TASK_FIELD_RE = re.compile(rb'name="task"\r\n\r\n([^\r]*)')
+FORMATTED_SAMPLE = "# Heading\n\n| Item | Qty |\n|---|---|\n| Widget | 4 |\n\nBody text of the page."
+PLAIN_SAMPLE = "Sample extracted text"
+
+
+class FakeGotOcrServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer carrying the fake service's settings and request counters."""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=200.0, jitter_ms=50.0, error_rate=0.0):
+        super().__init__(address, FakeGotOcrHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.images = 0
+        self.errors = 0
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/process"
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "images": self.images, "errors": self.errors}
+
+
+class FakeGotOcrHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass # Keep benchmark output clean
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path != "/process":
+            self._send_json(404, {"error": "Not found"})
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        image_count = max(1, body.count(b'name="images"'))
+        task_match = TASK_FIELD_RE.search(body)
+        task = task_match.group(1).decode("utf-8", "replace") if task_match else ""
+
+        server = self.server
+        delay = max(0.0, random.gauss(server.latency_ms, server.jitter_ms)) / 1000
+        time.sleep(delay)
+        failed = random.random() < server.error_rate
+        with server.lock:
+            server.requests += 1
+            server.images += image_count
+            server.errors += failed
+        if failed:
+            self._send_json(500, {"error": "Injected failure"})
+            return
+
+        text = FORMATTED_SAMPLE if task == "Format Text OCR" else PLAIN_SAMPLE
+        response = {"result": [{"text": text} for _ in range(image_count)]}
+        if task == "Format Text OCR":
+            response["formatted_text"] = text
+        self._send_json(200, response)
+
+
+def start_fake_server(host="127.0.0.1", port=0, **settings):
+    """Starts the fake service on a background thread (port 0 picks a free port) and returns the server."""
+    server = FakeGotOcrServer((host, port), **settings)
+    threading.Thread(target=server.serve_forever, name="fake-got-ocr", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake GOT-OCR /process service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeGotOcrServer((args.host, args.port), args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"Fake GOT-OCR listening on {fake.url}")
+    fake.serve_forever()
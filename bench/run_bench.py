@@ -0,0 +1,322 @@
+# bench/run_bench.py
+"""
+Benchmarks app.py's endpoints against the local fake GOT-OCR service.
+
+Starts bench/fake_got_ocr.py and the Flask app in this process (inside a
+scratch working directory, so uploads, caches and SQLite files never
+touch the real ones), generates synthetic PDFs and page images, then
+drives /upload, /processed_image, /ocr_area and /analyze_document at each
+concurrency level. Writes one JSON report: p50/p95/p99 latency, requests
+and pages per second per scenario, the background jobs (ingest,
+renditions, batch analysis) that failed, and peak RSS of the process and
+its children.
+
+    python bench/run_bench.py --docs 4 --pages 20 --concurrency 1,4,8 --output bench.json
+
+The report goes to --output, or to stdout if it is not given; everything
+the app prints (and any child process writes to stdout) goes to stderr, so
+stdout holds nothing but the report.
+
+Synthetic PDFs carry a text layer, so ingest copies them without running
+ocrmypdf; pass --scanned to benchmark real OCR. Uploaded images have no
+text layer, so the upload_image scenario always runs ocrmypdf (needs
+ocrmypdf installed).
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Keep the real stdout for the report and point fd 1 at stderr before
+# anything else loads, so PyMuPDF's warnings, the app's print()s, its worker
+# threads and child processes all log there
+sys.stdout.flush()
+REPORT_FD = os.dup(sys.stdout.fileno())
+os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+import fitz # PyMuPDF - For generating synthetic documents
+import requests
+from werkzeug.serving import make_server
+
+from fake_got_ocr import start_fake_server
+
+JOB_POLL_INTERVAL = 0.2 # Seconds between /jobs polls while an upload is processed
+JOB_TIMEOUT = 900 # Seconds before an upload counts as failed
+DRAIN_TIMEOUT = 300 # Seconds to wait for background jobs before reporting them
+IMAGE_FORMATS = ("png", "jpg") # Cycled through by the upload_image scenario
+VIEW_DPI = 200 # Matches app.EXTRACT_DPI; area boxes are in these pixels
+
+_thread_state = threading.local()
+
+
+def session():
+    """One requests.Session per benchmark thread."""
+    if not hasattr(_thread_state, "session"):
+        _thread_state.session = requests.Session()
+    return _thread_state.session
+
+
+# --- Synthetic Documents ---
+def make_pdf(path, pages, scanned=False):
+    """
+    Writes a PDF with a few paragraphs and a small table per page. A random
+    nonce makes every file unique, so uploads are never deduplicated.
+    With scanned=True each page is flattened to an image (no text layer).
+    """
+    nonce = uuid.uuid4().hex
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page() # A4-ish default size
+        body = "\n".join(f"Line {line} of page {page_num + 1}: benchmark text {nonce[:8]} lorem ipsum dolor sit amet."
+                         for line in range(30))
+        page.insert_textbox(fitz.Rect(50, 50, 545, 560), body, fontsize=10)
+        for row in range(5):
+            for col in range(3):
+                cell = fitz.Rect(50 + col * 160, 600 + row * 30, 210 + col * 160, 630 + row * 30)
+                page.draw_rect(cell)
+                page.insert_textbox(cell + (4, 8, -4, -4), f"R{row}C{col} {random.randint(0, 999)}", fontsize=9)
+    if scanned:
+        flat = fitz.open()
+        for page in doc:
+            pix = page.get_pixmap(dpi=150)
+            flat_page = flat.new_page(width=page.rect.width, height=page.rect.height)
+            flat_page.insert_image(flat_page.rect, stream=pix.tobytes("png"))
+        doc.close()
+        doc = flat
+    doc.save(path)
+    doc.close()
+
+
+def make_image(path, scanned_dpi=150):
+    """Writes one synthetic page as an image; the format follows the path's extension."""
+    pdf_path = path + ".pdf"
+    make_pdf(pdf_path, 1)
+    with fitz.open(pdf_path) as doc:
+        doc[0].get_pixmap(dpi=scanned_dpi).save(path)
+    os.remove(pdf_path)
+
+
+# --- Measurement ---
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def run_scenario(func, items, concurrency):
+    """
+    Calls func(item) for every item on concurrency threads. func returns
+    (ok, pages). Returns the scenario's latency/throughput summary.
+    """
+    def timed(item):
+        started = time.perf_counter()
+        try:
+            ok, pages = func(item)
+        except Exception as e:
+            print(f"  request failed: {e}", file=sys.stderr)
+            ok, pages = False, 0
+        return ok, time.perf_counter() - started, pages
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(timed, items))
+    wall = time.perf_counter() - started
+    latencies = sorted(elapsed * 1000 for ok, elapsed, _ in outcomes if ok)
+    pages = sum(p for ok, _, p in outcomes if ok)
+    return {
+        "concurrency": concurrency,
+        "requests": len(outcomes),
+        "errors": sum(1 for ok, _, _ in outcomes if not ok),
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(len(outcomes) / wall, 2) if wall else None,
+        "pages_per_s": round(pages / wall, 2) if wall and pages else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def peak_rss_kb():
+    """Peak resident set size (KB on Linux) of this process and of its waited-for children."""
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+# --- Scenarios ---
+def upload_document(base_url, path, pages, mimetype="application/pdf", doc_ids=None):
+    """Uploads one file and waits for its job; latency is upload to done. Finished doc_ids go to doc_ids."""
+    with open(path, "rb") as f:
+        response = session().post(f"{base_url}/upload", files={"file": (os.path.basename(path), f, mimetype)})
+    if response.status_code not in (200, 202):
+        print(f"  upload rejected: {response.status_code} {response.text[:200]}", file=sys.stderr)
+        return False, 0
+    doc_id = response.json()["doc_id"]
+    deadline = time.time() + JOB_TIMEOUT
+    while time.time() < deadline:
+        job = session().get(f"{base_url}/jobs/{doc_id}").json()
+        if job.get("status") == "done":
+            (upload_document.doc_ids if doc_ids is None else doc_ids).append(doc_id)
+            return True, pages
+        if job.get("status") == "failed":
+            print(f"  job {doc_id} failed: {job.get('error')}", file=sys.stderr)
+            return False, 0
+        time.sleep(JOB_POLL_INTERVAL)
+    return False, 0
+upload_document.doc_ids = []
+
+
+def background_jobs(app_module):
+    """
+    Waits (up to DRAIN_TIMEOUT) for the app's job queues to go idle, then
+    returns each queue's job counts by kind and status and its failed jobs.
+    Renditions and batch analyses run after the request that queued them
+    has returned, so their failures never show up in a scenario's errors.
+    """
+    queues = (app_module.job_queue, app_module.rendition_queue, app_module.analysis_queue)
+    deadline = time.time() + DRAIN_TIMEOUT
+    while time.time() < deadline and any(queue.pending_count() for queue in queues):
+        time.sleep(JOB_POLL_INTERVAL)
+    summary = {}
+    for queue in queues:
+        counts = queue.status_counts()
+        summary[queue.name] = {
+            "jobs": counts,
+            "failed": sum(statuses.get("failed", 0) for statuses in counts.values()),
+            "still_pending": queue.pending_count(),
+            "failures": [{"job_id": job_id, "kind": kind, "error": error} for job_id, kind, error in queue.failed_jobs()],
+        }
+    return summary
+
+
+def write_report(report, report_fd, output_path):
+    """Writes the JSON report to output_path, or to the saved stdout (report_fd) if there is none."""
+    if output_path:
+        os.close(report_fd)
+        f_out = open(output_path, "w", encoding="utf-8")
+    else:
+        f_out = os.fdopen(report_fd, "w", encoding="utf-8")
+    with f_out:
+        f_out.write(json.dumps(report, indent=2) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OCR backend against a fake GOT-OCR service")
+    parser.add_argument("--docs", type=int, default=4, help="Documents uploaded per concurrency level")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per synthetic document")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per level for per-page scenarios")
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--scenarios", default="upload,upload_image,processed_image,ocr_area,analyze_document")
+    parser.add_argument("--scanned", action="store_true", help="Image-only PDFs, so ingest runs ocrmypdf")
+    parser.add_argument("--ocr-latency-ms", type=float, default=200.0)
+    parser.add_argument("--ocr-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--ocr-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Write the JSON report here instead of to stdout")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+
+    # --- Fake GOT-OCR + app in a scratch directory ---
+    fake = start_fake_server(latency_ms=args.ocr_latency_ms, jitter_ms=args.ocr_jitter_ms, error_rate=args.ocr_error_rate)
+    os.environ["GOT_OCR_SERVICE_URL"] = fake.url
+    os.environ.setdefault("OCR_CACHE_ENABLED", "0") # Measure the service path, not cache hits
+    output_path = os.path.abspath(args.output) if args.output else None
+    work_dir = tempfile.mkdtemp(prefix="got-ocr-bench-")
+    os.chdir(work_dir)
+    import app as app_module # Reads its configuration from the environment set above
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    print(f"Benchmarking {base_url} (fake GOT-OCR at {fake.url}, work dir {work_dir})", file=sys.stderr)
+
+    report = {
+        "config": {**vars(args), "concurrency": levels, "scenarios": scenarios},
+        "scenarios": {},
+    }
+
+    # --- Ingest (also produces the documents the other scenarios read) ---
+    for level in levels:
+        paths = []
+        for index in range(args.docs):
+            path = os.path.join(work_dir, f"bench_{level}_{index}.pdf")
+            make_pdf(path, args.pages, scanned=args.scanned)
+            paths.append(path)
+        if "upload" in scenarios or not upload_document.doc_ids:
+            result = run_scenario(lambda p: upload_document(base_url, p, args.pages), paths, level)
+            if "upload" in scenarios:
+                report["scenarios"][f"upload@{level}"] = result
+        if "upload_image" in scenarios:
+            images = []
+            for index in range(args.docs):
+                fmt = IMAGE_FORMATS[index % len(IMAGE_FORMATS)]
+                path = os.path.join(work_dir, f"bench_{level}_{index}.{fmt}")
+                make_image(path)
+                images.append((path, "image/png" if fmt == "png" else "image/jpeg"))
+            # Image documents stay out of upload_document.doc_ids: they have one page, not args.pages
+            report["scenarios"][f"upload_image@{level}"] = run_scenario(
+                lambda image: upload_document(base_url, image[0], 1, mimetype=image[1], doc_ids=[]), images, level)
+    doc_ids = upload_document.doc_ids
+    if not doc_ids:
+        report["error"] = "No document finished ingest; see stderr"
+        report["background_jobs"] = background_jobs(app_module)
+        report["failed_background_jobs"] = sum(queue["failed"] for queue in report["background_jobs"].values())
+        write_report(report, REPORT_FD, output_path)
+        return 1
+
+    # --- Per-page scenarios ---
+    for level_index, level in enumerate(levels):
+        targets = [(random.choice(doc_ids), random.randrange(args.pages)) for _ in range(args.requests)]
+        if "processed_image" in scenarios:
+            cold_dpi = 150 + level_index # A DPI no earlier level used, so the first pass misses the page cache
+            def get_image(target, dpi):
+                response = session().get(f"{base_url}/processed_image/{target[0]}/page/{target[1]}", params={"dpi": dpi})
+                return response.status_code == 200, 1
+            report["scenarios"][f"processed_image@{level}"] = run_scenario(lambda t: get_image(t, cold_dpi), targets, level)
+            report["scenarios"][f"processed_image_cached@{level}"] = run_scenario(lambda t: get_image(t, cold_dpi), targets, level)
+        if "ocr_area" in scenarios:
+            def ocr_area(target):
+                x1, y1 = random.randint(50, 900), random.randint(50, 1500)
+                box = [x1, y1, x1 + random.randint(100, 600), y1 + random.randint(40, 300)]
+                response = session().post(f"{base_url}/ocr_area", json={
+                    "doc_id": target[0], "page_num": target[1], "box_coordinates": json.dumps(box), "use_cache": False})
+                return response.status_code == 200, 1
+            report["scenarios"][f"ocr_area@{level}"] = run_scenario(ocr_area, targets, level)
+
+    # --- Whole-document analysis ---
+    if "analyze_document" in scenarios:
+        for level in levels:
+            def analyze(doc_id):
+                response = session().post(f"{base_url}/analyze_document", json={"doc_id": doc_id, "use_cache": False})
+                return response.status_code == 200, args.pages
+            report["scenarios"][f"analyze_document@{level}"] = run_scenario(analyze, doc_ids[:max(level, 1)], level)
+
+    report["background_jobs"] = background_jobs(app_module)
+    report["failed_background_jobs"] = sum(queue["failed"] for queue in report["background_jobs"].values())
+    report["fake_got_ocr"] = fake.stats()
+    report["peak_rss_kb"] = peak_rss_kb()
+    write_report(report, REPORT_FD, output_path)
+    server.shutdown()
+    fake.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+# gunicorn.conf.py
+"""
+Production serving for the Flask backend:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+One worker process serves requests on SERVER_THREADS threads. The job
+queues, caches, document store and GOT-OCR concurrency limiter live in
+that process, so it must stay a single process (a second worker would
+run its own queues and mark the first one's jobs failed on startup);
+on_starting refuses to start with more than one worker.
+CPU-bound work (rasterization, PNG encoding, ocrmypdf) runs in child
+processes: RENDER_WORKERS render processes and OCR_WORKERS ocrmypdf runs,
+so throughput scales with the core count. Request threads mostly wait on
+those processes and on GOT-OCR.
+
+On SIGTERM gunicorn stops accepting connections, lets in-flight requests
+finish, and worker_exit drains the job queues before the process exits.
+The master kills the worker graceful_timeout seconds after SIGTERM, so the
+drain gets SHUTDOWN_DRAIN_TIMEOUT or whatever is left of graceful_timeout
+(less DRAIN_KILL_MARGIN), whichever is shorter.
+"""
+import os
+import signal
+import time
+
+DRAIN_KILL_MARGIN = 10 # Seconds kept back from graceful_timeout to stop the render pool before SIGKILL
+_stop_requested_at = None # When the worker received SIGTERM
+
+bind = os.getenv("SERVER_BIND", "0.0.0.0:5001")
+workers = 1 # See above: shared in-process state, CPU work fans out to child processes
+worker_class = "gthread"
+threads = int(os.getenv("SERVER_THREADS", "16")) # Concurrent requests
+timeout = int(os.getenv("SERVER_TIMEOUT", "600")) # /analyze_document of a long document is one request
+graceful_timeout = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "300")) # In-flight requests plus the job drain
+keepalive = 5
+preload_app = False # Import the app (and start its queue threads) inside the worker, not before forking
+accesslog = os.getenv("SERVER_ACCESS_LOG") or None # e.g. "-" for stdout
+
+
+def on_starting(server):
+    """Refuses more than one worker (e.g. -w 4 or --workers on the command line)."""
+    if server.cfg.workers != 1:
+        raise RuntimeError(f"workers = {server.cfg.workers}: the job queues and caches are per-process state, "
+                           "run one worker and scale with SERVER_THREADS / RENDER_WORKERS / OCR_WORKERS")
+
+
+def post_worker_init(worker):
+    """Records when SIGTERM arrives, before gunicorn's own handler stops the worker."""
+    handle_exit = worker.handle_exit
+
+    def record_stop(sig, frame):
+        global _stop_requested_at
+        _stop_requested_at = time.time()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, record_stop)
+
+
+def worker_exit(server, worker):
+    """Drains queued and running jobs before the worker process exits, within what is left of graceful_timeout."""
+    import app # Already imported by the worker
+    timeout = app.SHUTDOWN_DRAIN_TIMEOUT
+    if _stop_requested_at is not None: # In-flight requests may have used up most of graceful_timeout
+        remaining = server.cfg.graceful_timeout - (time.time() - _stop_requested_at) - DRAIN_KILL_MARGIN
+        timeout = max(0.0, min(timeout, remaining))
+    app.shutdown_background_work(timeout)
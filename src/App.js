@@ -3,8 +3,8 @@ import PageThumbnails from './components/PageThumbnails';
 import ImageViewer from './components/ImageViewer';
 import ResultsPanel from './components/ResultsPanel';
 import LoadingSpinner from './components/LoadingSpinner';
-// Import analyzeDocument and getImageUrl
-import { getImageUrl, analyzeDocument } from './services/api'; // Removed unused uploadFile import here
+// Import analyzeDocumentStream and getImageUrl
+import { getImageUrl, analyzeDocumentStream } from './services/api'; // Removed unused uploadFile import here
 import './App.css';
 
 function App() {
@@ -15,6 +15,8 @@ function App() {
   const [isLoading, setIsLoading] = useState(false); // Global loading state
   // State to store results from full document analysis (GOT-OCR layout attempt)
   const [documentAnalysisResults, setDocumentAnalysisResults] = useState(null);
+  // True while the analysis stream is open (the global spinner clears after the first page)
+  const [isAnalyzingDocument, setIsAnalyzingDocument] = useState(false);
 
   // --- Callbacks ---
   const handleUploadSuccess = useCallback((data) => {
@@ -52,11 +54,20 @@ function App() {
     }
     setErrorMessage('');
     setIsLoading(true);
+    setIsAnalyzingDocument(true);
     setDocumentAnalysisResults(null);
     console.log(`App: Analyzing entire document layout: ${docInfo.doc_id}`);
 
     try {
-      const result = await analyzeDocument(docInfo.doc_id);
+      // Show each page as soon as it arrives instead of waiting for the whole document
+      const result = await analyzeDocumentStream(docInfo.doc_id, (pageRecord) => {
+        setDocumentAnalysisResults((prev) => ({
+          page_results: { ...(prev?.page_results || {}), [pageRecord.page]: pageRecord.formatted_text },
+          errors: pageRecord.error ? { ...(prev?.errors || {}), [pageRecord.page]: pageRecord.error } : (prev?.errors || {}),
+          page_tables: pageRecord.tables?.length ? { ...(prev?.page_tables || {}), [pageRecord.page]: pageRecord.tables } : (prev?.page_tables || {}),
+        }));
+        if (pageRecord.page === 0) setIsLoading(false); // First page is viewable, stop blocking the UI
+      });
       console.log("App: Document analysis result:", result);
       setDocumentAnalysisResults(result);
       if (result.errors && Object.keys(result.errors).length > 0) {
@@ -71,6 +82,7 @@ function App() {
       setDocumentAnalysisResults(null);
     } finally {
       setIsLoading(false);
+      setIsAnalyzingDocument(false);
     }
   }, [docInfo, handleError]);
 
@@ -87,10 +99,10 @@ function App() {
         {docInfo && docInfo.page_count > 0 && (
             <button
                 onClick={handleAnalyzeDocumentClick}
-                disabled={isLoading}
+                disabled={isLoading || isAnalyzingDocument}
                 className="analyze-doc-button"
             >
-                Analyze Entire Document Layout (GOT-OCR)
+                {isAnalyzingDocument ? 'Analyzing Document...' : 'Analyze Entire Document Layout (GOT-OCR)'}
             </button>
         )}
       </header>
@@ -29,7 +29,13 @@ const FileUploadArea = ({ onUploadSuccess, onError, setIsLoading }) => {
     setLocalLoadingMessage(`Processing ${file.name}...`); // Show message in the box
 
     try {
-      const result = await uploadFile(file);
+      const result = await uploadFile(file, (job) => {
+        if (job.status === 'queued') {
+          setLocalLoadingMessage(`${file.name}: queued...`);
+        } else if (job.page_count) {
+          setLocalLoadingMessage(`${file.name}: page ${job.pages_done}/${job.page_count}...`);
+        }
+      });
       onUploadSuccess(result); // Pass result up to App
     } catch (error) {
       onError(error.message || "An unknown error occurred during upload.");
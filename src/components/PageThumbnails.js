@@ -1,5 +1,5 @@
 import React from 'react';
-import { getImageUrl } from '../services/api'; // getImageUrl now needs docId, pageNum
+import { getThumbnailUrl } from '../services/api'; // Small pre-rendered page images
 import FileUploadArea from './FileUploadArea';
 import './PageThumbnails.css'; // Make sure this file exists or remove import
 
@@ -35,8 +35,8 @@ const PageThumbnails = ({
               >
                 <img
                   className="thumbnail-image"
-                   // Call getImageUrl with docId and page index
-                  src={getImageUrl(docId, index)}
+                   // Thumbnail size (a few KB) instead of the full viewer image
+                  src={getThumbnailUrl(docId, index)}
                   alt={`Thumbnail of Page ${index + 1}`}
                   loading="lazy"
                 />
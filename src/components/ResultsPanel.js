@@ -1,8 +1,8 @@
 // src/components/ResultsPanel.js
 import React, { useState, useEffect } from 'react';
 // Import Latex parser and API functions
-import { ocrArea, exportText, analyzePage, getOcrText } from '../services/api';
-import { parseLatexTables, tableObjectToHtml } from '../utils/parsing'; // Use Latex parser
+import { ocrArea, exportText, analyzePage, getDocumentText } from '../services/api';
+import { parseLatexTables, modelTableToObject, tableObjectToHtml } from '../utils/parsing'; // Latex parser as a fallback for server tables
 import LoadingSpinner from './LoadingSpinner';
 import './ResultsPanel.css'; // Ensure this file exists
 
@@ -14,6 +14,7 @@ const ResultsPanel = ({ docId, currentPageNum, selectedAreaCoords, fullDocumentR
     // State for Automatic Page Analysis results (GOT-OCR Format - Raw LaTeX/Markdown)
     const [analysisResultRaw, setAnalysisResultRaw] = useState('');
     const [detectedTables, setDetectedTables] = useState([]); // Parsed tables from Full Page Analysis
+    const [serverTables, setServerTables] = useState(null); // Tables the backend parsed for the raw result (null: parse here)
     const [isAnalyzingPage, setIsAnalyzingPage] = useState(false);
 
     // State for OCR Layer Text (ocrmypdf)
@@ -35,6 +36,7 @@ const ResultsPanel = ({ docId, currentPageNum, selectedAreaCoords, fullDocumentR
         // Clear analysis display if full doc results aren't available for the new context
         if (!fullDocumentResults?.page_results?.hasOwnProperty(currentPageNum?.toString())) {
              setAnalysisResultRaw('');
+             setServerTables(null);
              setDetectedTables([]); // Clear parsed tables too
         }
     }, [currentPageNum, docId, fullDocumentResults]);
@@ -46,6 +48,7 @@ const ResultsPanel = ({ docId, currentPageNum, selectedAreaCoords, fullDocumentR
             const pageKey = currentPageNum?.toString();
             if (pageKey !== undefined && fullDocumentResults.page_results.hasOwnProperty(pageKey)) {
                 // console.log(`ResultsPanel Effect 2: Loading analysis result for page ${pageKey} from full doc.`); // Optional log
+                setServerTables(fullDocumentResults.page_tables ? (fullDocumentResults.page_tables[pageKey] || []) : null);
                 setAnalysisResultRaw(fullDocumentResults.page_results[pageKey] || '');
                 // Optionally handle errors specific to this page from fullDocumentResults.errors
             } else {
@@ -64,9 +67,8 @@ const ResultsPanel = ({ docId, currentPageNum, selectedAreaCoords, fullDocumentR
     useEffect(() => {
       // Run parsing whenever the raw analysis text changes
       if (analysisResultRaw) {
-        console.log("ResultsPanel: Raw analysis result updated, attempting to parse LaTeX tables...");
-        // *** Use the LaTeX parser ***
-        const tables = parseLatexTables(analysisResultRaw);
+        // Tables parsed by the backend when the result arrived; older responses without them are parsed here
+        const tables = serverTables ? serverTables.map(modelTableToObject) : parseLatexTables(analysisResultRaw);
         setDetectedTables(tables); // Update state with parsed tables (empty array if none found)
         if (tables.length === 0) {
             console.log("ResultsPanel: No tables found in parsed LaTeX output.");
@@ -77,7 +79,7 @@ const ResultsPanel = ({ docId, currentPageNum, selectedAreaCoords, fullDocumentR
         // If raw result is cleared, clear the parsed tables too
         setDetectedTables([]);
       }
-    }, [analysisResultRaw]); // Dependency: Run only when raw analysis text changes
+    }, [analysisResultRaw, serverTables]); // Dependency: Run only when the raw analysis text or its tables change
 
 
     // --- Action Handlers ---
@@ -122,6 +124,7 @@ const ResultsPanel = ({ docId, currentPageNum, selectedAreaCoords, fullDocumentR
         console.log(`ResultsPanel: Calling analyzePage (microservice GOT-OCR) for Doc: ${docId}, Page: ${currentPageNum}`);
         try {
             const result = await analyzePage(docId, currentPageNum);
+            setServerTables(result.tables || null);
             setAnalysisResultRaw(result.formatted_text || ''); // Update raw text -> triggers Effect 3
         } catch (err) {
             setError(err.message || "Failed to analyze page layout.");
@@ -152,10 +155,10 @@ const ResultsPanel = ({ docId, currentPageNum, selectedAreaCoords, fullDocumentR
          setAnalysisResultRaw(''); // Clear layout analysis when showing plain text
          setDetectedTables([]); // Clear parsed tables too
          setIsLoadingOcrLayer(true);
-         console.log(`ResultsPanel: Calling getOcrText for Doc: ${docId}, Page: ${currentPageNum}`);
+         console.log(`ResultsPanel: Loading text layer for Doc: ${docId}, Page: ${currentPageNum}`);
          try {
-            const result = await getOcrText(docId, currentPageNum);
-            setOcrLayerText(result.page_text || ''); // Update state with ocrmypdf text
+            const pages = await getDocumentText(docId); // Whole document once, later pages come from the cache
+            setOcrLayerText(pages[currentPageNum] || ''); // Update state with ocrmypdf text
          } catch (err) {
              setError(err.message || "Failed to fetch OCR layer text.");
              setOcrLayerText('');
@@ -1,13 +1,31 @@
 // src/services/api.js
 const API_BASE_URL = "http://localhost:5001"; // Your backend URL
 
-export const uploadFile = async (file) => {
+const JOB_POLL_INTERVAL_MS = 1500;
+
+export const getJobStatus = async (docId) => {
+  const response = await fetch(`${API_BASE_URL}/jobs/${docId}`, { method: 'GET' });
+  if (!response.ok) { const err = await response.json(); throw new Error(err.error || response.statusText); }
+  return await response.json(); // Expects { doc_id, status, page_count, pages_done, error }
+};
+
+// Uploads the file (or an array of image files, one page each), then polls the
+// background ocrmypdf job until it finishes.
+// onProgress (optional) receives each job status record while waiting.
+export const uploadFile = async (file, onProgress) => {
   const formData = new FormData();
-  formData.append('file', file);
+  (Array.isArray(file) ? file : [file]).forEach((f) => formData.append('file', f));
   try {
     const response = await fetch(`${API_BASE_URL}/upload`, { method: 'POST', body: formData });
     if (!response.ok) { const err = await response.json(); throw new Error(err.error || `Upload failed: ${response.statusText}`); }
-    return await response.json(); // Expects { doc_id, page_count }
+    const { doc_id } = await response.json(); // Expects { doc_id, page_count, status, status_url }
+    while (true) {
+      const job = await getJobStatus(doc_id);
+      if (onProgress) onProgress(job);
+      if (job.status === 'done') return { doc_id, page_count: job.page_count };
+      if (job.status === 'failed' || job.status === 'cancelled') throw new Error(job.error || `Processing ${job.status}`);
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
   } catch (error) { console.error("Upload Error:", error); throw error; }
 };
 
@@ -22,13 +40,18 @@ export const ocrArea = async (docId, pageNum, boxCoordinates) => {
   } catch (error) { console.error("OCR Area Error:", error); throw error; }
 };
 
-// --- UPDATED: getImageUrl constructs URL dynamically ---
+// --- Page images: pre-rendered at ingest (WebP/JPEG), rendered on the fly only until ready ---
 export const getImageUrl = (docId, pageNum) => {
     if (!docId || pageNum === null || pageNum === undefined) return '';
-    // URL points to the backend endpoint that extracts the image on the fly
-    return `${API_BASE_URL}/processed_image/${docId}/page/${pageNum}`;
+    // Viewer size is rendered at the server's EXTRACT_DPI, so selection coordinates stay in that space
+    return `${API_BASE_URL}/page_image/${docId}/page/${pageNum}/viewer`;
 };
-// --- END UPDATED ---
+
+export const getThumbnailUrl = (docId, pageNum) => {
+    if (!docId || pageNum === null || pageNum === undefined) return '';
+    return `${API_BASE_URL}/page_image/${docId}/page/${pageNum}/thumb`;
+};
+// --- END Page images ---
 
 export const analyzePage = async (docId, pageNum) => {
   try {
@@ -37,7 +60,7 @@ export const analyzePage = async (docId, pageNum) => {
       body: JSON.stringify({ doc_id: docId, page_num: pageNum }),
     });
     if (!response.ok) { const err = await response.json(); throw new Error(err.error || response.statusText); }
-    return await response.json(); // Expects { formatted_text }
+    return await response.json(); // Expects { formatted_text, tables }
   } catch (error) { console.error("Analyze Page Error:", error); throw error; }
 };
 
@@ -48,10 +71,82 @@ export const analyzeDocument = async (docId) => {
       body: JSON.stringify({ doc_id: docId }),
     });
     if (!response.ok) { const err = await response.json(); throw new Error(err.error || response.statusText); }
-    return await response.json(); // Expects { page_results: {...}, errors: {...} }
+    return await response.json(); // Expects { page_results: {...}, errors: {...}, page_tables: {...} }
   } catch (error) { console.error("Analyze Document Error:", error); throw error; }
 };
 
+// Tables parsed on the server from the stored analysis, as CSV (one table, or all of them with page/table columns)
+export const getTablesCsvUrl = (docId, pageNum, tableIndex) => {
+  const params = pageNum !== undefined && tableIndex !== undefined ? `&page=${pageNum}&table=${tableIndex}` : '';
+  return `${API_BASE_URL}/tables/${docId}?format=csv${params}`;
+};
+
+// Whole-document export of the stored analysis: 'json' (document model) or 'pdf' (searchable PDF)
+export const getExportUrl = (docId, format = 'json') => `${API_BASE_URL}/export/${docId}?format=${format}`;
+
+// Format Text results already stored for a document (null if it was never analyzed).
+// Pages in missing_pages are analyzed by the next analyzeDocument(Stream) call.
+export const getStoredAnalysis = async (docId) => {
+  const response = await fetch(`${API_BASE_URL}/analysis/${docId}`, { method: 'GET' });
+  if (response.status === 404) return null;
+  if (!response.ok) { const err = await response.json(); throw new Error(err.error || response.statusText); }
+  return await response.json(); // Expects { page_results, errors, skipped_pages, missing_pages, run }
+};
+
+// Stops an analysis request (by its request_id), an upload's processing (by doc_id) or a batch.
+export const cancelWork = async (id) => {
+  const response = await fetch(`${API_BASE_URL}/cancel/${encodeURIComponent(id)}`, { method: 'POST' });
+  if (!response.ok && response.status !== 404) { const err = await response.json(); throw new Error(err.error || response.statusText); }
+  return response.ok;
+};
+
+// Reads an NDJSON response body, calling handleRecord for each line as it arrives
+const readNdjson = async (response, handleRecord) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+    const lines = buffered.split('\n');
+    buffered = lines.pop(); // Keep the trailing partial line
+    lines.filter(line => line.trim()).forEach(line => handleRecord(JSON.parse(line)));
+  }
+  if (buffered.trim()) handleRecord(JSON.parse(buffered));
+};
+
+// Streams per-page layout results (NDJSON) as they finish.
+// onPage receives each { page, formatted_text, error, attempts, elapsed } record.
+// Resolves with the final { page_results: {...}, errors: {...}, page_tables: {...} } once the stream ends.
+// Aborting signal (an AbortSignal) closes the stream, which stops the analysis on the server.
+export const analyzeDocumentStream = async (docId, onPage, signal) => {
+  const pageResults = {};
+  const errors = {};
+  const pageTables = {};
+  const handleRecord = (record) => {
+    if (record.type === 'page') {
+      pageResults[record.page] = record.formatted_text;
+      if (record.error) errors[record.page] = record.error;
+      if (record.tables && record.tables.length > 0) pageTables[record.page] = record.tables;
+      if (onPage) onPage(record);
+    } else if (record.type === 'error') {
+      throw new Error(record.error);
+    } else if (record.type === 'cancelled') {
+      throw new Error(`Analysis ${record.reason}`);
+    }
+  };
+  try {
+    const response = await fetch(`${API_BASE_URL}/analyze_document/stream`, {
+      method: 'POST', headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ doc_id: docId }), signal,
+    });
+    if (!response.ok) { const err = await response.json(); throw new Error(err.error || response.statusText); }
+    await readNdjson(response, handleRecord);
+    return { page_results: pageResults, errors, page_tables: pageTables };
+  } catch (error) { console.error("Analyze Document Stream Error:", error); throw error; }
+};
+
 export const exportText = async (textContent, filename = 'exported_text.txt') => {
   try {
     const response = await fetch(`${API_BASE_URL}/export_text`, {
@@ -84,4 +179,32 @@ export const getOcrText = async (docId, pageNum) => {
         throw error;
     }
 };
-// --- END NEW FUNCTION ---
\ No newline at end of file
+// --- END NEW FUNCTION ---
+
+// --- Whole-document text layer (one streamed request, cached per document) ---
+const documentTextCache = new Map(); // docId -> Promise of { [page]: text }
+
+export const getDocumentText = (docId) => {
+    if (!documentTextCache.has(docId)) {
+        const load = (async () => {
+            const response = await fetch(`${API_BASE_URL}/text/${docId}`);
+            if (!response.ok) { const err = await response.json(); throw new Error(err.error || response.statusText); }
+            const pages = {};
+            await readNdjson(response, (record) => { if (record.type === 'page') pages[record.page] = record.text; });
+            return pages;
+        })();
+        load.catch(() => documentTextCache.delete(docId)); // Retry on the next call
+        documentTextCache.set(docId, load);
+    }
+    return documentTextCache.get(docId);
+};
+
+// Returns { hits: [{ page, snippet, boxes }] }; boxes in viewer pixels
+export const searchDocument = async (docId, query, limit = 50) => {
+    try {
+        const params = new URLSearchParams({ q: query, limit: String(limit), units: 'px' });
+        const response = await fetch(`${API_BASE_URL}/search/${docId}?${params}`);
+        if (!response.ok) { const err = await response.json(); throw new Error(err.error || response.statusText); }
+        return await response.json();
+    } catch (error) { console.error("Search Error:", error); throw error; }
+};
\ No newline at end of file
@@ -116,6 +116,19 @@ export const parseLatexTables = (latexString) => {
   return tables;
 };
 
+/**
+ * Converts a table of the server's document model ({ header, rows } of
+ * { text, colspan, rowspan } cells, parsed once when the OCR result arrived)
+ * into the table object used by tableObjectToHtml.
+ *
+ * @param {object} table Table block from /analyze_page, /analyze_document or /tables
+ * @returns {object} Table object { header: [], rows: [[]] }
+ */
+export const modelTableToObject = (table) => {
+    const cellTexts = (row) => row.flatMap(cell => [cell.text, ...Array(Math.max(0, cell.colspan - 1)).fill('')]);
+    return { header: cellTexts(table.header || []), rows: (table.rows || []).map(cellTexts) };
+};
+
 /**
  * Converts a parsed table object (from LaTeX or Markdown) into an HTML string.
  *
@@ -0,0 +1,103 @@
+# tests/test_analysis.py
+import json
+
+import pytest
+
+analysis = pytest.importorskip("utils.analysis") # Needs PyMuPDF, numpy, OpenCV and requests
+
+PARAMS = {"dpi": 300, "tiling": "off"}
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "doc_ocr.pdf"
+    path.write_bytes(b"%PDF-1.4 test") # Only its mtime and size are read
+    return str(path)
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    """Replaces GOT-OCR analysis with canned results and records the pages it was asked for."""
+    requested = []
+
+    def fake_iter_analyzed_pages(pdf_path, page_nums, **kwargs):
+        page_nums = list(page_nums)
+        requested.append(page_nums)
+        for page_num in page_nums:
+            yield {"page": page_num, "formatted_text": f"# Page {page_num}", "error": None, "attempts": 1,
+                   "elapsed": 0.0, "skipped": None, "duplicate_of": None}
+
+    monkeypatch.setattr(analysis, "iter_analyzed_pages", fake_iter_analyzed_pages)
+    return requested
+
+
+def page_result(page_num, error=None):
+    return {"page": page_num, "formatted_text": "" if error else f"text {page_num}", "error": error, "attempts": 1,
+            "elapsed": 0.0, "skipped": None, "duplicate_of": None}
+
+
+def test_truncated_last_line_is_ignored(pdf_path):
+    manifest = analysis.open_manifest(pdf_path, 3, PARAMS)
+    manifest.record(page_result(0))
+    manifest.record(page_result(1))
+    analysis.release_manifest(manifest)
+    with open(analysis.manifest_path(pdf_path), "a", encoding="utf-8") as f_out:
+        f_out.write(json.dumps({"type": "page", **page_result(2)})[:25]) # Killed mid-write
+
+    reopened = analysis.AnalysisManifest(pdf_path, 3, PARAMS)
+    assert sorted(reopened.pages) == [0, 1]
+    assert reopened.pages[0]["blocks"] == [{"type": "paragraph", "text": "text 0"}]
+    assert reopened.needs_analysis(2)
+
+
+def test_latest_line_of_a_page_wins_and_failed_pages_are_retried(pdf_path):
+    manifest = analysis.open_manifest(pdf_path, 2, PARAMS)
+    manifest.record(page_result(0, error="timeout"))
+    manifest.record(page_result(1, error="timeout"))
+    manifest.record(page_result(1))
+    analysis.release_manifest(manifest)
+
+    reopened = analysis.AnalysisManifest(pdf_path, 2, PARAMS)
+    assert reopened.pages[1]["status"] == analysis.PAGE_DONE
+    assert reopened.needs_analysis(0) and not reopened.needs_analysis(0, retry_failed=False)
+    assert reopened.summary()["pages_failed"] == 1
+
+
+def test_other_params_start_over(pdf_path):
+    manifest = analysis.open_manifest(pdf_path, 1, PARAMS)
+    manifest.record(page_result(0))
+    analysis.release_manifest(manifest)
+    assert analysis.AnalysisManifest(pdf_path, 1, {**PARAMS, "dpi": 200}).pages == {}
+
+
+def test_interrupted_run_resumes_from_stored_pages(pdf_path, analyzed):
+    first = analysis.iter_document_analysis(pdf_path, range(4), analysis.open_manifest(pdf_path, 4, PARAMS))
+    assert [next(first)["page"] for _ in range(2)] == [0, 1]
+    first.close() # Consumer went away (cancel, deadline, disconnect)
+
+    stored = analysis.load_analysis(pdf_path)
+    assert sorted(stored["pages"]) == [0, 1]
+    assert stored["run"]["state"] == analysis.RUN_STOPPED
+
+    results = list(analysis.iter_document_analysis(pdf_path, range(4), analysis.open_manifest(pdf_path, 4, PARAMS)))
+    assert analyzed == [[0, 1, 2, 3], [2, 3]] # Second run only analyzes what is missing
+    assert [(result["page"], result["stored"]) for result in results] == [(0, True), (1, True), (2, False), (3, False)]
+    assert results[2]["blocks"] == [{"type": "heading", "level": 1, "text": "Page 2"}]
+    assert analysis.load_analysis(pdf_path)["run"]["state"] == analysis.RUN_FINISHED
+
+
+def test_manifests_are_only_kept_while_a_run_holds_them(pdf_path, analyzed):
+    manifest = analysis.open_manifest(pdf_path, 2, PARAMS)
+    assert analysis.analysis_in_use(pdf_path)
+    list(analysis.iter_document_analysis(pdf_path, range(2), manifest))
+    assert not analysis.analysis_in_use(pdf_path)
+
+
+def test_a_failing_run_start_still_releases_the_manifest(pdf_path, analyzed, monkeypatch):
+    manifest = analysis.open_manifest(pdf_path, 2, PARAMS)
+    def failing_start_run(page_nums):
+        raise OSError("disk full")
+    monkeypatch.setattr(manifest, "start_run", failing_start_run)
+    with pytest.raises(OSError):
+        list(analysis.iter_document_analysis(pdf_path, range(2), manifest))
+    assert not analysis.analysis_in_use(pdf_path)
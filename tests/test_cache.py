@@ -0,0 +1,48 @@
+# tests/test_cache.py
+import pytest
+
+cache = pytest.importorskip("utils.cache") # Needs werkzeug
+from utils.cache import OCRResultCache
+
+
+def stored_bytes(ocr_cache):
+    return ocr_cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_results").fetchone()[0]
+
+
+def test_running_total_follows_puts_replacements_and_evictions(tmp_path):
+    ocr_cache = OCRResultCache(str(tmp_path / "ocr.sqlite3"), max_bytes=25, ttl_seconds=3600)
+    ocr_cache.put("a", "x" * 10)
+    ocr_cache.put("b", "y" * 10)
+    ocr_cache.put("a", "z" * 5) # Replaces a, freeing 5 bytes
+    assert ocr_cache.stats()["bytes"] == stored_bytes(ocr_cache) == 15
+    ocr_cache.get("a") # b is now the least recently read
+    ocr_cache.put("c", "w" * 12)
+    assert ocr_cache.get("b") is None
+    assert ocr_cache.get("a") == "z" * 5
+    assert ocr_cache.stats()["bytes"] == stored_bytes(ocr_cache) == 17
+
+
+def test_total_is_seeded_from_the_database_and_expired_rows_are_swept(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "ocr.sqlite3")
+    OCRResultCache(db_path, max_bytes=1000, ttl_seconds=3600).put("old", "x" * 10)
+    assert OCRResultCache(db_path, max_bytes=1000, ttl_seconds=3600).stats()["bytes"] == 10
+
+    now = cache.time.time()
+    monkeypatch.setattr(cache.time, "time", lambda: now + 7200)
+    ocr_cache = OCRResultCache(db_path, max_bytes=1000, ttl_seconds=3600, sweep_seconds=600)
+    assert ocr_cache.stats() == {"hits": 0, "misses": 0, "entries": 0, "bytes": 0}
+
+
+def test_sweeps_run_at_most_every_sweep_seconds(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: clock[0])
+    ocr_cache = OCRResultCache(str(tmp_path / "ocr.sqlite3"), max_bytes=1000, ttl_seconds=100, sweep_seconds=500)
+    ocr_cache.put("a", "x" * 10)
+    clock[0] += 200 # a has expired, but the next sweep is not due yet
+    ocr_cache.put("b", "y" * 10)
+    assert ocr_cache.stats()["entries"] == 2
+    assert ocr_cache.get("a") is None # Never served once expired
+    clock[0] += 400
+    ocr_cache.put("c", "z" * 10) # Sweeps b
+    assert ocr_cache.stats()["entries"] == 1
+    assert ocr_cache.stats()["bytes"] == stored_bytes(ocr_cache) == 10
@@ -0,0 +1,77 @@
+# tests/test_docmodel.py
+import pytest
+
+pytest.importorskip("utils.docmodel") # Needs PyMuPDF
+from utils.docmodel import parse_formatted_text, block_tables, table_grid, table_csv, blocks_text
+
+MARKDOWN = """# Results
+
+Measured values are below.
+
+- first item
+- second item
+
+| Name | Value |
+|------|-------|
+| a | 1 |
+| b \\| c | 2 |
+
+$$
+E = mc^2
+$$
+"""
+
+LATEX = r"""\section{Scores}
+\begin{tabular}{|l|c|c|}
+\hline
+\multicolumn{2}{c}{\textbf{Group}} & Total \\
+\hline
+A & 1 & 2 \\
+\multirow{2}{*}{B} & 3 & 4 \\
+ & 5 & 6 \\
+\end{tabular}
+After the table."""
+
+
+def cells(*texts):
+    return [{"text": text, "colspan": 1, "rowspan": 1} for text in texts]
+
+
+def test_markdown_blocks_in_reading_order():
+    blocks = parse_formatted_text(MARKDOWN)
+    assert [block["type"] for block in blocks] == ["heading", "paragraph", "list", "table", "math"]
+    assert blocks[0] == {"type": "heading", "level": 1, "text": "Results"}
+    assert blocks[2]["items"] == ["first item", "second item"]
+    assert blocks[3]["header"] == cells("Name", "Value")
+    assert blocks[3]["rows"] == [cells("a", "1"), cells("b | c", "2")] # Escaped pipe stays in the cell
+    assert blocks[4]["text"] == "$$\nE = mc^2\n$$"
+
+
+def test_latex_tabular_spans_and_styles():
+    blocks = parse_formatted_text(LATEX)
+    assert [block["type"] for block in blocks] == ["heading", "table", "paragraph"]
+    table = blocks[1]
+    assert table["format"] == "latex"
+    assert table["header"] == [{"text": "Group", "colspan": 2, "rowspan": 1}, *cells("Total")]
+    assert table["rows"][1][0] == {"text": "B", "colspan": 1, "rowspan": 2}
+
+
+def test_table_grid_expands_colspans_only():
+    table = block_tables(parse_formatted_text(LATEX))[0]
+    # The row under the multirow already holds an empty cell in the source
+    assert table_grid(table) == [["Group", "", "Total"], ["A", "1", "2"], ["B", "3", "4"], ["", "5", "6"]]
+
+
+def test_table_grid_pads_short_rows():
+    table = {"header": cells("a", "b", "c"), "rows": [cells("1")]}
+    assert table_grid(table) == [["a", "b", "c"], ["1", "", ""]]
+
+
+def test_table_csv_prefixes_every_row():
+    table = block_tables(parse_formatted_text(LATEX))[0]
+    assert table_csv(table, prefix=(3, 0)).splitlines() == ["3,0,Group,,Total", "3,0,A,1,2", "3,0,B,3,4", "3,0,,5,6"]
+
+
+def test_blocks_text_and_empty_input():
+    assert blocks_text(parse_formatted_text(LATEX)) == "Scores\n\nGroup\t\tTotal\nA\t1\t2\nB\t3\t4\n\t5\t6\n\nAfter the table."
+    assert parse_formatted_text("") == [] and parse_formatted_text(None) == []
@@ -0,0 +1,29 @@
+# tests/test_ingest.py
+import pytest
+
+ingest = pytest.importorskip("utils.ingest") # Needs PyMuPDF and img2pdf
+from utils.ingest import ocrmypdf_args, plan_page_ranges
+
+
+def test_plan_page_ranges_picks_a_mode_per_range():
+    assert plan_page_ranges([True, True, False, False, True, False], 2) == [
+        {"start": 0, "end": 2, "mode": "skip"},
+        {"start": 2, "end": 4, "mode": "full"},
+        {"start": 4, "end": 6, "mode": "mixed"},
+    ]
+
+
+@pytest.mark.parametrize("redo_existing", [False, True])
+def test_full_ranges_always_skip_text(monkeypatch, redo_existing):
+    monkeypatch.setattr(ingest, "OCR_REDO_EXISTING", redo_existing)
+    args = ocrmypdf_args("full", 2)
+    assert "--skip-text" in args and "--deskew" in args and "--redo-ocr" not in args
+
+
+def test_mixed_ranges_redo_ocr_only_when_configured(monkeypatch):
+    monkeypatch.setattr(ingest, "OCR_REDO_EXISTING", False)
+    assert "--skip-text" in ocrmypdf_args("mixed", 2)
+    monkeypatch.setattr(ingest, "OCR_REDO_EXISTING", True)
+    args = ocrmypdf_args("mixed", 2)
+    assert "--redo-ocr" in args and "--skip-text" not in args and "--deskew" not in args
+    assert args[:4] == ["--output-type", "pdf", "--jobs", "2"]
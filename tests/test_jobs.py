@@ -0,0 +1,149 @@
+# tests/test_jobs.py
+import threading
+
+import pytest
+
+from utils.cancel import OperationCancelled
+from utils.jobs import (JobQueue, QueueFullError, PRIORITY_INTERACTIVE, PRIORITY_BATCH,
+                        STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED, STATUS_QUEUED, STATUS_RUNNING)
+
+WAIT = 5 # Seconds a test waits for a worker before failing
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / "jobs.sqlite3"), max_workers=1, reserved_workers=0, name="test-job")
+    yield queue
+    queue.shutdown(wait=True, timeout=WAIT)
+
+
+def blocker(queue):
+    """Submits a job that holds the only worker until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+
+    def hold(job_id):
+        started.set()
+        release.wait(WAIT)
+
+    queue.submit("blocker", "test", hold)
+    assert started.wait(WAIT)
+    return release
+
+
+def wait_for_status(queue, job_id, status):
+    for _ in range(int(WAIT / 0.01)):
+        if queue.get(job_id)["status"] == status:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError(f"{job_id} is {queue.get(job_id)['status']}, expected {status}")
+
+
+def test_interactive_jobs_start_before_batch_jobs(queue):
+    release = blocker(queue)
+    order = []
+    queue.submit("batch-1", "test", lambda job_id: order.append(job_id), priority=PRIORITY_BATCH)
+    queue.submit("batch-2", "test", lambda job_id: order.append(job_id), priority=PRIORITY_BATCH)
+    queue.submit("interactive", "test", lambda job_id: order.append(job_id), priority=PRIORITY_INTERACTIVE)
+    release.set()
+    wait_for_status(queue, "batch-2", STATUS_DONE)
+    assert order == ["interactive", "batch-1", "batch-2"]
+
+
+def test_failed_job_records_the_error(queue):
+    def fail(job_id):
+        raise ValueError("bad page")
+
+    queue.submit("failing", "test", fail)
+    wait_for_status(queue, "failing", STATUS_FAILED)
+    assert queue.get("failing")["error"] == "bad page"
+
+
+def test_full_queue_refuses_submissions(tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / "jobs.sqlite3"), max_workers=1, max_pending=2, reserved_workers=0)
+    release = blocker(queue)
+    queue.submit("queued", "test", lambda job_id: None)
+    assert queue.is_full(PRIORITY_INTERACTIVE)
+    with pytest.raises(QueueFullError):
+        queue.submit("refused", "test", lambda job_id: None)
+    release.set()
+    assert queue.shutdown(wait=True, timeout=WAIT)
+
+
+def test_cancel_queued_job_runs_cleanup_instead_of_the_job(queue):
+    release = blocker(queue)
+    ran, cleaned = [], []
+    queue.submit("queued", "test", lambda job_id: ran.append(job_id), on_cancel=cleaned.append)
+    assert queue.cancel("queued", "user cancelled") == STATUS_QUEUED
+    release.set()
+    wait_for_status(queue, "blocker", STATUS_DONE)
+    assert ran == []
+    assert cleaned == ["queued"]
+    job = queue.get("queued")
+    assert job["status"] == STATUS_CANCELLED and job["error"] == "user cancelled"
+    assert queue.pending_count() == 0
+
+
+def test_cancel_running_job_stops_it_through_its_token(queue):
+    started = threading.Event()
+
+    def work(job_id):
+        started.set()
+        queue.cancel_token(job_id).sleep(WAIT) # Raises OperationCancelled once cancelled
+
+    queue.submit("running", "test", work)
+    assert started.wait(WAIT)
+    assert queue.cancel("running") == STATUS_RUNNING
+    wait_for_status(queue, "running", STATUS_CANCELLED)
+    assert queue.cancel("running") is None # No longer active
+
+
+def test_restart_marks_active_jobs_failed_and_lists_them(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    first = JobQueue(db_path=db_path, max_workers=1, reserved_workers=0)
+    release = blocker(first)
+    first.submit("queued", "batch_analysis", lambda job_id: None, priority=PRIORITY_BATCH)
+    first.update("queued", doc_id="doc-1")
+
+    second = JobQueue(db_path=db_path, max_workers=1, reserved_workers=0) # As if the first process had died
+    try:
+        interrupted = {job["job_id"]: job for job in second.interrupted}
+        assert set(interrupted) == {"blocker", "queued"}
+        assert interrupted["queued"]["meta"]["doc_id"] == "doc-1"
+        assert second.get("queued")["status"] == STATUS_FAILED
+    finally:
+        release.set()
+        first.shutdown(wait=True, timeout=WAIT)
+        second.shutdown(wait=True, timeout=WAIT)
+
+
+def test_cancel_token_sleep_raises_when_cancelled(queue):
+    release = blocker(queue)
+    token = queue.cancel_token("blocker")
+    token.cancel("stop")
+    with pytest.raises(OperationCancelled):
+        token.sleep(WAIT)
+    release.set()
+
+
+def test_queues_sharing_a_database_only_sweep_their_own_jobs(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    uploads = JobQueue(db_path=db_path, max_workers=1, reserved_workers=0, name="uploads")
+    analyses = JobQueue(db_path=db_path, max_workers=1, reserved_workers=0, name="analyses")
+    releases = [blocker(uploads)]
+    analyses_started, analyses_release = threading.Event(), threading.Event()
+    analyses.submit("b1:d1", "batch_analysis", lambda job_id: (analyses_started.set(), analyses_release.wait(WAIT)))
+    assert analyses_started.wait(WAIT)
+    releases.append(analyses_release)
+
+    # A restarted process builds its queues in the same order
+    uploads_after = JobQueue(db_path=db_path, max_workers=1, reserved_workers=0, name="uploads")
+    analyses_after = JobQueue(db_path=db_path, max_workers=1, reserved_workers=0, name="analyses")
+    try:
+        assert [job["job_id"] for job in uploads_after.interrupted] == ["blocker"]
+        assert [job["job_id"] for job in analyses_after.interrupted] == ["b1:d1"]
+        assert analyses_after.get("b1:d1")["status"] == STATUS_FAILED
+    finally:
+        for release in releases:
+            release.set()
+        for queue in (uploads, analyses, uploads_after, analyses_after):
+            queue.shutdown(wait=True, timeout=WAIT)
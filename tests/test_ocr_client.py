@@ -0,0 +1,80 @@
+# tests/test_ocr_client.py
+import io
+
+import pytest
+
+ocr = pytest.importorskip("utils.ocr") # Needs requests, numpy, OpenCV and python-dotenv
+requests = pytest.importorskip("requests")
+
+
+class FakeSession:
+    """Answers each post() with the next outcome: an HTTP status code or an exception to raise."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def post(self, url, files=None, data=None, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.models.Response()
+        response.status_code = outcome
+        response.url = url
+        response.reason = "test"
+        return response
+
+
+def make_client(outcomes, **kwargs):
+    options = {"service_url": "http://got-ocr.test/process", "max_retries": 2, "backoff_base": 0,
+               "failure_threshold": 5, "reset_timeout": 60, **kwargs}
+    client = ocr.GotOcrClient(**options)
+    client.session = FakeSession(outcomes)
+    return client
+
+
+def post(client):
+    return client.post({"image": ("page.png", io.BytesIO(b"png"), "image/png")}, {"task": "Format Text"})
+
+
+def test_server_errors_are_retried_until_success():
+    client = make_client([503, requests.exceptions.ConnectionError("reset"), 200])
+    assert post(client).status_code == 200
+    assert client.session.calls == 3
+    assert client.circuit_state() == {"state": "closed", "consecutive_failures": 0}
+
+
+def test_gives_up_after_max_retries():
+    client = make_client([503, 503, 503])
+    with pytest.raises(requests.exceptions.HTTPError):
+        post(client)
+    assert client.session.calls == 3
+
+
+def test_client_errors_are_not_retried_and_do_not_count_as_failures():
+    client = make_client([400])
+    with pytest.raises(requests.exceptions.HTTPError):
+        post(client)
+    assert client.session.calls == 1
+    assert client.circuit_state()["consecutive_failures"] == 0
+
+
+def test_circuit_opens_after_consecutive_failures_and_fails_fast():
+    client = make_client([requests.exceptions.Timeout("slow")] * 2, max_retries=0, failure_threshold=2)
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.Timeout):
+            post(client)
+    with pytest.raises(ocr.CircuitOpenError):
+        post(client)
+    assert client.session.calls == 2 # The open circuit never reached the service
+    assert client.circuit_state() == {"state": "open", "consecutive_failures": 2}
+
+
+def test_trial_call_after_reset_timeout_closes_the_circuit():
+    client = make_client([requests.exceptions.ConnectionError("down"), 200], max_retries=0, failure_threshold=1, reset_timeout=0)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        post(client)
+    assert client.circuit_state()["state"] == "open"
+    assert post(client).status_code == 200
+    assert client.circuit_state() == {"state": "closed", "consecutive_failures": 0}
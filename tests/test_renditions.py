@@ -0,0 +1,37 @@
+# tests/test_renditions.py
+import os
+
+import pytest
+
+renditions = pytest.importorskip("utils.renditions") # Needs PyMuPDF and Pillow
+import fitz
+from utils.pipeline import shutdown_render_pool
+
+
+@pytest.fixture
+def pdf_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(renditions, "RENDITIONS_DIR", str(tmp_path / "renditions"))
+    path = str(tmp_path / "doc_ocr.pdf")
+    with fitz.open() as doc:
+        for text in ("first page", "second page"):
+            page = doc.new_page(width=595, height=842) # A4, so the thumbnail DPI is fractional
+            page.insert_text((72, 72), text)
+        doc.save(path)
+    yield path
+    shutdown_render_pool()
+
+
+def test_generate_renditions_writes_thumb_and_viewer_images(pdf_path):
+    manifest = renditions.generate_renditions(pdf_path, 150, tile_dpis=[], fmt="jpeg")
+    assert manifest["page_count"] == 2
+    for page_num in range(2):
+        for size in renditions.RENDITION_SIZES:
+            assert os.path.getsize(renditions.rendition_path(pdf_path, page_num, size, "jpeg")) > 0
+    assert manifest["pages"][0]["width"] == round(595 * 150 / 72)
+    assert renditions.load_manifest(pdf_path) == manifest
+
+
+def test_thumbnail_fits_its_long_edge(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        _, width, height = renditions.render_size(doc.load_page(0), "thumb", 150, "jpeg")
+    assert max(width, height) == pytest.approx(renditions.THUMB_LONG_EDGE, abs=1)
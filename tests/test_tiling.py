@@ -0,0 +1,37 @@
+# tests/test_tiling.py
+import pytest
+
+pytest.importorskip("utils.tiling") # Needs numpy, OpenCV and PyMuPDF
+from utils.tiling import _overlap, stitch_tile_texts
+
+
+def test_overlap_finds_lines_repeated_across_the_strip_boundary():
+    assert _overlap(["a b c", "d e f", "g h i"], ["d e f", "g h i", "j k l"]) == (2, 0, 0)
+
+
+def test_overlap_allows_one_cut_line_on_either_side():
+    previous = ["intro", "four five six", "seven eight nine", "ten ele"]
+    current = ["ive si", "seven eight nine", "ten eleven twelve", "thirteen"]
+    assert _overlap(previous, current) == (1, 1, 1)
+
+
+def test_overlap_of_unrelated_text_is_empty():
+    assert _overlap(["alpha"], ["beta"]) == (0, 0, 0)
+
+
+def test_stitch_keeps_overlapping_lines_once_and_separates_blocks():
+    tiles = [{"overlaps_previous": False}, {"overlaps_previous": True}, {"overlaps_previous": False}]
+    texts = ["Title\nfirst line\nsecond line\n", "first line\nsecond line\nthird line", "Sidebar"]
+    assert stitch_tile_texts(texts, tiles) == "Title\nfirst line\nsecond line\nthird line\n\nSidebar"
+
+
+def test_stitch_drops_cut_lines_at_the_boundary():
+    tiles = [{"overlaps_previous": False}, {"overlaps_previous": True}]
+    texts = ["intro\nfour five six\nseven eight nine\nten ele", "ive si\nseven eight nine\nten eleven twelve\nthirteen"]
+    assert stitch_tile_texts(texts, tiles) == "intro\nfour five six\nseven eight nine\nten eleven twelve\nthirteen"
+
+
+def test_stitch_keeps_the_longer_reading_of_a_repeated_line():
+    tiles = [{"overlaps_previous": False}, {"overlaps_previous": True}]
+    texts = ["one\nthe quick brown fox jumps", "the quick brown fox jumps.\ntwo"]
+    assert stitch_tile_texts(texts, tiles) == "one\nthe quick brown fox jumps.\ntwo"
@@ -0,0 +1,31 @@
+# tests/test_upload.py
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("fitz")
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    """Imports app.py inside a scratch directory, so its uploads and SQLite files stay there."""
+    previous_cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        import app
+        yield app
+    finally:
+        os.chdir(previous_cwd)
+        sys.modules["app"].shutdown_background_work(timeout=5)
+
+
+def test_truncated_upload_leaves_no_spool_file(app_module):
+    body = (b"--XBOUNDARY\r\n"
+            b'Content-Disposition: form-data; name="file"; filename="doc.pdf"\r\n'
+            b"Content-Type: application/pdf\r\n\r\n"
+            b"%PDF-1.4 first bytes of a document whose upload was cut off")
+    response = app_module.app.test_client().post("/upload", data=body, content_type="multipart/form-data; boundary=XBOUNDARY")
+    assert response.status_code == 400
+    assert [name for name in os.listdir(app_module.UPLOAD_FOLDER) if name.endswith(".upload")] == []
@@ -0,0 +1,342 @@
+# utils/analysis.py
+import json
+import os
+import threading
+import time
+
+from utils.docmodel import parse_formatted_text
+from utils.pipeline import iter_analyzed_pages, ANALYZE_DPI, ANALYZE_SKIP_BLANK, ANALYZE_REUSE_DUPLICATES
+from utils.preprocess import (OCR_PREPROCESS, OCR_TARGET_LONG_EDGE, OCR_COLOR_MODE, OCR_BINARIZE, OCR_IMAGE_FORMAT,
+                              OCR_JPEG_QUALITY)
+from utils.tiling import ANALYZE_TILING
+
+# --- Configuration ---
+ANALYSIS_MANIFEST_SUFFIX = ".analysis.jsonl" # Written next to the processed PDF, shared by its doc_ids
+SEARCHABLE_EXPORT_SUFFIX = ".searchable.pdf" # Searchable PDF export, regenerated when the manifest changes
+MANIFEST_VERSION = 1
+
+# Run states recorded in the manifest
+RUN_RUNNING = "running"
+RUN_FINISHED = "finished"
+RUN_STOPPED = "stopped" # Cancelled or failed; the pages stored so far are kept
+# Page states
+PAGE_DONE = "done"
+PAGE_FAILED = "failed"
+
+_manifests = {} # manifest path -> AnalysisManifest in use by a run (dropped once the last one releases it)
+_manifests_lock = threading.Lock()
+
+
+def manifest_path(pdf_path):
+    """Path of the analysis manifest of a processed PDF."""
+    return os.path.splitext(pdf_path)[0] + ANALYSIS_MANIFEST_SUFFIX
+
+
+def searchable_export_path(pdf_path):
+    """Path of the searchable PDF export of a processed PDF."""
+    return os.path.splitext(pdf_path)[0] + SEARCHABLE_EXPORT_SUFFIX
+
+
+def analysis_params(dpi=ANALYZE_DPI, tiling=ANALYZE_TILING, skip_blank=ANALYZE_SKIP_BLANK, reuse_duplicates=ANALYZE_REUSE_DUPLICATES):
+    """
+    The settings that change what GOT-OCR returns for a page. Stored results
+    are only reused while these match; concurrency, timeouts and retries
+    are left out since they do not change a successful result.
+    """
+    return {
+        "dpi": dpi,
+        "tiling": tiling,
+        "skip_blank": bool(skip_blank),
+        "reuse_duplicates": bool(reuse_duplicates),
+        "preprocess": {
+            "enabled": OCR_PREPROCESS, "target_long_edge": OCR_TARGET_LONG_EDGE, "color_mode": OCR_COLOR_MODE,
+            "binarize": OCR_BINARIZE, "image_format": OCR_IMAGE_FORMAT, "jpeg_quality": OCR_JPEG_QUALITY,
+        },
+    }
+
+
+class AnalysisManifest:
+    """
+    Per-page GOT-OCR Format Text results of one processed PDF, persisted as
+    JSON Lines next to it.
+
+    The first line is a header (source PDF mtime/size, page count, the
+    analysis params); then every finished page is appended as one line, the
+    latest line of a page winning, plus a line whenever a run starts or
+    ends. Page lines carry the page's document model ("blocks", see
+    utils.docmodel), parsed once when the result arrives. Appending keeps each page durable as soon as it is done without
+    rewriting the file, so the next run after a cancellation or restart
+    (a resubmitted request, or a batch job re-queued on startup) resumes
+    from the pages already stored. A truncated last line (crash
+    mid-write) is ignored. compact() rewrites the file with one line per
+    page at the end of a run.
+    """
+
+    def __init__(self, pdf_path, page_count, params):
+        self.pdf_path = pdf_path
+        self.path = manifest_path(pdf_path)
+        self.page_count = page_count
+        self.params = params
+        self.pages = {} # page -> record
+        self.run = None # Last run event
+        self.updated_at = None
+        self.users = 0 # Runs holding it through open_manifest, guarded by _manifests_lock
+        self._lock = threading.Lock()
+        self.source = source_stat(pdf_path) # Identifies the PDF version the results belong to
+        if not self._load():
+            self._rewrite()
+
+    # --- Persistence ---
+    def _header(self):
+        return {"type": "header", "version": MANIFEST_VERSION, **self.source, "page_count": self.page_count, "params": self.params}
+
+    def _load(self):
+        """Reads the stored manifest. Returns False if it is missing or made for another PDF version or params."""
+        entries = read_manifest_lines(self.path)
+        if not entries:
+            return False
+        header = entries[0]
+        if (header.get("type") != "header" or header.get("version") != MANIFEST_VERSION or header.get("params") != self.params
+                or any(header.get(key) != value for key, value in self.source.items())):
+            print(f"Analysis manifest {self.path} is for another PDF version or other params, starting over")
+            return False
+        for entry in entries[1:]:
+            if entry.get("type") == "page" and 0 <= entry.get("page", -1) < self.page_count:
+                self.pages[entry["page"]] = with_blocks(entry)
+            elif entry.get("type") == "run":
+                self.run = entry
+            self.updated_at = entry.get("at", self.updated_at)
+        return True
+
+    def _rewrite(self):
+        """Writes the whole manifest to a temporary file and renames it into place."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f_out:
+            for entry in [self._header(), *(self.pages[page] for page in sorted(self.pages)), *([self.run] if self.run else [])]:
+                f_out.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def _append(self, entry):
+        with open(self.path, "a", encoding="utf-8") as f_out:
+            f_out.write(json.dumps(entry) + "\n")
+        self.updated_at = entry["at"]
+
+    def compact(self):
+        """Rewrites the manifest with only the latest line of each page."""
+        with self._lock:
+            self._rewrite()
+
+    # --- Recording ---
+    def start_run(self, page_nums):
+        with self._lock:
+            self.run = {"type": "run", "state": RUN_RUNNING, "pages": len(page_nums), "at": time.time()}
+            self._append(self.run)
+
+    def end_run(self, state, reason=None):
+        with self._lock:
+            self.run = {"type": "run", "state": state, "reason": reason, "at": time.time()}
+            self._append(self.run)
+
+    def record(self, page_result):
+        """Stores one iter_analyzed_pages result with its parsed blocks. Returns the stored entry."""
+        entry = {"type": "page", **page_result, "status": PAGE_FAILED if page_result["error"] else PAGE_DONE,
+                 "blocks": parse_formatted_text(page_result["formatted_text"]), "at": time.time()}
+        with self._lock:
+            self.pages[entry["page"]] = entry
+            self._append(entry)
+        return entry
+
+    # --- Queries ---
+    def needs_analysis(self, page_num, retry_failed=True):
+        """True if a page has no stored result, or only a failed one and retry_failed is set."""
+        entry = self.pages.get(page_num)
+        return entry is None or (retry_failed and entry["status"] == PAGE_FAILED)
+
+    def summary(self):
+        """Counts of done, failed and missing pages, the params and the state of the last run."""
+        with self._lock:
+            failed = sum(1 for entry in self.pages.values() if entry["status"] == PAGE_FAILED)
+            return {
+                "page_count": self.page_count,
+                "pages_done": len(self.pages) - failed,
+                "pages_failed": failed,
+                "pages_missing": self.page_count - len(self.pages),
+                "params": self.params,
+                "run": self.run,
+                "updated_at": self.updated_at,
+            }
+
+
+def with_blocks(entry):
+    """Adds the parsed blocks to a page line stored before the manifest held them."""
+    if "blocks" not in entry:
+        entry["blocks"] = parse_formatted_text(entry.get("formatted_text"))
+    return entry
+
+
+def read_manifest_lines(path):
+    """Parses a manifest file into a list of dicts, skipping a truncated last line. Returns [] if missing."""
+    entries = []
+    try:
+        with open(path, encoding="utf-8") as f_in:
+            for line in f_in:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue # Partially written line of a run that was killed
+    except OSError:
+        return []
+    return entries
+
+
+def open_manifest(pdf_path, page_count, params, reset=False):
+    """
+    Returns the manifest of a processed PDF for these params, shared by every
+    run in this process that holds it at the same time. A manifest for other
+    params or an older version of the PDF (or any, with reset) is replaced
+    by an empty one. Every call must be paired with release_manifest()
+    (iter_document_analysis does it), so only manifests of running analyses
+    stay in memory.
+    """
+    path = manifest_path(pdf_path)
+    with _manifests_lock:
+        manifest = _manifests.get(path)
+        if manifest is None or reset or manifest.params != params or manifest.source != source_stat(pdf_path):
+            if reset and os.path.exists(path):
+                os.remove(path)
+            manifest = _manifests[path] = AnalysisManifest(pdf_path, page_count, params)
+        manifest.users += 1
+        return manifest
+
+
+def release_manifest(manifest):
+    """Ends a run's hold on a manifest from open_manifest; the last one drops it from memory."""
+    with _manifests_lock:
+        manifest.users -= 1
+        if manifest.users <= 0 and _manifests.get(manifest.path) is manifest:
+            del _manifests[manifest.path]
+
+
+def source_stat(pdf_path):
+    """mtime and size of a processed PDF, recorded so results of a replaced PDF are never reused."""
+    pdf_stat = os.stat(pdf_path)
+    return {"source_mtime_ns": pdf_stat.st_mtime_ns, "source_size": pdf_stat.st_size}
+
+
+def load_analysis(pdf_path):
+    """
+    Reads the stored analysis of a processed PDF without touching GOT-OCR.
+
+    Returns:
+        dict: {"header": header line, "pages": {page: record}, "run": last run event},
+            or None if there is none for the current version of the PDF.
+    """
+    entries = read_manifest_lines(manifest_path(pdf_path))
+    if not entries or entries[0].get("type") != "header":
+        return None
+    header = entries[0]
+    try:
+        if any(header.get(key) != value for key, value in source_stat(pdf_path).items()):
+            return None
+    except OSError:
+        return None
+    pages, run = {}, None
+    for entry in entries[1:]:
+        if entry.get("type") == "page":
+            pages[entry["page"]] = with_blocks(entry)
+        elif entry.get("type") == "run":
+            run = entry
+    return {"header": header, "pages": pages, "run": run}
+
+
+def store_page_result(pdf_path, page_count, params, page_result):
+    """
+    Records a single-page analysis in the document's manifest, unless the
+    manifest holds results for other params (which it would discard).
+
+    Returns:
+        dict: The stored entry, or None if it was not stored.
+    """
+    stored = read_manifest_lines(manifest_path(pdf_path))[:1]
+    if stored and stored[0].get("params") != params:
+        return None
+    manifest = open_manifest(pdf_path, page_count, params)
+    try:
+        return manifest.record({"skipped": None, "duplicate_of": None, **page_result})
+    finally:
+        release_manifest(manifest)
+
+
+def analysis_in_use(pdf_path):
+    """True while a run holds the PDF's manifest (open_manifest without release_manifest yet)."""
+    with _manifests_lock:
+        return manifest_path(pdf_path) in _manifests
+
+
+def analysis_size(pdf_path):
+    """Bytes of the analysis manifest and searchable export of a PDF."""
+    path = manifest_path(pdf_path)
+    return sum(os.path.getsize(stored) for stored in (path, searchable_export_path(pdf_path)) if os.path.exists(stored))
+
+
+def remove_analysis(pdf_path):
+    """Deletes the analysis manifest and searchable export of a PDF (used when the PDF itself is removed)."""
+    path = manifest_path(pdf_path)
+    with _manifests_lock:
+        _manifests.pop(path, None)
+    for stale in (path, f"{path}.tmp", searchable_export_path(pdf_path)):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+
+def iter_document_analysis(pdf_path, page_nums, manifest, retry_failed=True, **analyze_kwargs):
+    """
+    Analyzes a document through its manifest and yields one result per page,
+    in page order: stored results (with "stored": True) for pages already
+    done, and fresh iter_analyzed_pages results, each recorded as soon as
+    it arrives, for missing pages and (with retry_failed) failed ones.
+    Both carry the page's parsed "blocks".
+
+    The run is marked finished, or stopped if it is cancelled or fails, the
+    manifest is compacted either way and then released (release_manifest).
+
+    Args:
+        pdf_path (str): Processed PDF.
+        page_nums (iterable of int): Pages to yield.
+        manifest (AnalysisManifest): From open_manifest with the params the
+            analyze_kwargs produce. Released when the generator ends, so
+            iterate it right after opening.
+        retry_failed (bool): Analyze pages whose stored result is an error again.
+        **analyze_kwargs: Passed to iter_analyzed_pages.
+    """
+    fresh, run_started = None, False
+    state, reason = RUN_FINISHED, None
+    try: # From the first step on, so even a failing start_run releases the manifest
+        page_nums = list(page_nums)
+        todo = [page_num for page_num in page_nums if manifest.needs_analysis(page_num, retry_failed)]
+        todo_set = set(todo)
+        if todo:
+            print(f"Analysis of {pdf_path}: {len(page_nums) - len(todo)} stored page(s), {len(todo)} to analyze")
+            manifest.start_run(todo)
+            run_started = True
+        fresh = iter_analyzed_pages(pdf_path, todo, **analyze_kwargs)
+        for page_num in page_nums:
+            if page_num in todo_set:
+                result = next(fresh)
+                entry = manifest.record(result)
+                yield {**result, "blocks": entry["blocks"], "stored": False}
+            else:
+                entry = manifest.pages[page_num]
+                yield {**{key: value for key, value in entry.items() if key not in ("type", "status", "at")}, "stored": True}
+    except BaseException as e: # Also GeneratorExit when the consumer stops early
+        state, reason = RUN_STOPPED, str(e) or type(e).__name__
+        raise
+    finally:
+        try:
+            if fresh is not None:
+                fresh.close() # Stops pages still in flight if the loop ended early
+            if run_started:
+                manifest.end_run(state, reason)
+                manifest.compact()
+        finally:
+            release_manifest(manifest)
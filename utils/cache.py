@@ -0,0 +1,261 @@
+# utils/cache.py
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.utils import secure_filename
+
+# --- Configuration ---
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "page_cache") # Disk tier for rendered page images
+PAGE_CACHE_MEMORY_MB = int(os.getenv("PAGE_CACHE_MEMORY_MB", "64"))
+PAGE_CACHE_DISK_MB = int(os.getenv("PAGE_CACHE_DISK_MB", "512"))
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "ocr_cache.sqlite3") # SQLite file for GOT-OCR results
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "256"))
+OCR_CACHE_TTL_DAYS = float(os.getenv("OCR_CACHE_TTL_DAYS", "30"))
+OCR_CACHE_SWEEP_SECONDS = float(os.getenv("OCR_CACHE_SWEEP_SECONDS", "3600")) # How often put() deletes expired results
+
+
+class TieredLRUCache:
+    """
+    Two-tier (memory + disk) byte cache with size-based LRU eviction.
+
+    Keys are tuples whose first element is a namespace (the doc_id), which
+    lets all entries of one document be dropped at once with invalidate().
+    The memory tier is an OrderedDict; the disk tier stores one file per
+    entry under <disk_dir>/<namespace>/, indexed in a second OrderedDict of
+    path -> size so eviction never has to walk the directory. The index is
+    rebuilt from the files' mtimes at startup, so hits also touch the file.
+    """
+
+    def __init__(self, disk_dir, memory_bytes, disk_bytes):
+        self.disk_dir = disk_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict() # key -> bytes, most recently used last
+        self._memory_size = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(disk_dir, exist_ok=True)
+        # path -> size, least recently used first
+        self._disk = OrderedDict((path, size) for path, size, _ in sorted(self._disk_entries(), key=lambda entry: entry[2]))
+        self._disk_size = sum(self._disk.values())
+
+    # --- Disk Helpers ---
+    def _disk_path(self, key):
+        namespace = secure_filename(str(key[0])) or "_"
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, namespace, digest)
+
+    def _disk_entries(self):
+        """Yields (path, size, mtime) for every file in the disk tier."""
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes and self._disk:
+            path, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error evicting cache file {path}: {e}")
+
+    # --- Memory Helpers ---
+    def _remember(self, key, value):
+        if len(value) > self.memory_bytes:
+            return # Too large for the memory tier, disk only
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_size += len(value)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    # --- Public API ---
+    def get(self, key):
+        """Returns the cached bytes for key, or None on a miss."""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+            path = self._disk_path(key)
+            try:
+                with open(path, "rb") as f:
+                    value = f.read()
+                os.utime(path) # Keeps the LRU order across restarts
+            except OSError:
+                self.misses += 1
+                return None
+            if path in self._disk:
+                self._disk.move_to_end(path)
+            self._remember(key, value)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Stores bytes under key in both tiers, evicting old entries as needed."""
+        with self._lock:
+            self._remember(key, value)
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(value)
+                os.replace(tmp_path, path)
+                self._disk_size += len(value) - self._disk.pop(path, 0)
+                self._disk[path] = len(value)
+            except OSError as e:
+                print(f"Error writing cache file {path}: {e}")
+                return
+            self._evict_disk()
+
+    def invalidate(self, namespace):
+        """Drops every entry whose key starts with namespace (e.g. a doc_id)."""
+        with self._lock:
+            for key in [k for k in self._memory if k[0] == namespace]:
+                self._memory_size -= len(self._memory.pop(key))
+            ns_dir = os.path.join(self.disk_dir, secure_filename(str(namespace)) or "_")
+            for path in [p for p in self._disk if os.path.dirname(p) == ns_dir]:
+                self._disk_size -= self._disk.pop(path)
+            shutil.rmtree(ns_dir, ignore_errors=True)
+
+    def stats(self):
+        """Returns hit/miss counts and current tier sizes."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._disk_size,
+            }
+
+
+def create_page_image_cache():
+    """
+    Builds the page-raster cache from the PAGE_CACHE_* settings. It holds
+    on-demand renders: /page_image/<page> and renditions that have not been
+    generated yet; generated renditions are served from their files.
+    """
+    return TieredLRUCache(PAGE_CACHE_DIR, PAGE_CACHE_MEMORY_MB * 1024 * 1024, PAGE_CACHE_DISK_MB * 1024 * 1024)
+
+
+class OCRResultCache:
+    """
+    Persistent content-addressed store for GOT-OCR results, backed by SQLite.
+
+    Entries are keyed by a SHA-256 of the image bytes plus the task
+    parameters, so the same image sent with the same task is answered
+    locally. Entries expire after ttl_seconds; when the stored text exceeds
+    max_bytes the least recently read entries are dropped.
+
+    The total stored size is kept in memory (summed once at startup), so a
+    put() only touches the rows it writes or evicts. Expired rows are never
+    served by get(); they are deleted in bulk at most every sweep_seconds.
+    """
+
+    def __init__(self, db_path, max_bytes, ttl_seconds, sweep_seconds=OCR_CACHE_SWEEP_SECONDS):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_seconds = sweep_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS ocr_results (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_results_last_access ON ocr_results (last_access)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_results_created_at ON ocr_results (created_at)")
+            self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_results").fetchone()[0]
+            self._sweep_expired(time.time())
+
+    def _sweep_expired(self, now):
+        """Deletes every expired result. Caller holds the lock and a transaction."""
+        cutoff = now - self.ttl_seconds
+        expired = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_results WHERE created_at < ?", (cutoff,)).fetchone()[0]
+        if expired:
+            self._conn.execute("DELETE FROM ocr_results WHERE created_at < ?", (cutoff,))
+            self._total -= expired
+        self._next_sweep = now + self.sweep_seconds
+
+    @staticmethod
+    def make_key(image_bytes, params):
+        """Hashes the image content together with the task parameters (task, ocr_type, ocr_box, ...)."""
+        digest = hashlib.sha256(image_bytes)
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached text for key, or None if missing or expired."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, created_at, size FROM ocr_results WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM ocr_results WHERE key = ?", (key,))
+                    self._total -= row[2]
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE ocr_results SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        """Stores a result and evicts expired or least recently used entries beyond max_bytes."""
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock, self._conn:
+            replaced = self._conn.execute("SELECT size FROM ocr_results WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_results (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._total += size - (replaced[0] if replaced else 0)
+            if now >= self._next_sweep:
+                self._sweep_expired(now)
+            while self._total > self.max_bytes:
+                oldest = self._conn.execute("SELECT key, size FROM ocr_results ORDER BY last_access LIMIT 32").fetchall()
+                if not oldest:
+                    self._total = 0
+                    break
+                for old_key, old_size in oldest:
+                    self._conn.execute("DELETE FROM ocr_results WHERE key = ?", (old_key,))
+                    self._total -= old_size
+                    if self._total <= self.max_bytes:
+                        break
+
+    def stats(self):
+        """Returns hit/miss counts and the number and size of stored results."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM ocr_results").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": self._total}
+
+
+def create_ocr_result_cache():
+    """Builds the GOT-OCR result cache from the OCR_CACHE_* settings."""
+    return OCRResultCache(OCR_CACHE_PATH, OCR_CACHE_MAX_MB * 1024 * 1024, OCR_CACHE_TTL_DAYS * 86400)
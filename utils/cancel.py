@@ -0,0 +1,133 @@
+# utils/cancel.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# --- Configuration ---
+CANCEL_POLL_INTERVAL = 0.5 # Seconds between cancellation checks of blocking waits
+
+
+class OperationCancelled(Exception):
+    """Raised when work is cancelled or its deadline passes. str() is the reason."""
+
+
+class CancelToken:
+    """
+    Cancellation flag with an optional deadline, shared by everything that
+    works on behalf of one request or job.
+
+    Long-running code passes the token down and calls check() between steps,
+    sleeps with sleep() and bounds network and subprocess waits with
+    timeout(). Once the deadline passes the token counts as cancelled with
+    the reason "deadline exceeded".
+    """
+
+    def __init__(self, timeout=None):
+        self.deadline = time.time() + timeout if timeout else None
+        self.reason = None
+        self._event = threading.Event()
+        self._parent = None
+
+    def child(self):
+        """
+        New token with the same deadline that also counts as cancelled once
+        this one is, while cancelling it leaves this one alone (e.g. to stop
+        the sibling tasks of one that failed).
+        """
+        token = CancelToken()
+        token.deadline = self.deadline
+        token._parent = self
+        return token
+
+    def cancel(self, reason="cancelled"):
+        """Cancels the work. The first reason given is kept."""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self._parent is not None and self._parent.cancelled:
+            self.cancel(self._parent.reason)
+        if not self._event.is_set() and self.deadline is not None and time.time() >= self.deadline:
+            self.cancel("deadline exceeded")
+        return self._event.is_set()
+
+    def remaining(self):
+        """Seconds until the deadline, or None without one."""
+        return None if self.deadline is None else max(0.0, self.deadline - time.time())
+
+    def check(self):
+        """Raises OperationCancelled if the work was cancelled or the deadline passed."""
+        if self.cancelled:
+            raise OperationCancelled(self.reason)
+
+    def timeout(self, timeout):
+        """timeout capped to the time left before the deadline. Raises OperationCancelled if none is left."""
+        self.check()
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def wait(self, seconds):
+        """Blocks up to seconds (or until the deadline). Returns True if the work is cancelled by then."""
+        remaining = self.remaining()
+        self._event.wait(seconds if remaining is None else min(seconds, remaining))
+        return self.cancelled
+
+    def sleep(self, seconds):
+        """Sleeps like time.sleep, but raises OperationCancelled as soon as the work is cancelled."""
+        if self.wait(seconds):
+            raise OperationCancelled(self.reason)
+
+
+class CancelRegistry:
+    """Thread-safe map of request ids to their CancelTokens, so another request can cancel them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+
+    def register(self, key, token):
+        with self._lock:
+            self._tokens[key] = token
+        return token
+
+    def discard(self, key):
+        with self._lock:
+            self._tokens.pop(key, None)
+
+    def cancel(self, key, reason="cancelled"):
+        """Cancels the token registered under key. Returns False if there is none."""
+        with self._lock:
+            token = self._tokens.get(key)
+        if token is None:
+            return False
+        token.cancel(reason)
+        return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tokens)
+
+
+@contextmanager
+def cancellable_executor(max_workers, thread_name_prefix, cancel=None):
+    """
+    ThreadPoolExecutor for fanning out cancellable work. A normal exit joins
+    the threads like the with-statement form. When the block raises
+    (OperationCancelled, a failed task, GeneratorExit from a closed
+    generator) or cancel is cancelled, queued tasks are dropped and tasks
+    already running are left to finish in the background, so the caller
+    returns at once instead of waiting out in-flight GOT-OCR calls (whose
+    timeouts are capped by the token's deadline).
+    """
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+    try:
+        yield pool
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=cancel is None or not cancel.cancelled, cancel_futures=True)
@@ -0,0 +1,255 @@
+# utils/docmodel.py
+import csv
+import io
+import os
+import re
+
+import fitz # PyMuPDF - For the searchable PDF export
+
+# --- Configuration ---
+EXPORT_FONT_SIZES = (10, 7, 5, 3, 2, 1) # Tried in turn until a page's text fits its invisible text box
+# TrueType/OpenType font for the export's text layer (e.g. a Noto Sans covering your documents' scripts);
+# empty uses PyMuPDF's built-in Droid Sans Fallback, which covers Latin and CJK
+EXPORT_FONT_FILE = os.getenv("EXPORT_FONT_FILE", "")
+EXPORT_FONT_NAME = "gotocr" # Resource name of the embedded font on each page
+EXPORT_LINE_SPACING = 1.2 # Line height as a multiple of the font size in the line-by-line fallback
+# Block types of the document model
+BLOCK_HEADING = "heading"
+BLOCK_PARAGRAPH = "paragraph"
+BLOCK_LIST = "list"
+BLOCK_MATH = "math"
+BLOCK_TABLE = "table"
+
+# --- LaTeX ---
+# \begin{tabular}{colspec}...\end{tabular}; tabular* / tabularx take a width first, and the
+# colspec may hold one level of nested braces (p{3cm})
+TABULAR_RE = re.compile(r"\\begin\{((?:tabular|longtable|array)(\*|x)?)\}\s*(?(2)\{[^{}]*\}\s*)(?:\[[^\]]*\]\s*)?"
+                        r"\{(?:[^{}]|\{[^{}]*\})*\}(.*?)\\end\{\1\}", re.DOTALL)
+TABLE_RULE_RE = re.compile(r"\\(?:hline|toprule|midrule|bottomrule|endhead|endfirsthead|endfoot|endlastfoot)\b|\\(?:cline|cmidrule)(?:\([^)]*\))?\{[^}]*\}")
+ROW_END_RE = re.compile(r"\\\\(?:\s*\[[^\]]*\])?")
+CELL_SPLIT_RE = re.compile(r"(?<!\\)&")
+SPAN_RE = re.compile(r"^\\multi(column|row)\{(\d+)\}\{[^{}]*\}\{(.*)\}$", re.DOTALL)
+LATEX_HEADING_RE = re.compile(r"^\\(title|section|subsection|subsubsection|paragraph)\*?\{(.*)\}\s*$", re.DOTALL)
+LATEX_HEADING_LEVELS = {"title": 1, "section": 1, "subsection": 2, "subsubsection": 3, "paragraph": 4}
+LATEX_ENV_RE = re.compile(r"\\(?:begin|end)\{(?:table\*?|center|figure\*?|document|abstract|itemize|enumerate)\}(?:\[[^\]]*\])?")
+LATEX_STYLE_RE = re.compile(r"\\(?:textbf|textit|texttt|textrm|textsf|emph|underline|text|mathrm|mathbf|caption|footnote|mbox)\*?\{((?:[^{}]|\{[^{}]*\})*)\}")
+LATEX_ESCAPES = {"\\&": "&", "\\%": "%", "\\$": "$", "\\#": "#", "\\_": "_", "\\{": "{", "\\}": "}", "~": " "}
+# --- Markdown ---
+MD_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+MD_TABLE_SEPARATOR_RE = re.compile(r"^\s*\|?\s*:?-+:?\s*(?:\|\s*:?-+:?\s*)*\|?\s*$")
+LIST_ITEM_RE = re.compile(r"^\s*(?:[-*+]|\d+[.)]|\\item)\s+(.*)$")
+
+
+def latex_to_text(text):
+    """Plain text of a LaTeX fragment: style commands unwrapped, escapes resolved, whitespace collapsed."""
+    previous = None
+    while previous != text: # Unwrap nested styles from the inside out
+        previous, text = text, LATEX_STYLE_RE.sub(r"\1", text)
+    for escape, char in LATEX_ESCAPES.items():
+        text = text.replace(escape, char)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _cell(text, colspan=1, rowspan=1):
+    return {"text": text, "colspan": colspan, "rowspan": rowspan}
+
+
+def parse_latex_table(body):
+    """
+    Parses the body of a tabular environment into rows of cells. Rules
+    (\\hline, \\midrule, ...) are dropped, \\multicolumn and \\multirow become
+    colspan / rowspan. The first row is the header, as the viewer has always
+    shown it.
+    """
+    rows = []
+    for line in ROW_END_RE.split(TABLE_RULE_RE.sub("", body)):
+        if not line.strip():
+            continue
+        cells = []
+        for raw in CELL_SPLIT_RE.split(line):
+            raw = raw.strip()
+            span = SPAN_RE.match(raw)
+            if span:
+                kind, count, inner = span.groups()
+                inner_span = SPAN_RE.match(inner.strip()) # \multicolumn{2}{c}{\multirow{2}{*}{x}}
+                text = latex_to_text(inner_span.group(3) if inner_span else inner)
+                colspan = int(count) if kind == "column" else (int(inner_span.group(2)) if inner_span and inner_span.group(1) == "column" else 1)
+                rowspan = int(count) if kind == "row" else (int(inner_span.group(2)) if inner_span and inner_span.group(1) == "row" else 1)
+                cells.append(_cell(text, max(1, colspan), max(1, rowspan)))
+            else:
+                cells.append(_cell(latex_to_text(raw)))
+        rows.append(cells)
+    return {"format": "latex", "header": rows[0] if rows else [], "rows": rows[1:]}
+
+
+def _split_markdown_row(line):
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [_cell(cell.strip().replace("\\|", "|")) for cell in re.split(r"(?<!\\)\|", line)]
+
+
+def _text_blocks(text, blocks):
+    """Appends the heading, list, math, paragraph and Markdown table blocks of text without tabulars."""
+    lines = LATEX_ENV_RE.sub("", text).splitlines()
+    paragraph, items = [], []
+
+    def flush():
+        if paragraph:
+            blocks.append({"type": BLOCK_PARAGRAPH, "text": latex_to_text(" ".join(paragraph))})
+            paragraph.clear()
+        if items:
+            blocks.append({"type": BLOCK_LIST, "items": list(items)})
+            items.clear()
+
+    index = 0
+    while index < len(lines):
+        line = lines[index].strip()
+        index += 1
+        heading = MD_HEADING_RE.match(line) or LATEX_HEADING_RE.match(line)
+        if not line:
+            flush()
+        elif heading:
+            flush()
+            level = len(heading.group(1)) if heading.group(1).startswith("#") else LATEX_HEADING_LEVELS[heading.group(1)]
+            blocks.append({"type": BLOCK_HEADING, "level": level, "text": latex_to_text(heading.group(2))})
+        elif "|" in line and index < len(lines) and "|" in lines[index] and MD_TABLE_SEPARATOR_RE.match(lines[index]):
+            flush()
+            header = _split_markdown_row(line)
+            rows = []
+            index += 1 # Separator
+            while index < len(lines) and "|" in lines[index] and lines[index].strip():
+                rows.append(_split_markdown_row(lines[index]))
+                index += 1
+            blocks.append({"type": BLOCK_TABLE, "format": "markdown", "header": header, "rows": rows})
+        elif line.startswith(("$$", "\\[")):
+            flush()
+            closing = "$$" if line.startswith("$$") else "\\]"
+            math = [line]
+            done = line.endswith(closing) and len(line) >= 2 * len(closing)
+            while not done and index < len(lines): # Up to the closing delimiter
+                math.append(lines[index].strip())
+                index += 1
+                done = math[-1].endswith(closing)
+            blocks.append({"type": BLOCK_MATH, "text": "\n".join(math)})
+        elif LIST_ITEM_RE.match(line):
+            if paragraph:
+                flush()
+            items.append(latex_to_text(LIST_ITEM_RE.match(line).group(1)))
+        else:
+            if items:
+                flush()
+            paragraph.append(line)
+    flush()
+
+
+def parse_formatted_text(text):
+    """
+    Parses GOT-OCR Format Text output (Markdown / LaTeX) into the blocks of
+    the document model, in reading order.
+
+    Returns:
+        list of dict: {"type": "heading", "level", "text"}, {"type": "paragraph", "text"},
+            {"type": "list", "items"}, {"type": "math", "text"} (raw source) and
+            {"type": "table", "format", "header", "rows"}, cells being
+            {"text", "colspan", "rowspan"}.
+    """
+    blocks = []
+    if not text:
+        return blocks
+    position = 0
+    for match in TABULAR_RE.finditer(text):
+        _text_blocks(text[position:match.start()], blocks)
+        table = parse_latex_table(match.group(3))
+        if table["header"] or table["rows"]:
+            blocks.append({"type": BLOCK_TABLE, **table})
+        position = match.end()
+    _text_blocks(text[position:], blocks)
+    return blocks
+
+
+def block_tables(blocks):
+    """The table blocks of a page, in reading order."""
+    return [block for block in blocks if block["type"] == BLOCK_TABLE]
+
+
+def table_grid(table):
+    """
+    The header and rows of a table block as a rectangular grid of strings.
+    A colspan cell's text goes in its first column and the columns it
+    covers stay empty; rows under a rowspan already hold an empty cell in
+    the LaTeX source, so they need no padding.
+    """
+    grid = [[value for cell in row for value in [cell["text"]] + [""] * (cell["colspan"] - 1)]
+            for row in [table["header"], *table["rows"]]]
+    width = max((len(values) for values in grid), default=0)
+    return [values + [""] * (width - len(values)) for values in grid]
+
+
+def table_csv(table, prefix=()):
+    """A table block as CSV text, each row preceded by the prefix values (e.g. page and table number)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in table_grid(table):
+        writer.writerow([*prefix, *values])
+    return buffer.getvalue()
+
+
+def blocks_text(blocks):
+    """Plain text of a page's blocks: table rows tab-separated, blocks separated by blank lines."""
+    parts = []
+    for block in blocks:
+        if block["type"] == BLOCK_TABLE:
+            parts.append("\n".join("\t".join(values) for values in table_grid(block)))
+        elif block["type"] == BLOCK_LIST:
+            parts.append("\n".join(f"- {item}" for item in block["items"]))
+        else:
+            parts.append(block["text"])
+    return "\n\n".join(part for part in parts if part.strip())
+
+
+# --- Searchable PDF Export ---
+def write_searchable_pdf(pdf_path, page_texts, out_path):
+    """
+    Copies a processed PDF and lays each page's analyzed text over it as
+    invisible text (render mode 3), so the export is searchable and
+    copyable with GOT-OCR's reading of the page. The page images and
+    ocrmypdf's word-positioned text layer are kept. Runs on the render pool.
+
+    The text is set in a Unicode font (EXPORT_FONT_FILE) so non-Latin
+    characters survive. Text that overflows the page even at the smallest
+    of EXPORT_FONT_SIZES is written line by line, each line squeezed to
+    the page width and the lines to its height, rather than dropped.
+
+    Args:
+        pdf_path (str): Processed PDF.
+        page_texts (dict): page -> plain text (blocks_text); other pages are copied as they are.
+        out_path (str): Where to write the export.
+    """
+    font = fitz.Font(fontfile=EXPORT_FONT_FILE) if EXPORT_FONT_FILE else fitz.Font("cjk")
+    with fitz.open(pdf_path) as doc:
+        for page_num, text in page_texts.items():
+            if not text.strip() or not 0 <= page_num < len(doc):
+                continue
+            page = doc.load_page(page_num)
+            page.insert_font(fontname=EXPORT_FONT_NAME, fontbuffer=font.buffer)
+            for font_size in EXPORT_FONT_SIZES:
+                # insert_textbox draws nothing and returns a negative value when the text overflows
+                if page.insert_textbox(page.rect, text, fontsize=font_size, fontname=EXPORT_FONT_NAME, render_mode=3) >= 0:
+                    break
+            else:
+                _insert_text_lines(page, text, font)
+        doc.save(out_path, garbage=3, deflate=True)
+    return out_path
+
+
+def _insert_text_lines(page, text, font):
+    """Writes each line of text invisibly, scaled to fit the page width, the lines spread over the page height."""
+    lines = [line for line in text.splitlines() if line.strip()]
+    rect = page.rect
+    step = min(EXPORT_FONT_SIZES[-1] * EXPORT_LINE_SPACING, rect.height / max(1, len(lines)))
+    for index, line in enumerate(lines):
+        font_size = min(EXPORT_FONT_SIZES[-1], rect.width / max(font.text_length(line, fontsize=1), 1e-3))
+        page.insert_text((rect.x0, rect.y0 + step * (index + 1)), line, fontsize=font_size, fontname=EXPORT_FONT_NAME, render_mode=3)
@@ -0,0 +1,123 @@
+# utils/docpool.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import fitz # PyMuPDF
+
+from utils.metrics import metrics
+
+# --- Configuration ---
+DOC_POOL_MAX_HANDLES = int(os.getenv("DOC_POOL_MAX_HANDLES", "32")) # Idle handles kept open across all docs
+DOC_POOL_IDLE_TIMEOUT = float(os.getenv("DOC_POOL_IDLE_TIMEOUT", "300")) # Seconds before an idle handle is closed
+
+
+class DocumentPool:
+    """
+    Bounded, thread-safe pool of open fitz.Document handles keyed by doc_id.
+
+    A fitz.Document must not be used by two threads at once, so handles are
+    leased: checkout() hands a handle to exactly one caller and returns it
+    to the idle list afterwards. Idle handles are evicted least-recently-used
+    first once max_handles is exceeded, and closed after idle_timeout. A
+    handle whose PDF changed on disk (mtime/size) or whose doc_id was
+    invalidated is closed instead of being reused.
+    """
+
+    def __init__(self, max_handles=DOC_POOL_MAX_HANDLES, idle_timeout=DOC_POOL_IDLE_TIMEOUT):
+        self.max_handles = max(1, max_handles)
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        # (doc_id, handle id) -> (doc, file signature, last used); most recently used last
+        self._idle = OrderedDict()
+        self._generation = {} # doc_id -> counter bumped by invalidate()
+        self._leases = {} # pdf_path -> handles currently checked out
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _signature(pdf_path):
+        st = os.stat(pdf_path)
+        return st.st_mtime_ns, st.st_size
+
+    @staticmethod
+    def _close(doc):
+        try:
+            doc.close()
+        except Exception as close_err:
+            print(f"Error closing pooled PDF handle: {close_err}")
+
+    def _prune(self, now):
+        """Closes expired idle handles and trims the pool to max_handles. Caller holds the lock."""
+        expired = [key for key, (_, _, last_used) in self._idle.items() if now - last_used > self.idle_timeout]
+        for key in expired:
+            self._close(self._idle.pop(key)[0])
+        while len(self._idle) > self.max_handles:
+            _, (doc, _, _) = self._idle.popitem(last=False)
+            self._close(doc)
+
+    @contextmanager
+    def checkout(self, doc_id, pdf_path):
+        """
+        Leases an open document for the duration of a with-block.
+
+        Args:
+            doc_id (str): Document identifier used as the pool key.
+            pdf_path (str): Path of the processed PDF to open on a miss.
+
+        Yields:
+            fitz.Document: A handle used by this caller only.
+        """
+        signature = self._signature(pdf_path)
+        doc = None
+        with self._lock:
+            generation = self._generation.get(doc_id, 0)
+            for key in reversed(self._idle):
+                if key[0] == doc_id:
+                    doc, idle_signature, _ = self._idle.pop(key)
+                    if idle_signature == signature:
+                        self.hits += 1
+                        break
+                    self._close(doc) # PDF was replaced since this handle was opened
+                    doc = None
+                    break
+            if doc is None:
+                self.misses += 1
+            self._leases[pdf_path] = self._leases.get(pdf_path, 0) + 1
+        if doc is None:
+            with metrics.span("pdf_open"):
+                doc = fitz.open(pdf_path)
+
+        try:
+            yield doc
+        finally:
+            with self._lock:
+                self._leases[pdf_path] -= 1
+                if not self._leases[pdf_path]:
+                    del self._leases[pdf_path]
+                if self._generation.get(doc_id, 0) != generation or doc.is_closed:
+                    self._close(doc)
+                else:
+                    now = time.time()
+                    self._idle[(doc_id, id(doc))] = (doc, signature, now)
+                    self._prune(now)
+
+    def in_use(self, pdf_path):
+        """True while a handle of pdf_path is checked out."""
+        with self._lock:
+            return pdf_path in self._leases
+
+    def invalidate(self, doc_id):
+        """Closes idle handles for doc_id; handles currently leased are closed on return."""
+        with self._lock:
+            self._generation[doc_id] = self._generation.get(doc_id, 0) + 1
+            for key in [k for k in self._idle if k[0] == doc_id]:
+                self._close(self._idle.pop(key)[0])
+
+    def stats(self):
+        """Returns hit/miss counts and the number of idle handles, for sizing the pool."""
+        with self._lock:
+            self._prune(time.time())
+            return {"hits": self.hits, "misses": self.misses, "idle_handles": len(self._idle), "max_handles": self.max_handles}
@@ -0,0 +1,253 @@
+# utils/docstore.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# --- Configuration ---
+DOC_STORE_DB_PATH = os.getenv("DOC_STORE_DB_PATH", "docstore.sqlite3") # SQLite index of stored artifacts
+DOC_STORE_QUOTA_MB = int(os.getenv("DOC_STORE_QUOTA_MB", "5120")) # Disk budget for processed PDFs and their derived files
+LEGACY_SUFFIX = "_ocr.pdf" # <doc_id>_ocr.pdf files written before the store existed
+ACCESS_TOUCH_INTERVAL = 60 # Seconds between last-access writes for the same artifact
+
+# Artifact states
+ARTIFACT_PROCESSING = "processing"
+ARTIFACT_READY = "ready"
+
+
+def make_content_key(content_sha256, ocr_options):
+    """
+    Derives the artifact key from the uploaded bytes' hash and the OCR
+    options, so the same file processed with different settings is stored
+    separately.
+    """
+    digest = hashlib.sha256(content_sha256.encode("ascii"))
+    digest.update(json.dumps(ocr_options, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class DocumentStore:
+    """
+    Content-addressed store of processed PDFs.
+
+    Each artifact (one OCR'd PDF) is identified by a content key; any number
+    of doc_ids can point at it, so re-uploading the same file reuses the
+    existing result instead of running ocrmypdf again. Artifacts track their
+    last access, and gc() deletes the least recently used ready artifacts
+    (and their doc_ids) once the total size exceeds the quota.
+    on_discard(path), if given, is called for every removed artifact so
+    files derived from it can be removed too; derived_size(path) reports
+    their bytes so they count against the quota, and in_use(path) keeps gc()
+    away from PDFs a reader or job still needs.
+    """
+
+    def __init__(self, storage_dir, db_path=DOC_STORE_DB_PATH, quota_bytes=DOC_STORE_QUOTA_MB * 1024 * 1024, on_discard=None,
+                 derived_size=None, in_use=None):
+        self.storage_dir = storage_dir
+        self.quota_bytes = quota_bytes
+        self.on_discard = on_discard
+        self.derived_size = derived_size
+        self.in_use = in_use
+        self._lock = threading.Lock()
+        self._last_touch = {} # content_key -> last time last_access was written
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS artifacts (
+                    content_key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    origin_doc_id TEXT NOT NULL,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    page_count INTEGER,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS documents (
+                    doc_id TEXT PRIMARY KEY,
+                    content_key TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS documents_content_key ON documents (content_key)")
+            # Half-finished artifacts from a previous process will never complete
+            self._conn.execute("DELETE FROM documents WHERE content_key IN (SELECT content_key FROM artifacts WHERE status = ?)", (ARTIFACT_PROCESSING,))
+            self._conn.execute("DELETE FROM artifacts WHERE status = ?", (ARTIFACT_PROCESSING,))
+
+    def artifact_path(self, content_key):
+        """Path where the processed PDF for a content key is stored."""
+        return os.path.join(self.storage_dir, f"{content_key[:32]}_ocr.pdf")
+
+    # --- Lookups ---
+    def find(self, content_key):
+        """Returns the artifact record for a content key, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM artifacts WHERE content_key = ?", (content_key,)).fetchone()
+        return dict(row) if row else None
+
+    def resolve(self, doc_id):
+        """
+        Returns the stored PDF path for doc_id, or None if the doc_id is not
+        in the store. Also refreshes the artifact's last access time.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT a.content_key, a.path FROM documents d JOIN artifacts a ON a.content_key = d.content_key WHERE d.doc_id = ?",
+                (doc_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - self._last_touch.get(row["content_key"], 0) > ACCESS_TOUCH_INTERVAL:
+                self._last_touch[row["content_key"]] = now
+                with self._conn:
+                    self._conn.execute("UPDATE artifacts SET last_access = ? WHERE content_key = ?", (now, row["content_key"]))
+            return row["path"]
+
+    def origin_doc_id(self, doc_id):
+        """Returns the doc_id whose upload produced the artifact doc_id points at."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT a.origin_doc_id FROM documents d JOIN artifacts a ON a.content_key = d.content_key WHERE d.doc_id = ?",
+                (doc_id,),
+            ).fetchone()
+        return row["origin_doc_id"] if row else None
+
+    # --- Registration ---
+    def create(self, doc_id, content_key):
+        """
+        Registers a new artifact (status processing) produced by doc_id's upload.
+
+        Returns:
+            bool: False if another upload registered the same content key first.
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO artifacts (content_key, path, status, origin_doc_id, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                        (content_key, self.artifact_path(content_key), ARTIFACT_PROCESSING, doc_id, now, now),
+                    )
+                    self._conn.execute("INSERT OR REPLACE INTO documents (doc_id, content_key, created_at) VALUES (?, ?, ?)", (doc_id, content_key, now))
+            except sqlite3.IntegrityError:
+                return False
+        return True
+
+    def alias(self, doc_id, content_key):
+        """Points an additional doc_id at an existing artifact."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO documents (doc_id, content_key, created_at) VALUES (?, ?, ?)", (doc_id, content_key, now))
+            self._conn.execute("UPDATE artifacts SET last_access = ? WHERE content_key = ?", (now, content_key))
+
+    def mark_ready(self, content_key, page_count):
+        """Records that the artifact's PDF is complete."""
+        path = self.artifact_path(content_key)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE artifacts SET status = ?, size = ?, page_count = ?, last_access = ? WHERE content_key = ?",
+                (ARTIFACT_READY, size, page_count, time.time(), content_key),
+            )
+
+    def discard(self, content_key):
+        """
+        Removes an artifact and every doc_id pointing at it (used when
+        processing fails or by gc()).
+
+        Returns:
+            list of str: doc_ids that pointed at the artifact.
+        """
+        with self._lock, self._conn:
+            doc_ids = [r["doc_id"] for r in self._conn.execute("SELECT doc_id FROM documents WHERE content_key = ?", (content_key,))]
+            row = self._conn.execute("SELECT path FROM artifacts WHERE content_key = ?", (content_key,)).fetchone()
+            self._conn.execute("DELETE FROM documents WHERE content_key = ?", (content_key,))
+            self._conn.execute("DELETE FROM artifacts WHERE content_key = ?", (content_key,))
+            self._last_touch.pop(content_key, None)
+        if row:
+            self._remove_file(row["path"])
+        return doc_ids
+
+    def _remove_file(self, path):
+        """Deletes a stored PDF and, through on_discard, the files derived from it."""
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error removing stored artifact {path}: {e}")
+        if self.on_discard:
+            self.on_discard(path)
+
+    # --- Garbage Collection ---
+    def _legacy_files(self, known_paths):
+        """Yields (doc_id, path, stat) of <doc_id>_ocr.pdf files in storage_dir that no artifact owns."""
+        try:
+            entries = list(os.scandir(self.storage_dir))
+        except OSError:
+            return
+        for entry in entries:
+            path = os.path.join(self.storage_dir, entry.name)
+            if entry.name.startswith(".") or not entry.name.endswith(LEGACY_SUFFIX) or path in known_paths:
+                continue
+            try:
+                yield entry.name[:-len(LEGACY_SUFFIX)], path, entry.stat()
+            except OSError:
+                continue # Removed meanwhile
+
+    def gc(self, keep=()):
+        """
+        Deletes least recently accessed artifacts until the store fits its
+        quota. Each PDF counts with its derived files (derived_size), and
+        legacy <doc_id>_ocr.pdf files the store does not index are counted
+        and collected too, by file mtime. Artifacts still processing, in
+        keep, or reported by in_use are never collected.
+
+        Args:
+            keep (iterable of str): Content keys that must not be collected.
+
+        Returns:
+            list of str: doc_ids whose artifact (or legacy file) was deleted.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT content_key, path, status, size, last_access FROM artifacts").fetchall()
+        total = 0
+        candidates = [] # (last access, bytes, content_key or None for a legacy file, doc_id, path)
+        for row in rows:
+            size = row["size"] + (self.derived_size(row["path"]) if self.derived_size else 0)
+            total += size
+            if row["status"] == ARTIFACT_READY and row["content_key"] not in keep:
+                candidates.append((row["last_access"], size, row["content_key"], None, row["path"]))
+        for doc_id, path, file_stat in self._legacy_files({row["path"] for row in rows}):
+            size = file_stat.st_size + (self.derived_size(path) if self.derived_size else 0)
+            total += size
+            candidates.append((file_stat.st_mtime, size, None, doc_id, path))
+        candidates.sort(key=lambda candidate: candidate[0])
+
+        removed_doc_ids = []
+        for _, size, content_key, doc_id, path in candidates:
+            if total <= self.quota_bytes:
+                break
+            if self.in_use and self.in_use(path):
+                continue
+            if content_key is None:
+                print(f"Document store over quota, removing legacy PDF {os.path.basename(path)} ({size} bytes)")
+                self._remove_file(path)
+                removed_doc_ids.append(doc_id)
+            else:
+                print(f"Document store over quota, removing artifact {content_key[:12]} ({size} bytes)")
+                removed_doc_ids += self.discard(content_key)
+            total -= size
+        return removed_doc_ids
+
+    def stats(self):
+        """Returns artifact/doc counts and stored bytes against the quota."""
+        with self._lock:
+            artifacts, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        return {"artifacts": artifacts, "documents": documents, "bytes": total, "quota_bytes": self.quota_bytes}
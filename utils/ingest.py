@@ -0,0 +1,378 @@
+# utils/ingest.py
+import hashlib
+import os
+import re
+import shutil
+import signal
+import subprocess # To run ocrmypdf command
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+import fitz # PyMuPDF - For splitting, merging and inspecting text layers
+import img2pdf # To convert images to PDF
+from PIL import Image # For counting TIFF frames
+
+from utils.cancel import CancelToken, OperationCancelled, CANCEL_POLL_INTERVAL
+
+# --- Configuration ---
+# Path to ocrmypdf executable if not in system PATH
+OCRMYPDF_PATH = os.getenv("OCRMYPDF_EXEC", "ocrmypdf") # Use env var or default
+OCR_SPLIT_THRESHOLD = int(os.getenv("OCR_SPLIT_THRESHOLD", "40")) # PDFs with more pages are OCR'd in parallel ranges
+OCR_CHUNK_PAGES = int(os.getenv("OCR_CHUNK_PAGES", "20")) # Pages per range when splitting
+OCR_REDO_EXISTING = os.getenv("OCR_REDO_EXISTING", "0") == "1" # Use --redo-ocr instead of --skip-text on text pages
+TEXT_LAYER_MIN_CHARS = 20 # A page with fewer extractable characters is treated as a scan
+OCRMYPDF_TERMINATE_GRACE = 10 # Seconds a cancelled ocrmypdf gets to clean up after SIGTERM before it is killed
+# ocrmypdf per-page log lines start with the page number, e.g. "   3 page already has text"
+OCRMYPDF_PAGE_LOG_RE = re.compile(r"^\s*(\d+)\s")
+
+
+def ocr_options():
+    """Settings that change ocrmypdf's output; part of the document store's content key."""
+    return {"redo_ocr": OCR_REDO_EXISTING, "text_layer_min_chars": TEXT_LAYER_MIN_CHARS}
+
+
+class HashingSpoolFile:
+    """
+    Disk-backed file that an uploaded multipart part is written into
+    directly, hashing the bytes as they stream past.
+
+    Used as the werkzeug stream factory result, so a large upload is
+    written to disk once in chunks (no SpooledTemporaryFile + save() copy)
+    and its SHA-256 is known without re-reading it.
+    """
+
+    def __init__(self, directory):
+        fd, self.name = tempfile.mkstemp(dir=directory, suffix=".upload")
+        self._file = os.fdopen(fd, "w+b")
+        self._sha256 = hashlib.sha256()
+        self._moved = False
+        self.size = 0
+
+    def write(self, data):
+        self._sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        """SHA-256 of everything written so far."""
+        return self._sha256.hexdigest()
+
+    def move_to(self, path):
+        """Closes the spool file and renames it to path (same filesystem, no copy)."""
+        self._file.close()
+        os.replace(self.name, path)
+        self.name = path
+        self._moved = True
+
+    def discard(self):
+        """Closes and deletes the spool file if it was not moved."""
+        self._file.close()
+        if not self._moved and os.path.exists(self.name):
+            os.remove(self.name)
+
+    def __getattr__(self, attr):
+        # read/seek/tell/flush/close used by werkzeug's FileStorage
+        return getattr(self._file, attr)
+
+
+def count_input_pages(input_paths):
+    """
+    Counts pages of an upload before any conversion or OCR: PDF pages, or
+    image frames (multi-frame TIFFs count every frame).
+
+    Returns:
+        int: Page count, or None if an input cannot be read.
+    """
+    total = 0
+    try:
+        for path in input_paths:
+            if path.lower().endswith(".pdf"):
+                doc = fitz.open(path)
+                total += len(doc)
+                doc.close()
+            else:
+                with Image.open(path) as img:
+                    total += getattr(img, "n_frames", 1)
+    except Exception as count_err:
+        print(f"Error counting input pages: {count_err}")
+        return None
+    return total
+
+
+def images_to_pdf(image_paths, out_path):
+    """
+    Converts one or more images (multi-frame TIFFs included) into one PDF,
+    one image file at a time: each is converted on its own and appended to
+    out_path with an incremental save, so only one image is held in memory.
+    """
+    for index, image_path in enumerate(image_paths):
+        with fitz.open(stream=img2pdf.convert(image_path), filetype="pdf") as image_pdf:
+            if index == 0:
+                image_pdf.save(out_path)
+                continue
+            with fitz.open(out_path) as doc:
+                doc.insert_pdf(image_pdf)
+                doc.save(out_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+
+
+def adaptive_job_count(queue_depth):
+    """
+    Picks the ocrmypdf --jobs value: all cores when this is the only
+    document being processed, an even share of them when several are.
+
+    Args:
+        queue_depth (int): Documents currently queued or running, including this one.
+
+    Returns:
+        int: Worker count, at least 1.
+    """
+    cores = os.cpu_count() or 1
+    return max(1, cores // max(1, queue_depth))
+
+
+def inspect_text_layer(pdf_path):
+    """
+    Returns one bool per page: True if the page already has a usable text layer.
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        return [len(page.get_text("text").strip()) >= TEXT_LAYER_MIN_CHARS for page in doc]
+    finally:
+        doc.close()
+
+
+def plan_page_ranges(has_text, chunk_pages):
+    """
+    Splits pages into consecutive ranges and chooses an OCR mode for each.
+    The mode is decided per range, not per page: a range is only copied
+    through when every page in it has text, otherwise ocrmypdf runs over
+    the whole range and --skip-text / --redo-ocr take care of its text
+    pages one by one.
+
+    Modes:
+        "skip"  - every page already has text; copied through untouched.
+        "full"  - no page has text (by TEXT_LAYER_MIN_CHARS); OCR'd.
+        "mixed" - some pages have text; OCR'd, ocrmypdf skipping (or
+                  redoing, if OCR_REDO_EXISTING) the text pages.
+
+    Returns:
+        list of dict: {"start": int, "end": int (exclusive), "mode": str}
+    """
+    ranges = []
+    for start in range(0, len(has_text), max(1, chunk_pages)):
+        flags = has_text[start:start + chunk_pages]
+        mode = "skip" if all(flags) else ("full" if not any(flags) else "mixed")
+        ranges.append({"start": start, "end": start + len(flags), "mode": mode})
+    return ranges
+
+
+def ocrmypdf_args(mode, jobs):
+    """
+    Builds the ocrmypdf option list for a range mode (see plan_page_ranges).
+    A "full" range has no text worth redoing, so it always gets --skip-text
+    (and --deskew): a page there can still hold a little text below
+    TEXT_LAYER_MIN_CHARS, which would otherwise abort the run with
+    PriorInputHasText. Only a "mixed" range honours OCR_REDO_EXISTING.
+    """
+    args = ["--output-type", "pdf", "--jobs", str(jobs)]
+    if mode == "mixed" and OCR_REDO_EXISTING:
+        args += ["--redo-ocr", "--clean", "--rotate-pages"] # --redo-ocr is incompatible with --deskew
+    else:
+        args += ["--skip-text", "--deskew", "--clean", "--rotate-pages"]
+    # args += ["-l", "eng"] # Add language if needed
+    return args
+
+
+def terminate_process_group(proc, grace=OCRMYPDF_TERMINATE_GRACE):
+    """
+    Stops a child started with start_new_session=True together with its own
+    workers: SIGTERM to the process group (ocrmypdf removes its temporary
+    files on it), then SIGKILL if it is still running after grace seconds.
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        print(f"ocrmypdf (pid {proc.pid}) ignored SIGTERM for {grace}s, killing it")
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except ProcessLookupError:
+        pass # Already exited
+
+
+def run_ocrmypdf(input_pdf, output_pdf, args, on_page=None, cancel=None):
+    """
+    Runs ocrmypdf as a child process and streams its log.
+
+    Args:
+        input_pdf (str): PDF to OCR.
+        output_pdf (str): Destination path.
+        args (list): Options from ocrmypdf_args().
+        on_page (callable, optional): Called with each newly reached 1-based page number.
+        cancel (CancelToken, optional): Terminates ocrmypdf (and its worker
+            processes) once cancelled or past its deadline.
+
+    Raises:
+        OperationCancelled: If ocrmypdf was stopped through cancel.
+        Exception: If ocrmypdf exits with a non-zero code.
+    """
+    if cancel is not None:
+        cancel.check()
+    command = [OCRMYPDF_PATH, *args, input_pdf, output_pdf]
+    print(f"Running ocrmypdf: {' '.join(command)}")
+    # Stream the combined output so per-page log lines can drive progress.
+    # Its own session, so a cancel can signal ocrmypdf and its workers as one group.
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, start_new_session=True)
+    watcher = None
+    if cancel is not None:
+        def watch():
+            while proc.poll() is None:
+                if cancel.wait(CANCEL_POLL_INTERVAL):
+                    print(f"Stopping ocrmypdf for {input_pdf}: {cancel.reason}")
+                    terminate_process_group(proc)
+                    return
+        watcher = threading.Thread(target=watch, name="ocrmypdf-cancel", daemon=True)
+        watcher.start()
+    output_lines = []
+    pages_seen = 0
+    for line in proc.stdout:
+        output_lines.append(line)
+        # ocrmypdf prefixes per-page log lines with the 1-based page number
+        page_match = OCRMYPDF_PAGE_LOG_RE.match(line)
+        if page_match and int(page_match.group(1)) > pages_seen:
+            pages_seen = int(page_match.group(1))
+            if on_page: on_page(pages_seen)
+    returncode = proc.wait()
+    if watcher is not None:
+        watcher.join()
+
+    if cancel is not None and cancel.cancelled:
+        raise OperationCancelled(cancel.reason)
+    print("ocrmypdf output:\n", "".join(output_lines))
+    if returncode != 0:
+        raise Exception(f"ocrmypdf failed with return code {returncode}. Check logs.")
+
+
+def extract_page_range(src_pdf, start, end, out_path):
+    """Writes pages [start, end) of src_pdf to a new PDF."""
+    src = fitz.open(src_pdf)
+    out = fitz.open()
+    try:
+        out.insert_pdf(src, from_page=start, to_page=end - 1)
+        out.save(out_path)
+    finally:
+        out.close()
+        src.close()
+
+
+def ocr_pdf(input_pdf, output_pdf, work_dir, queue_depth=1, progress=None, cancel=None):
+    """
+    OCRs a PDF, skipping pages that are already searchable and splitting
+    large documents into page ranges that run in parallel.
+
+    Small documents go through a single ocrmypdf run (or are copied as-is if
+    every page has text). Documents over OCR_SPLIT_THRESHOLD pages are cut
+    into OCR_CHUNK_PAGES ranges; each range gets its own mode, the ranges
+    run concurrently sharing the adaptive job budget, and the results are
+    merged back in order with PyMuPDF. If one range fails, the ocrmypdf
+    runs of the others are stopped and its error is raised.
+
+    Args:
+        input_pdf (str): Source PDF.
+        output_pdf (str): Destination for the OCR'd PDF.
+        work_dir (str): Directory for temporary range files.
+        queue_depth (int): Documents queued or running, used to size --jobs.
+        progress (callable, optional): Called with the total pages finished so far.
+        cancel (CancelToken, optional): Stops every running ocrmypdf process and
+            skips ranges not started yet (see run_ocrmypdf).
+
+    Returns:
+        dict: {"page_count", "jobs", "ranges", "skipped_pages"} describing the run.
+
+    Raises:
+        OperationCancelled: If the run was cancelled.
+    """
+    has_text = inspect_text_layer(input_pdf)
+    page_count = len(has_text)
+    jobs = adaptive_job_count(queue_depth)
+    chunk_pages = OCR_CHUNK_PAGES if page_count > OCR_SPLIT_THRESHOLD else max(1, page_count)
+    ranges = plan_page_ranges(has_text, chunk_pages)
+    summary = {"page_count": page_count, "jobs": jobs, "ranges": ranges, "skipped_pages": sum(has_text)}
+    print(f"OCR plan for {input_pdf}: {page_count} pages, {len(ranges)} range(s), "
+          f"{summary['skipped_pages']} page(s) already searchable, --jobs {jobs}")
+
+    if all(r["mode"] == "skip" for r in ranges):
+        shutil.copyfile(input_pdf, output_pdf) # Digital-born: nothing to OCR
+        if progress: progress(page_count)
+        return summary
+
+    if len(ranges) == 1:
+        run_ocrmypdf(input_pdf, output_pdf, ocrmypdf_args(ranges[0]["mode"], jobs), on_page=progress, cancel=cancel)
+        return summary
+
+    # --- Parallel page ranges ---
+    run_id = uuid.uuid4().hex
+    lock = threading.Lock()
+    range_done = [0] * len(ranges)
+    ocr_ranges = [i for i, r in enumerate(ranges) if r["mode"] != "skip"]
+    parallel = min(len(ocr_ranges), jobs)
+    jobs_per_range = max(1, jobs // max(1, parallel))
+    range_outputs = {}
+    ranges_cancel = (cancel or CancelToken()).child() # Also stops the other ranges when one fails
+
+    def report(index, pages):
+        with lock:
+            range_done[index] = pages
+            if progress: progress(sum(range_done))
+
+    def process_range(index):
+        r = ranges[index]
+        ranges_cancel.check()
+        range_input = os.path.join(work_dir, f"{run_id}_range{index}_in.pdf")
+        range_output = os.path.join(work_dir, f"{run_id}_range{index}_out.pdf")
+        extract_page_range(input_pdf, r["start"], r["end"], range_input)
+        try:
+            run_ocrmypdf(range_input, range_output, ocrmypdf_args(r["mode"], jobs_per_range),
+                         on_page=lambda pages: report(index, pages), cancel=ranges_cancel)
+        finally:
+            if os.path.exists(range_input): os.remove(range_input)
+        report(index, r["end"] - r["start"])
+        return range_output
+
+    try:
+        for index, r in enumerate(ranges):
+            if r["mode"] == "skip": report(index, r["end"] - r["start"])
+        with ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="ocrmypdf-range") as pool:
+            futures = {index: pool.submit(process_range, index) for index in ocr_ranges}
+            done, _ = wait(futures.values(), return_when=FIRST_EXCEPTION)
+            errors = [future.exception() for future in futures.values() if future in done and future.exception() is not None]
+            if errors:
+                # Terminate the sibling ranges' ocrmypdf runs; the pool exit waits until they are gone
+                ranges_cancel.cancel("another page range failed")
+                raise next((e for e in errors if not isinstance(e, OperationCancelled)), errors[0])
+            for index, future in futures.items():
+                range_outputs[index] = future.result()
+
+        # --- Merge ranges back in page order ---
+        src = fitz.open(input_pdf)
+        merged = fitz.open()
+        try:
+            for index, r in enumerate(ranges):
+                if index in range_outputs:
+                    part = fitz.open(range_outputs[index])
+                    merged.insert_pdf(part)
+                    part.close()
+                else:
+                    merged.insert_pdf(src, from_page=r["start"], to_page=r["end"] - 1)
+            merged.save(output_pdf, garbage=3, deflate=True)
+        finally:
+            merged.close()
+            src.close()
+        return summary
+    finally:
+        # Remove every range file of this run, including those of ranges that failed
+        for name in os.listdir(work_dir):
+            if name.startswith(run_id):
+                os.remove(os.path.join(work_dir, name))
@@ -0,0 +1,411 @@
+# utils/jobs.py
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from utils.cancel import CancelToken, OperationCancelled, CANCEL_POLL_INTERVAL
+
+# --- Configuration ---
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3") # SQLite file holding job status
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2")) # Concurrent ocrmypdf runs
+OCR_MAX_PENDING = int(os.getenv("OCR_MAX_PENDING", "16")) # Queued + running jobs before uploads are refused
+OCR_MAX_BATCH_PENDING = int(os.getenv("OCR_MAX_BATCH_PENDING", "256")) # Same limit for batch jobs
+OCR_INTERACTIVE_RESERVED = int(os.getenv("OCR_INTERACTIVE_RESERVED", "1")) # Workers batch jobs may never occupy
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "0")) # Seconds a job may run before it is cancelled (0 = no limit)
+
+# Scheduling priorities, lower runs first
+PRIORITY_INTERACTIVE = 0 # Uploads and analysis started from the UI
+PRIORITY_BATCH = 1 # Bulk work submitted through /batches
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+# Job states, in lifecycle order
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds its maximum number of pending jobs."""
+
+
+class PriorityLimiter:
+    """
+    Concurrency budget that hands free slots to interactive callers first.
+
+    Batch callers wait while any interactive caller is waiting and may hold
+    at most limit - reserved slots, so a backfill never takes the whole
+    budget away from the UI.
+    """
+
+    def __init__(self, limit, reserved=OCR_INTERACTIVE_RESERVED):
+        self.limit = max(1, limit)
+        self.batch_limit = max(1, self.limit - reserved)
+        self._cond = threading.Condition()
+        self._active = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+
+    def _can_enter(self, priority):
+        if sum(self._active.values()) >= self.limit:
+            return False
+        if priority == PRIORITY_BATCH:
+            return self._waiting[PRIORITY_INTERACTIVE] == 0 and self._active[PRIORITY_BATCH] < self.batch_limit
+        return True
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE, cancel=None):
+        """
+        Blocks until a slot is free for this priority and holds it for the
+        with-block. Raises OperationCancelled if cancel (a CancelToken) is
+        cancelled while waiting.
+        """
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while not self._can_enter(priority):
+                    if cancel is not None:
+                        cancel.check()
+                    self._cond.wait(CANCEL_POLL_INTERVAL if cancel is not None else None)
+            finally:
+                self._waiting[priority] -= 1
+            self._active[priority] += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[priority] -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        """Returns slot usage and waiters per priority."""
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "batch_limit": self.batch_limit,
+                "active": {PRIORITY_NAMES[p]: n for p, n in self._active.items()},
+                "waiting": {PRIORITY_NAMES[p]: n for p, n in self._waiting.items()},
+            }
+
+
+class JobQueue:
+    """
+    Bounded in-process worker pool with job status persisted in SQLite.
+
+    Work runs on a fixed set of worker threads (the heavy lifting happens in
+    child processes such as ocrmypdf, so threads are enough to drive it).
+    Queued jobs are started in priority order, interactive before batch,
+    and batch jobs never occupy the reserved_workers kept for interactive
+    ones. Status lives in a small SQLite table so any request thread can
+    poll it and so finished results survive a restart. Jobs that were still
+    queued or running when the process died are marked failed on startup
+    and listed in interrupted, so the owner can submit them again. Queues
+    may share one database: each row records the name of the queue that
+    ran it, and each queue only sweeps its own rows.
+
+    Every job gets a CancelToken (with a job_timeout deadline if set) that
+    its function fetches with cancel_token(); cancel() drops a queued job
+    (calling its on_cancel cleanup, since the function never runs) or
+    cancels a running one's token.
+    """
+
+    def __init__(self, db_path=JOBS_DB_PATH, max_workers=OCR_WORKERS, max_pending=OCR_MAX_PENDING,
+                 max_batch_pending=OCR_MAX_BATCH_PENDING, reserved_workers=OCR_INTERACTIVE_RESERVED, name="ocr-job",
+                 job_timeout=JOB_TIMEOUT):
+        self.db_path = db_path
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.max_batch_pending = max(1, max_batch_pending)
+        self.batch_workers = max(1, self.max_workers - reserved_workers)
+        self.job_timeout = job_timeout
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._running_batch = 0
+        self._queue = [] # heap of (priority, seq, job_id, func, args, kwargs)
+        self._tokens = {} # job_id -> CancelToken of queued and running jobs
+        self._on_cancel = {} # job_id -> cleanup of a queued job that is cancelled before it starts
+        self._seq = itertools.count()
+        self._closed = False
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self.interrupted = [] # Jobs a previous process left queued or running (job dicts, as from get())
+        self._init_db()
+        self._workers = [threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True) for i in range(self.max_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _init_db(self):
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    page_count INTEGER,
+                    pages_done INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    meta TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    queue TEXT
+                )"""
+            )
+            if "queue" not in [row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")]:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN queue TEXT") # Rows written before queues were told apart stay NULL
+            # Anything still active belongs to a previous process and will never finish
+            rows = self._conn.execute("SELECT * FROM jobs WHERE queue = ? AND status IN (?, ?)", (self.name, *ACTIVE_STATUSES)).fetchall()
+            self.interrupted = [{**dict(row), "meta": json.loads(row["meta"]) if row["meta"] else {}} for row in rows]
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE (queue = ? OR queue IS NULL) AND status IN (?, ?)",
+                (STATUS_FAILED, "Interrupted by server restart", time.time(), self.name, *ACTIVE_STATUSES),
+            )
+
+    # --- Status Access ---
+    def get(self, job_id):
+        """
+        Returns the status record for a job.
+
+        Args:
+            job_id (str): Job identifier (the doc_id for upload jobs).
+
+        Returns:
+            dict: Job fields, or None if the job is unknown.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["meta"] = json.loads(job["meta"]) if job["meta"] else {}
+        return job
+
+    def update(self, job_id, **fields):
+        """
+        Updates status fields of a job. Extra keys are merged into the job's meta dict.
+
+        Args:
+            job_id (str): Job identifier.
+            **fields: Column values (status, page_count, pages_done, error, ...) or meta entries.
+        """
+        columns = {"status", "page_count", "pages_done", "error", "started_at", "finished_at"}
+        updates = {k: v for k, v in fields.items() if k in columns}
+        meta_updates = {k: v for k, v in fields.items() if k not in columns}
+        with self._lock, self._conn:
+            if meta_updates:
+                row = self._conn.execute("SELECT meta FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                meta = json.loads(row["meta"]) if row and row["meta"] else {}
+                meta.update(meta_updates)
+                updates["meta"] = json.dumps(meta)
+            if not updates:
+                return
+            assignments = ", ".join(f"{col} = ?" for col in updates)
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*updates.values(), job_id))
+
+    def status_counts(self):
+        """Returns {kind: {status: count}} over the jobs this queue has recorded."""
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, status, COUNT(*) AS n FROM jobs WHERE queue = ? GROUP BY kind, status", (self.name,)).fetchall()
+        counts = {}
+        for row in rows:
+            counts.setdefault(row["kind"], {})[row["status"]] = row["n"]
+        return counts
+
+    def failed_jobs(self, limit=20):
+        """Returns (job_id, kind, error) of this queue's most recently failed jobs."""
+        with self._lock:
+            rows = self._conn.execute("SELECT job_id, kind, error FROM jobs WHERE queue = ? AND status = ? ORDER BY finished_at DESC LIMIT ?",
+                                      (self.name, STATUS_FAILED, limit)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def pending_count(self, priority=None):
+        """Returns the number of queued plus running jobs in this process, optionally of one priority."""
+        with self._lock:
+            return sum(self._pending.values()) if priority is None else self._pending[priority]
+
+    def is_full(self, priority=PRIORITY_INTERACTIVE):
+        """True if submit() at this priority would raise QueueFullError."""
+        limit = self.max_pending if priority == PRIORITY_INTERACTIVE else self.max_batch_pending
+        return self.pending_count(priority) >= limit
+
+    # --- Submission ---
+    def submit(self, job_id, kind, func, *args, page_count=None, priority=PRIORITY_INTERACTIVE, on_cancel=None, **kwargs):
+        """
+        Records a new job and schedules func(job_id, *args, **kwargs) on the pool.
+
+        The function may report progress through update(); its return value is
+        ignored. An exception marks the job failed with the exception message.
+
+        Args:
+            job_id (str): Job identifier.
+            kind (str): Short label for the type of work (e.g. "ocrmypdf").
+            func (callable): Work function, called with job_id first.
+            page_count (int, optional): Page count if known before the work starts.
+            priority (int, optional): PRIORITY_INTERACTIVE or PRIORITY_BATCH.
+            on_cancel (callable, optional): Called with job_id if the job is
+                cancelled while still queued, to release what func would
+                have cleaned up (input files, reserved store entries).
+
+        Raises:
+            QueueFullError: If the priority's pending limit is already reached.
+        """
+        limit = self.max_pending if priority == PRIORITY_INTERACTIVE else self.max_batch_pending
+        with self._lock:
+            if self._closed:
+                raise QueueFullError("Job queue is shutting down")
+            if self._pending[priority] >= limit:
+                raise QueueFullError(f"Job queue is full ({self._pending[priority]} {PRIORITY_NAMES[priority]} pending)")
+            self._pending[priority] += 1
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO jobs (job_id, kind, status, page_count, pages_done, meta, created_at, queue) VALUES (?, ?, ?, ?, 0, ?, ?, ?)",
+                    (job_id, kind, STATUS_QUEUED, page_count, json.dumps({"priority": PRIORITY_NAMES[priority]}), time.time(), self.name),
+                )
+            heapq.heappush(self._queue, (priority, next(self._seq), job_id, func, args, kwargs))
+            self._tokens[job_id] = CancelToken()
+            if on_cancel is not None:
+                self._on_cancel[job_id] = on_cancel
+            self._wakeup.notify()
+
+    def add_record(self, job_id, kind, status=STATUS_DONE, page_count=None, **meta):
+        """
+        Records a job that does not run on the pool: an upload answered from
+        the document store, or a batch whose members are separate jobs.
+        """
+        now = time.time()
+        finished_at = now if status not in ACTIVE_STATUSES else None
+        pages_done = (page_count or 0) if status == STATUS_DONE else 0
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, kind, status, page_count, pages_done, meta, created_at, started_at, finished_at, queue) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, status, page_count, pages_done, json.dumps(meta), now, now, finished_at, self.name),
+            )
+
+    # --- Cancellation ---
+    def active_job_ids(self):
+        """Ids of the jobs queued or running in this process."""
+        with self._lock:
+            return list(self._tokens)
+
+    def cancel_token(self, job_id):
+        """Returns the CancelToken of a queued or running job, or None."""
+        with self._lock:
+            return self._tokens.get(job_id)
+
+    def cancel(self, job_id, reason="cancelled"):
+        """
+        Cancels a job of this queue. A queued job is removed right away and
+        its on_cancel cleanup runs; a running job's token is cancelled, and
+        the job is marked cancelled once its function notices and raises
+        OperationCancelled.
+
+        Returns:
+            str: The job's status before the call (queued or running), or None
+                if it is not active in this queue.
+        """
+        with self._wakeup:
+            for index, entry in enumerate(self._queue):
+                if entry[2] == job_id:
+                    self._queue.pop(index)
+                    heapq.heapify(self._queue)
+                    self._pending[entry[0]] -= 1
+                    self._tokens.pop(job_id, None)
+                    on_cancel = self._on_cancel.pop(job_id, None)
+                    self._wakeup.notify_all()
+                    break
+            else:
+                token = self._tokens.get(job_id)
+                if token is None:
+                    return None
+                token.cancel(reason)
+                return STATUS_RUNNING
+        self.update(job_id, status=STATUS_CANCELLED, error=reason, finished_at=time.time())
+        if on_cancel is not None:
+            try:
+                on_cancel(job_id)
+            except Exception as e:
+                print(f"Cleanup of cancelled job {job_id} failed: {e}")
+        return STATUS_QUEUED
+
+    # --- Workers ---
+    def _next_runnable(self):
+        """Head of the queue if it may start now (batch jobs leave reserved workers free)."""
+        if not self._queue:
+            return None
+        if self._queue[0][0] == PRIORITY_BATCH and self._running_batch >= self.batch_workers:
+            return None
+        return heapq.heappop(self._queue)
+
+    def _worker(self):
+        while True:
+            with self._wakeup:
+                entry = self._next_runnable()
+                while entry is None:
+                    if self._closed and not self._queue:
+                        return
+                    self._wakeup.wait()
+                    entry = self._next_runnable()
+                if entry[0] == PRIORITY_BATCH:
+                    self._running_batch += 1
+            priority, _, job_id, func, args, kwargs = entry
+            self._run(job_id, priority, func, args, kwargs)
+
+    def _run(self, job_id, priority, func, args, kwargs):
+        if self.job_timeout:
+            with self._lock:
+                self._tokens[job_id].deadline = time.time() + self.job_timeout # Counted from the start, not from submission
+        self.update(job_id, status=STATUS_RUNNING, started_at=time.time())
+        try:
+            func(job_id, *args, **kwargs)
+            self.update(job_id, status=STATUS_DONE, finished_at=time.time())
+        except OperationCancelled as e:
+            print(f"Job {job_id} cancelled: {e}")
+            self.update(job_id, status=STATUS_CANCELLED, error=str(e), finished_at=time.time())
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            traceback.print_exc()
+            self.update(job_id, status=STATUS_FAILED, error=str(e), finished_at=time.time())
+        finally:
+            with self._wakeup:
+                self._tokens.pop(job_id, None)
+                self._on_cancel.pop(job_id, None)
+                self._pending[priority] -= 1
+                if priority == PRIORITY_BATCH:
+                    self._running_batch -= 1
+                self._wakeup.notify_all()
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stops accepting work and optionally waits for queued and running jobs to finish.
+
+        Args:
+            wait (bool): Join the workers, which exit once the queue is drained.
+            timeout (float, optional): Seconds to wait in total. Jobs still
+                unfinished then are left to the daemon threads and are marked
+                failed by the next startup.
+
+        Returns:
+            bool: True if every job finished.
+        """
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify_all()
+        if not wait:
+            return False
+        deadline = None if timeout is None else time.time() + timeout
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(0.0, deadline - time.time()))
+        if any(worker.is_alive() for worker in self._workers):
+            return False
+        with self._lock:
+            self._conn.close()
+        return True
@@ -0,0 +1,186 @@
+# utils/metrics.py
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# --- Configuration ---
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0" # Global switch for spans, counters and /metrics
+SLOW_SPAN_SECONDS = float(os.getenv("SLOW_SPAN_SECONDS", "0")) # Log spans slower than this (0 disables)
+# Histogram bucket upper bounds in seconds, from a cached page image up to a long ocrmypdf run
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+METRICS_PREFIX = "gotocr_"
+
+METRIC_HELP = {
+    "stage_duration_seconds": "Time spent in one pipeline stage (pdf_open, page_render, png_encode, got_ocr_request, ...)",
+    "http_request_duration_seconds": "Time until the response is returned to the server (first byte for streamed responses)",
+    "http_requests_total": "HTTP requests by endpoint, method and status code",
+    "got_ocr_requests_total": "GOT-OCR HTTP attempts by task and outcome",
+    "got_ocr_retries_total": "GOT-OCR attempts retried after a transient failure",
+    "analyze_pages_skipped_total": "Pages of document analysis answered without GOT-OCR (blank, or a repeat of an earlier page)",
+    "ocr_image_bytes_total": "Page image bytes sent to GOT-OCR, and saved against an uncompressed RGB render at the analysis DPI",
+}
+
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+class MetricsRegistry:
+    """
+    In-process counters and latency histograms, rendered in the Prometheus
+    text format.
+
+    Series are keyed by metric name plus a sorted tuple of label pairs, so
+    label values must come from small fixed sets (route rules, stage names,
+    outcomes), never from doc_ids. Values that already live elsewhere
+    (queue depth, cache hit counts) are not copied here: collectors
+    registered with add_collector() report them when /metrics is scraped.
+
+    span() also records each stage into the current trace, if one was
+    started with start_trace(), so a request can report its own breakdown
+    (the app sends it as a Server-Timing header).
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED, buckets=LATENCY_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {} # name -> {label tuple: value}
+        self._histograms = {} # name -> {label tuple: [bucket counts..., sum, count]}
+        self._collectors = []
+
+    # --- Recording ---
+    def inc(self, name, amount=1, **labels):
+        """Adds amount to a counter."""
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        """Records one observation in a latency histogram."""
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                values[index] += 1 # Cumulated when rendered
+            values[-2] += seconds
+            values[-1] += 1
+
+    def record(self, stage, seconds):
+        """Records a stage duration measured by the caller (see span())."""
+        if not self.enabled:
+            return
+        self.observe("stage_duration_seconds", seconds, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.append((stage, seconds))
+        if SLOW_SPAN_SECONDS and seconds >= SLOW_SPAN_SECONDS:
+            print(f"Slow stage: stage={stage} seconds={seconds:.3f}")
+
+    @contextmanager
+    def span(self, stage):
+        """Times the with-block as one stage, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    # --- Per-Request Traces ---
+    @staticmethod
+    def start_trace():
+        """Starts collecting the spans of the current context. Returns a token for end_trace()."""
+        return _current_trace.set([])
+
+    @staticmethod
+    def end_trace(token):
+        """
+        Stops the trace started with token.
+
+        Returns:
+            dict: stage -> total seconds, in first-seen order.
+        """
+        trace = _current_trace.get() or []
+        _current_trace.reset(token)
+        totals = {}
+        for stage, seconds in trace:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    # --- Exposition ---
+    def add_collector(self, collector):
+        """
+        Registers a callable run on every render(). It returns samples as
+        (name, type, labels dict, value) with type "gauge" or "counter".
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {key: list(values) for key, values in series.items()} for name, series in self._histograms.items()}
+            collectors = list(self._collectors)
+
+        lines = []
+        def header(name, metric_type):
+            if name in METRIC_HELP:
+                lines.append(f"# HELP {METRICS_PREFIX}{name} {METRIC_HELP[name]}")
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} {metric_type}")
+
+        for name in sorted(counters):
+            header(name, "counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{METRICS_PREFIX}{name}{_format_labels(dict(key))} {_format_value(value)}")
+
+        for name in sorted(histograms):
+            header(name, "histogram")
+            for key, values in sorted(histograms[name].items()):
+                labels = dict(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets, values):
+                    cumulative += count
+                    lines.append(f"{METRICS_PREFIX}{name}_bucket{_format_labels({**labels, 'le': _format_value(float(bound))})} {cumulative}")
+                lines.append(f"{METRICS_PREFIX}{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {values[-1]}")
+                lines.append(f"{METRICS_PREFIX}{name}_sum{_format_labels(labels)} {_format_value(float(values[-2]))}")
+                lines.append(f"{METRICS_PREFIX}{name}_count{_format_labels(labels)} {values[-1]}")
+
+        collected = {}
+        for collector in collectors:
+            try:
+                for name, metric_type, labels, value in collector():
+                    collected.setdefault((name, metric_type), []).append((labels, value))
+            except Exception as e:
+                print(f"Error collecting metrics from {collector}: {e}")
+        for (name, metric_type), samples in sorted(collected.items()):
+            header(name, metric_type)
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f"{METRICS_PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry shared by the app and utils modules
+metrics = MetricsRegistry()
@@ -1,45 +1,336 @@
 # utils/ocr.py
 import requests
+from requests.adapters import HTTPAdapter
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import io
 import os
+import random
+import cv2 # For encoding numpy images
+import numpy as np
 from dotenv import load_dotenv
-import time # For potential delays/retries if needed, though not used currently
+import threading
+import time # For retry backoff and the circuit breaker clock
+from utils.cache import create_ocr_result_cache
+from utils.jobs import PriorityLimiter, PRIORITY_INTERACTIVE, PRIORITY_NAMES
+from utils.cancel import OperationCancelled, cancellable_executor
+from utils.metrics import metrics
 
 load_dotenv() # Load environment variables from .env file if present
 
 # --- Configuration ---
 GOT_OCR_SERVICE_URL = os.getenv("GOT_OCR_SERVICE_URL", "http://127.0.0.1:3000/process") # Default if not in .env
 REQUEST_TIMEOUT = 120 # Increased timeout in seconds for potentially long OCR operations
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") != "0" # Global switch for the result cache
+# Client pooling / resilience settings
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", "8")) # Keep-alive connections (and async concurrency) per client
+OCR_MAX_RETRIES = int(os.getenv("OCR_MAX_RETRIES", "2")) # Extra attempts on 5xx, timeouts and connection errors
+OCR_BACKOFF_BASE = float(os.getenv("OCR_BACKOFF_BASE", "1.0")) # Seconds; doubled per attempt, with +/-50% jitter
+OCR_BACKOFF_MAX = 30.0
+OCR_CIRCUIT_THRESHOLD = int(os.getenv("OCR_CIRCUIT_THRESHOLD", "5")) # Consecutive failures that open the circuit
+OCR_CIRCUIT_RESET = float(os.getenv("OCR_CIRCUIT_RESET", "30")) # Seconds before a trial call is let through
+GOT_OCR_MAX_CONCURRENCY = int(os.getenv("GOT_OCR_MAX_CONCURRENCY", str(OCR_POOL_SIZE))) # Requests in flight to GOT-OCR, all callers
+GOT_OCR_MULTI_IMAGE = os.getenv("GOT_OCR_MULTI_IMAGE", "0") == "1" # Service accepts several 'images' parts per request
+AREA_MAX_IN_FLIGHT = int(os.getenv("AREA_MAX_IN_FLIGHT", "8")) # Concurrent area calls of one batched request
+# Logging: per-call progress lines and raw response dumps are off the hot path unless enabled
+OCR_LOG_VERBOSE = os.getenv("OCR_LOG_VERBOSE", "0") == "1" # "Calling GOT-OCR ..." / success lines
+OCR_LOG_RAW_SAMPLE = float(os.getenv("OCR_LOG_RAW_SAMPLE", "0")) # Share of raw responses printed (0..1)
+OCR_LOG_RAW_MAX_CHARS = 2000 # Raw responses are truncated to this length
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling GOT-OCR while the circuit breaker is open."""
+
+
+class GotOcrClient:
+    """
+    Reusable GOT-OCR client with a keep-alive connection pool.
+
+    Transient failures (5xx, timeouts, connection errors) are retried with
+    exponential backoff and jitter. After OCR_CIRCUIT_THRESHOLD consecutive
+    failures the circuit opens and calls fail immediately for
+    OCR_CIRCUIT_RESET seconds, after which one trial call decides whether
+    it closes again. At most max_concurrency requests are in flight; batch
+    callers queue behind interactive ones (see PriorityLimiter). The
+    a*-methods run calls on a bounded executor for asyncio callers.
+    """
+
+    def __init__(self, service_url=GOT_OCR_SERVICE_URL, pool_size=OCR_POOL_SIZE, max_retries=OCR_MAX_RETRIES,
+                 backoff_base=OCR_BACKOFF_BASE, failure_threshold=OCR_CIRCUIT_THRESHOLD, reset_timeout=OCR_CIRCUIT_RESET,
+                 max_concurrency=GOT_OCR_MAX_CONCURRENCY):
+        self.service_url = service_url
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None # Time the circuit opened, None while closed
+        self._async_executor = None
+        self._pool_size = pool_size
+        self.limiter = PriorityLimiter(max_concurrency)
+
+    # --- Circuit Breaker ---
+    def _check_circuit(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.time() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError("OCR service circuit is open after repeated failures")
+            self._opened_at = time.time() # Half-open: let this call through, keep others failing fast
+
+    def _record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+
+    def _record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"GOT-OCR circuit opened after {self._consecutive_failures} consecutive failures")
+                self._opened_at = time.time()
+
+    def circuit_state(self):
+        """Returns "closed" or "open" plus the current consecutive failure count."""
+        with self._lock:
+            return {"state": "closed" if self._opened_at is None else "open", "consecutive_failures": self._consecutive_failures}
+
+    # --- HTTP ---
+    def post(self, files, payload, timeout=REQUEST_TIMEOUT, priority=PRIORITY_INTERACTIVE, cancel=None):
+        """
+        POSTs a multipart request to the service, retrying transient failures.
+
+        Args:
+            files (dict or list): requests files= mapping or list of (field, file tuple);
+                file objects must be seekable.
+            payload (dict): Form fields (task, ocr_type, ocr_box, ...).
+            timeout (float): Per-attempt timeout in seconds.
+            priority (int): Scheduling priority for a concurrency slot, held per attempt.
+            cancel (CancelToken, optional): Stops waiting for a slot or a retry once
+                cancelled; attempts are capped to the time left before its deadline.
+
+        Returns:
+            requests.Response: A successful (2xx) response.
+
+        Raises:
+            CircuitOpenError: If the circuit is open.
+            OperationCancelled: If cancel was cancelled or its deadline passed.
+            requests.exceptions.RequestException: If all attempts failed.
+        """
+        task = payload.get('task', 'unknown')
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._check_circuit()
+            except CircuitOpenError:
+                metrics.inc("got_ocr_requests_total", task=task, outcome="circuit_open")
+                raise
+            for _, file_obj, _ in (files.values() if isinstance(files, dict) else (f for _, f in files)):
+                file_obj.seek(0) # Rewind the body for each attempt
+            outcome = "ok"
+            try:
+                wait_started = time.perf_counter()
+                with self.limiter.slot(priority, cancel): # Released during backoff sleeps
+                    metrics.record(f"got_ocr_slot_wait_{PRIORITY_NAMES[priority]}", time.perf_counter() - wait_started)
+                    attempt_timeout = cancel.timeout(timeout) if cancel is not None else timeout
+                    with metrics.span("got_ocr_request"): # Network plus model time, as seen by this client
+                        response = self.session.post(self.service_url, files=files, data=payload, timeout=attempt_timeout)
+                if response.status_code < 500:
+                    if response.status_code >= 400: outcome = "client_error"
+                    self._record_success() # The service answered; 4xx is the caller's problem
+                    response.raise_for_status()
+                    return response
+                outcome = "server_error"
+                response.raise_for_status() # 5xx -> HTTPError, retried below
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
+                if isinstance(e, requests.exceptions.Timeout): outcome = "timeout"
+                elif isinstance(e, requests.exceptions.ConnectionError): outcome = "connection_error"
+                if outcome == "client_error":
+                    raise
+                self._record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                delay = min(OCR_BACKOFF_MAX, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+                print(f"GOT-OCR call failed ({e}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                metrics.inc("got_ocr_retries_total", task=task)
+                if cancel is not None:
+                    cancel.sleep(delay)
+                else:
+                    time.sleep(delay)
+            except OperationCancelled:
+                outcome = "cancelled"
+                raise
+            finally:
+                metrics.inc("got_ocr_requests_total", task=task, outcome=outcome)
+
+    # --- Task Helpers ---
+    def ocr_area(self, image, box_coordinates_str=None, **kwargs):
+        """Same as call_got_ocr_area, using this client."""
+        return call_got_ocr_area(image, box_coordinates_str, client=self, **kwargs)
+
+    def format_text(self, image, **kwargs):
+        """Same as call_got_ocr_format_text, using this client."""
+        return call_got_ocr_format_text(image, client=self, **kwargs)
+
+    # --- asyncio Variants ---
+    async def _run_async(self, func, *args, **kwargs):
+        with self._lock:
+            if self._async_executor is None:
+                self._async_executor = ThreadPoolExecutor(max_workers=self._pool_size, thread_name_prefix="got-ocr")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._async_executor, functools.partial(func, *args, **kwargs))
+
+    async def aocr_area(self, image, box_coordinates_str=None, **kwargs):
+        """Awaitable ocr_area; at most pool_size calls run at once."""
+        return await self._run_async(self.ocr_area, image, box_coordinates_str, **kwargs)
+
+    async def aformat_text(self, image, **kwargs):
+        """Awaitable format_text; at most pool_size calls run at once."""
+        return await self._run_async(self.format_text, image, **kwargs)
 
 # --- Function Definitions ---
 
-def call_got_ocr_area(image_path, box_coordinates_str=None):
+def get_default_client():
+    """Returns the process-wide GotOcrClient (created on first use)."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = GotOcrClient()
+        return _default_client
+
+
+def _log_verbose(message):
+    """Prints a per-call progress line if OCR_LOG_VERBOSE is set."""
+    if OCR_LOG_VERBOSE:
+        print(message)
+
+
+def _log_raw_response(task_desc, response_data):
+    """Prints a sampled, truncated copy of a raw GOT-OCR response (OCR_LOG_RAW_SAMPLE)."""
+    if OCR_LOG_RAW_SAMPLE > 0 and random.random() < OCR_LOG_RAW_SAMPLE:
+        print(f"GOT-OCR {task_desc} Raw Response: {str(response_data)[:OCR_LOG_RAW_MAX_CHARS]}")
+
+
+def get_ocr_result_cache():
+    """Returns the shared GOT-OCR result cache (opened on first use), or None if disabled."""
+    global _result_cache
+    if not OCR_CACHE_ENABLED:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = create_ocr_result_cache()
+        return _result_cache
+
+
+def _cached_result(image_upload, payload, use_cache):
+    """Looks up a previous result for this image + payload. Returns (cache key, text or None)."""
+    cache = get_ocr_result_cache() if use_cache else None
+    if cache is None:
+        return None, None
+    with metrics.span("ocr_cache_lookup"): # Hashing the image plus the SQLite read
+        key = cache.make_key(image_upload.getvalue(), payload)
+        return key, cache.get(key)
+
+
+def _store_result(cache_key, text):
+    """Saves a successful result under the key returned by _cached_result."""
+    if cache_key is not None:
+        get_ocr_result_cache().put(cache_key, text)
+
+
+def _prepare_image_upload(image, default_name="image.png"):
     """
-    Calls the GOT-OCR service for a specific image path.
+    Normalizes the supported image inputs into a multipart file tuple.
+
+    Args:
+        image: One of
+            - str: path to an image file on disk,
+            - bytes / bytearray / memoryview: encoded image data (PNG/JPEG),
+            - file-like object with read(): encoded image data,
+            - numpy.ndarray: decoded image in OpenCV (BGR / grayscale) layout,
+              encoded once here as PNG.
+        default_name (str): Filename sent for in-memory inputs.
+
+    Returns:
+        tuple: (filename, file object, mimetype) for requests' files= argument.
+
+    Raises:
+        FileNotFoundError: If a path was given and does not exist.
+        ValueError: If the input type is unsupported or cannot be encoded.
+    """
+    if isinstance(image, str):
+        if not os.path.exists(image):
+            raise FileNotFoundError(image)
+        with open(image, 'rb') as f:
+            data = f.read()
+        name = os.path.basename(image)
+    elif isinstance(image, np.ndarray):
+        with metrics.span("png_encode"):
+            ok, encoded = cv2.imencode('.png', image)
+        if not ok: raise ValueError("Could not encode image array as PNG")
+        data, name = encoded.tobytes(), default_name
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        data, name = bytes(image), default_name
+    elif hasattr(image, 'read'):
+        data, name = image.read(), getattr(image, 'name', None) or default_name
+        name = os.path.basename(str(name))
+    else:
+        raise ValueError(f"Unsupported image input type: {type(image).__name__}")
+
+    mimetype = 'image/jpeg' if data[:3] == b'\xff\xd8\xff' else 'image/png' # Sniff JPEG magic, else PNG
+    return name, io.BytesIO(data), mimetype
+
+
+def call_got_ocr_area(image, box_coordinates_str=None, timeout=REQUEST_TIMEOUT, use_cache=True, client=None,
+                      priority=PRIORITY_INTERACTIVE, cancel=None):
+    """
+    Calls the GOT-OCR service for a specific image.
     If box_coordinates_str is provided, uses 'Fine-grained OCR (Box)' task.
     If box_coordinates_str is None, uses 'Plain Text OCR' task, assuming the
     input image itself is already cropped to the desired area.
 
     Args:
-        image_path (str): Path to the image file (can be full page or pre-cropped).
+        image (str | bytes | file-like | numpy.ndarray): Image path or in-memory image
+            (can be full page or pre-cropped). See _prepare_image_upload.
         box_coordinates_str (str, optional): Bounding box string e.g., "[x1,y1,x2,y2]".
                                              If None, assumes pre-cropped image. Defaults to None.
+        timeout (float, optional): Request timeout in seconds. Defaults to REQUEST_TIMEOUT.
+        use_cache (bool, optional): Look up / store the result in the OCR result cache. Defaults to True.
+        client (GotOcrClient, optional): Client to send the request with. Defaults to the shared client.
+        priority (int, optional): PRIORITY_INTERACTIVE or PRIORITY_BATCH. Defaults to interactive.
+        cancel (CancelToken, optional): See GotOcrClient.post.
 
     Returns:
         str: Extracted text content, or an error string if failed, or None for critical errors.
-    """
-    if not os.path.exists(image_path):
-        print(f"Error [call_got_ocr_area]: Image path not found: {image_path}")
-        return "Error: Input image file not found." # Return specific error
 
+    Raises:
+        OperationCancelled: If cancel was cancelled or its deadline passed.
+    """
     files = None
     file_handle = None # Define outside try for finally block
+    image_filename = None
     task_desc = "[Unknown Task]" # For logging clarity
+    ocr_client = client or get_default_client()
 
     try:
-        # Prepare file for upload
-        image_filename = os.path.basename(image_path)
-        file_handle = open(image_path, 'rb')
-        files = {'images': (image_filename, file_handle, 'image/png')} # Assume PNG content type
+        # Prepare file for upload (encoded once, sent from memory)
+        try:
+            image_filename, file_handle, mimetype = _prepare_image_upload(image, "area.png")
+        except FileNotFoundError:
+            print(f"Error [call_got_ocr_area]: Image path not found: {image}")
+            return "Error: Input image file not found." # Return specific error
+        files = {'images': (image_filename, file_handle, mimetype)}
 
         # Determine payload based on presence of box coordinates
         if box_coordinates_str:
@@ -49,19 +340,23 @@ def call_got_ocr_area(image_path, box_coordinates_str=None):
                 'ocr_box': box_coordinates_str
             }
             task_desc = "[Box]"
-            print(f"Calling GOT-OCR {task_desc} with box {box_coordinates_str} for {image_filename}")
+            _log_verbose(f"Calling GOT-OCR {task_desc} with box {box_coordinates_str} for {image_filename}")
         else:
             # Image is pre-cropped, use Plain Text OCR on the whole (cropped) image
             payload = {'task': 'Plain Text OCR'}
             task_desc = "[Plain - Cropped Img]"
-            print(f"Calling GOT-OCR {task_desc} (no box needed) for {image_filename}")
+            _log_verbose(f"Calling GOT-OCR {task_desc} (no box needed) for {image_filename}")
+
+        cache_key, cached_text = _cached_result(file_handle, payload, use_cache)
+        if cached_text is not None:
+            _log_verbose(f"GOT-OCR {task_desc} result served from cache for {image_filename}")
+            return cached_text
 
-        # Make the API call
-        response = requests.post(GOT_OCR_SERVICE_URL, files=files, data=payload, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+        # Make the API call (pooled connection, retries, circuit breaker)
+        response = ocr_client.post(files, payload, timeout=timeout, priority=priority, cancel=cancel)
 
         response_data = response.json()
-        print(f"GOT-OCR {task_desc} Raw Response: {response_data}")
+        _log_raw_response(task_desc, response_data)
 
         # --- Parse the response ---
         extracted_text = None
@@ -78,15 +373,21 @@ def call_got_ocr_area(image_path, box_coordinates_str=None):
 
         if extracted_text is None:
              # If parsing failed, return a specific error message including part of the raw response
-             print(f"Warning: Could not parse 'text' from GOT-OCR {task_desc} response: {response_data}")
+             print(f"Warning: Could not parse 'text' from GOT-OCR {task_desc} response: {str(response_data)[:OCR_LOG_RAW_MAX_CHARS]}")
              return f"Error: Could not parse OCR result structure: {str(response_data)[:150]}..."
         else:
             # Successfully extracted text
-            print(f"Successfully extracted text {task_desc} (length: {len(extracted_text)})")
+            _log_verbose(f"Successfully extracted text {task_desc} (length: {len(extracted_text)})")
+            _store_result(cache_key, extracted_text)
             return extracted_text
 
+    except OperationCancelled:
+        raise
+    except CircuitOpenError:
+        print(f"GOT-OCR service {task_desc} skipped: circuit breaker is open.")
+        return "Error: OCR service unavailable (too many recent failures). Try again shortly."
     except requests.exceptions.Timeout:
-        print(f"Error calling GOT-OCR service {task_desc}: Request timed out after {REQUEST_TIMEOUT} seconds.")
+        print(f"Error calling GOT-OCR service {task_desc}: Request timed out after {timeout} seconds.")
         return "Error: OCR service request timed out."
     except requests.exceptions.RequestException as e:
         print(f"Error calling GOT-OCR service {task_desc}: {e}")
@@ -109,40 +410,54 @@ def call_got_ocr_area(image_path, box_coordinates_str=None):
                 print(f"Error closing file handle for {image_filename}: {close_err}")
 
 
-def call_got_ocr_format_text(image_path):
+def call_got_ocr_format_text(image, timeout=REQUEST_TIMEOUT, use_cache=True, client=None, priority=PRIORITY_INTERACTIVE,
+                             cancel=None):
     """
     Calls the GOT-OCR service using the 'Format Text OCR' task, expecting
     structured output like Markdown, suitable for layout analysis.
 
     Args:
-        image_path (str): Path to the image file.
+        image (str | bytes | file-like | numpy.ndarray): Image path or in-memory image.
+            See _prepare_image_upload.
+        timeout (float, optional): Request timeout in seconds. Defaults to REQUEST_TIMEOUT.
+        use_cache (bool, optional): Look up / store the result in the OCR result cache. Defaults to True.
+        client (GotOcrClient, optional): Client to send the request with. Defaults to the shared client.
+        priority (int, optional): PRIORITY_INTERACTIVE or PRIORITY_BATCH. Defaults to interactive.
+        cancel (CancelToken, optional): See GotOcrClient.post.
 
     Returns:
         str: Extracted formatted text content, or an error string if failed, or None for critical errors.
-    """
-    if not os.path.exists(image_path):
-        print(f"Error [call_got_ocr_format_text]: Image path not found: {image_path}")
-        return "Error: Input image file not found."
 
+    Raises:
+        OperationCancelled: If cancel was cancelled or its deadline passed.
+    """
     files = None
     file_handle = None
+    image_filename = None
     task_desc = "[Format]" # For logging
+    ocr_client = client or get_default_client()
 
     try:
-        image_filename = os.path.basename(image_path)
-        file_handle = open(image_path, 'rb')
-        files = {'images': (image_filename, file_handle, 'image/png')}
+        try:
+            image_filename, file_handle, mimetype = _prepare_image_upload(image, "page.png")
+        except FileNotFoundError:
+            print(f"Error [call_got_ocr_format_text]: Image path not found: {image}")
+            return "Error: Input image file not found."
+        files = {'images': (image_filename, file_handle, mimetype)}
         payload = {
             'task': 'Format Text OCR',
             'ocr_type': 'format' # Request formatted output
         }
-        print(f"Calling GOT-OCR {task_desc} at {GOT_OCR_SERVICE_URL} for {image_filename}")
+        cache_key, cached_text = _cached_result(file_handle, payload, use_cache)
+        if cached_text is not None:
+            _log_verbose(f"GOT-OCR {task_desc} result served from cache for {image_filename}")
+            return cached_text
+        _log_verbose(f"Calling GOT-OCR {task_desc} at {ocr_client.service_url} for {image_filename}")
 
-        response = requests.post(GOT_OCR_SERVICE_URL, files=files, data=payload, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
+        response = ocr_client.post(files, payload, timeout=timeout, priority=priority, cancel=cancel)
 
         response_data = response.json()
-        print(f"GOT-OCR {task_desc} Raw Response: {response_data}")
+        _log_raw_response(task_desc, response_data)
 
         # --- Parse the response for formatted text ---
         formatted_text = None
@@ -155,14 +470,20 @@ def call_got_ocr_format_text(image_path):
         # --- End Parsing ---
 
         if formatted_text is None:
-            print(f"Warning: Could not parse formatted text from GOT-OCR {task_desc} response: {response_data}")
+            print(f"Warning: Could not parse formatted text from GOT-OCR {task_desc} response: {str(response_data)[:OCR_LOG_RAW_MAX_CHARS]}")
             return f"Error: Could not parse formatted result: {str(response_data)[:150]}..."
         else:
-            print(f"Successfully extracted formatted text {task_desc} (length: {len(formatted_text)})")
+            _log_verbose(f"Successfully extracted formatted text {task_desc} (length: {len(formatted_text)})")
+            _store_result(cache_key, formatted_text)
             return formatted_text
 
+    except OperationCancelled:
+        raise
+    except CircuitOpenError:
+        print(f"GOT-OCR service {task_desc} skipped: circuit breaker is open.")
+        return "Error: OCR service unavailable (too many recent failures). Try again shortly."
     except requests.exceptions.Timeout:
-        print(f"Error calling GOT-OCR service {task_desc}: Request timed out after {REQUEST_TIMEOUT} seconds.")
+        print(f"Error calling GOT-OCR service {task_desc}: Request timed out after {timeout} seconds.")
         return "Error: OCR service request timed out."
     except requests.exceptions.RequestException as e:
         print(f"Error calling GOT-OCR service {task_desc}: {e}")
@@ -180,4 +501,79 @@ def call_got_ocr_format_text(image_path):
                 file_handle.close()
                 # print(f"Closed file handle for {image_filename}")
             except Exception as close_err:
-                print(f"Error closing file handle for {image_filename}: {close_err}")
\ No newline at end of file
+                print(f"Error closing file handle for {image_filename}: {close_err}")
+
+
+def _parse_multi_image_response(response_data, expected):
+    """Returns the per-image texts of a multi-image response, or None if it does not hold exactly expected results."""
+    results = response_data.get('result') if isinstance(response_data, dict) else None
+    if not isinstance(results, list) or len(results) != expected:
+        return None
+    texts = [item.get('text') if isinstance(item, dict) else None for item in results]
+    return texts if all(isinstance(text, str) for text in texts) else None
+
+
+def call_got_ocr_areas(images, timeout=REQUEST_TIMEOUT, use_cache=True, client=None, priority=PRIORITY_INTERACTIVE,
+                       max_in_flight=AREA_MAX_IN_FLIGHT, cancel=None):
+    """
+    OCRs several pre-cropped area images ('Plain Text OCR' on each).
+
+    Cached results are answered locally. The rest go to the service in one
+    multi-image request if GOT_OCR_MULTI_IMAGE is set (falling back to
+    single calls if the response does not carry one result per image), or
+    as concurrent call_got_ocr_area calls, at most max_in_flight at once.
+
+    Args:
+        images (list): Area images, any input accepted by _prepare_image_upload.
+        cancel (CancelToken, optional): See GotOcrClient.post; areas not yet sent are dropped.
+
+    Returns:
+        list of str: One result per image, in order (error strings for failures).
+
+    Raises:
+        OperationCancelled: If cancel was cancelled or its deadline passed.
+    """
+    ocr_client = client or get_default_client()
+    results = [None] * len(images)
+    if GOT_OCR_MULTI_IMAGE and len(images) > 1:
+        payload = {'task': 'Plain Text OCR'}
+        uploads, misses = [], []
+        for index, image in enumerate(images):
+            try:
+                upload = _prepare_image_upload(image, f"area{index}.png")
+            except (FileNotFoundError, ValueError) as e:
+                results[index] = f"Error: Invalid area image: {e}"
+                continue
+            cache_key, cached_text = _cached_result(upload[1], payload, use_cache)
+            if cached_text is not None:
+                results[index] = cached_text
+            else:
+                uploads.append(upload)
+                misses.append((index, cache_key))
+        if uploads:
+            try:
+                _log_verbose(f"Calling GOT-OCR [Plain - Multi] with {len(uploads)} images")
+                response = ocr_client.post([('images', upload) for upload in uploads], payload, timeout=timeout, priority=priority,
+                                           cancel=cancel)
+                texts = _parse_multi_image_response(response.json(), len(uploads))
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"GOT-OCR multi-image call failed ({e}), sending areas one by one")
+                texts = None
+            if texts is not None:
+                for (index, cache_key), text in zip(misses, texts):
+                    results[index] = text
+                    _store_result(cache_key, text)
+                misses = []
+            else:
+                print("GOT-OCR multi-image response did not match the request, sending areas one by one")
+        pending = [index for index, _ in misses]
+    else:
+        pending = list(range(len(images)))
+
+    if pending:
+        with cancellable_executor(max(1, min(max_in_flight, len(pending))), "got-ocr-area", cancel) as pool:
+            futures = {index: pool.submit(call_got_ocr_area, images[index], None, timeout=timeout, use_cache=use_cache,
+                                          client=ocr_client, priority=priority, cancel=cancel) for index in pending}
+            for index, future in futures.items():
+                results[index] = future.result()
+    return results
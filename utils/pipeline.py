@@ -0,0 +1,452 @@
+# utils/pipeline.py
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz # PyMuPDF - For display-list renders of page regions
+
+from utils.ocr import call_got_ocr_format_text, REQUEST_TIMEOUT
+from utils.jobs import PRIORITY_INTERACTIVE
+from utils.cancel import CancelToken, OperationCancelled, cancellable_executor
+from utils.docpool import DocumentPool
+from utils.metrics import metrics
+from utils.preprocess import (prepare_page_image, screen_page, gray_probe, ink_similarity,
+                              DUPLICATE_HASH_DISTANCE, DUPLICATE_VERIFY_LONG_EDGE, DUPLICATE_MIN_SIMILARITY)
+from utils.tiling import prepare_page_tiles, stitch_tile_texts, ANALYZE_TILING, TILE_MAX_IN_FLIGHT
+
+# --- Configuration ---
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 2))) # Processes rasterizing pages
+# How render processes are started ("fork", "spawn", "forkserver"). Forking the threaded server
+# process is unsafe, so the default is forkserver (spawn where the platform lacks it).
+RENDER_START_METHOD = os.getenv("RENDER_START_METHOD") or (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "120")) # Seconds a request waits for one render task
+ANALYZE_MAX_IN_FLIGHT = int(os.getenv("ANALYZE_MAX_IN_FLIGHT", "4")) # Concurrent GOT-OCR calls per document
+ANALYZE_PAGE_RETRIES = int(os.getenv("ANALYZE_PAGE_RETRIES", "0")) # Extra attempts for a failed page (transport errors are already retried by GotOcrClient)
+ANALYZE_RETRY_BACKOFF = 2.0 # Seconds before the first retry, doubled on each further attempt
+ANALYZE_DPI = 300 # DPI used for layout analysis renders
+ANALYZE_SKIP_BLANK = os.getenv("ANALYZE_SKIP_BLANK", "1") != "0" # Default for skipping blank pages in document analysis
+ANALYZE_REUSE_DUPLICATES = os.getenv("ANALYZE_REUSE_DUPLICATES", "1") != "0" # Default for reusing results of repeated pages
+SCREEN_PAGES_PER_TASK = 16 # Pages screened per render-pool task
+DUPLICATE_MAX_CANDIDATES = 3 # Earlier pages verified per page whose hash is close
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_worker_doc_pool = None # Per-process handle pool, created lazily inside each render worker
+
+
+def get_render_pool():
+    """Returns the shared process pool used for page rasterization (created on first use)."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=max(1, RENDER_WORKERS),
+                                               mp_context=multiprocessing.get_context(RENDER_START_METHOD))
+        return _render_pool
+
+
+def shutdown_render_pool(wait=True):
+    """Stops the render pool (if it was started), letting submitted tasks finish when wait is True."""
+    global _render_pool
+    with _render_pool_lock:
+        pool, _render_pool = _render_pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def _traced_call(func, *args):
+    """Runs func in a render process and returns (result, {stage: seconds}) so the caller can record its spans."""
+    token = metrics.start_trace()
+    try:
+        result = func(*args)
+    finally:
+        stages = metrics.end_trace(token)
+    return result, stages
+
+
+def run_on_render_pool(func, *args, stage="render_pool", timeout=RENDER_TIMEOUT):
+    """
+    Runs a rasterization function on the render pool and waits for its
+    result, so CPU-bound page work never holds the GIL of the serving
+    process. The round trip is recorded as stage and the function's own
+    spans (page_render, png_encode, ...) are recorded as if they ran here.
+    """
+    return map_on_render_pool(func, [args], stage=stage, timeout=timeout)[0]
+
+
+def map_on_render_pool(func, arg_tuples, stage="render_pool", timeout=RENDER_TIMEOUT):
+    """Like run_on_render_pool for several calls, which run in parallel. Returns their results in order."""
+    with metrics.span(stage):
+        futures = [get_render_pool().submit(_traced_call, func, *args) for args in arg_tuples]
+        outcomes = [future.result(timeout=timeout) for future in futures]
+    for _, stages in outcomes:
+        for worker_stage, seconds in stages.items():
+            metrics.record(worker_stage, seconds)
+    return [result for result, _ in outcomes]
+
+
+def worker_document(pdf_path):
+    """Leases an open handle from this render process's own handle pool (a with-block context manager)."""
+    global _worker_doc_pool
+    if _worker_doc_pool is None:
+        _worker_doc_pool = DocumentPool(max_handles=4)
+    return _worker_doc_pool.checkout(pdf_path, pdf_path)
+
+
+def render_page_png(pdf_path, page_num, dpi, fmt="png"):
+    """
+    Renders one PDF page to PNG (or JPEG) bytes. Runs inside a render pool
+    process, so it only takes and returns picklable values.
+
+    Args:
+        pdf_path (str): Path to the PDF.
+        page_num (int): 0-based page index.
+        dpi (int): Render resolution.
+        fmt (str): "png" or "jpeg".
+
+    Returns:
+        bytes: The encoded image.
+    """
+    with worker_document(pdf_path) as doc:
+        with metrics.span("page_render"):
+            pix = doc.load_page(page_num).get_pixmap(dpi=dpi)
+    with metrics.span(f"{fmt}_encode"):
+        return pix.tobytes(fmt)
+
+
+def render_page_for_ocr(pdf_path, page_num, dpi):
+    """
+    Renders one page for GOT-OCR through the preprocessing stage (see
+    utils/preprocess.py). Runs inside a render pool process.
+
+    Returns:
+        tuple: (image bytes, preprocessing info dict)
+    """
+    with worker_document(pdf_path) as doc:
+        return prepare_page_image(doc.load_page(page_num), dpi)
+
+
+def render_ocr_image(pdf_path, page_num, dpi=ANALYZE_DPI, timeout=RENDER_TIMEOUT):
+    """Runs render_page_for_ocr on the render pool and counts the bytes sent and saved. Returns (bytes, info)."""
+    data, info = run_on_render_pool(render_page_for_ocr, pdf_path, page_num, dpi, stage="page_render_pool", timeout=timeout)
+    metrics.inc("ocr_image_bytes_total", info["bytes"], kind="sent")
+    metrics.inc("ocr_image_bytes_total", info["bytes_saved"], kind="saved")
+    return data, info
+
+
+def render_page_tiles(pdf_path, page_num, dpi, mode):
+    """
+    Renders one page at full analysis resolution and cuts it into tiles
+    (see utils/tiling.py). Runs inside a render pool process.
+
+    Returns:
+        tuple: (list of image bytes, list of tile info dicts)
+    """
+    with worker_document(pdf_path) as doc:
+        return prepare_page_tiles(doc.load_page(page_num), dpi, mode)
+
+
+def screen_pages(pdf_path, page_nums):
+    """Runs screen_page on several pages. Runs inside a render pool process; returns a list of dicts with "page" added."""
+    with worker_document(pdf_path) as doc:
+        return [{"page": page_num, **screen_page(doc.load_page(page_num))} for page_num in page_nums]
+
+
+def compare_pages(pdf_path, pairs):
+    """
+    Ink-map similarity of page pairs on sharper probes (see ink_similarity).
+    Runs inside a render pool process; each page is rendered once per call.
+
+    Returns:
+        list of float: One similarity per (page_a, page_b) pair.
+    """
+    probes = {}
+    with worker_document(pdf_path) as doc:
+        def probe(page_num):
+            if page_num not in probes:
+                probes[page_num] = gray_probe(doc.load_page(page_num), DUPLICATE_VERIFY_LONG_EDGE)
+            return probes[page_num]
+        return [ink_similarity(probe(page_a), probe(page_b)) for page_a, page_b in pairs]
+
+
+def plan_page_analysis(pdf_path, page_nums, skip_blank=ANALYZE_SKIP_BLANK, reuse_duplicates=ANALYZE_REUSE_DUPLICATES,
+                       timeout=RENDER_TIMEOUT):
+    """
+    Pre-pass over small probe renders that decides which pages need GOT-OCR.
+
+    Blank pages (almost no ink inside the margins) are skipped. A page whose
+    perceptual hash is within DUPLICATE_HASH_DISTANCE bits of an earlier
+    page's is compared with it on a sharper probe, and reuses that page's
+    result if their ink maps are at least DUPLICATE_MIN_SIMILARITY alike.
+
+    Returns:
+        dict: page -> {"skipped": "blank"} or {"duplicate_of": earlier page};
+            pages that need OCR are absent.
+    """
+    page_nums = list(page_nums)
+    if not page_nums or not (skip_blank or reuse_duplicates):
+        return {}
+    chunks = [(pdf_path, page_nums[start:start + SCREEN_PAGES_PER_TASK]) for start in range(0, len(page_nums), SCREEN_PAGES_PER_TASK)]
+    screens = [screen for chunk in map_on_render_pool(screen_pages, chunks, stage="page_screen", timeout=timeout) for screen in chunk]
+
+    plan = {}
+    inked = [] # Screens of non-blank pages, in page order
+    for screen in screens:
+        if skip_blank and screen["blank"]:
+            plan[screen["page"]] = {"skipped": "blank"}
+        else:
+            inked.append(screen)
+    if not reuse_duplicates:
+        return plan
+
+    candidates = {} # page -> earlier pages with a close hash, nearest first
+    for index, screen in enumerate(inked):
+        distances = sorted((bin(screen["hash"] ^ earlier["hash"]).count("1"), earlier["page"]) for earlier in inked[:index]
+                           if earlier["size"] == screen["size"])
+        close = [page for distance, page in distances if distance <= DUPLICATE_HASH_DISTANCE][:DUPLICATE_MAX_CANDIDATES]
+        if close:
+            candidates[screen["page"]] = close
+    if not candidates:
+        return plan
+
+    pairs = [(earlier, page) for page, earlier_pages in candidates.items() for earlier in earlier_pages]
+    similarities = run_on_render_pool(compare_pages, pdf_path, pairs, stage="page_compare", timeout=timeout)
+    confirmed = {}
+    for (earlier, page), similarity in zip(pairs, similarities):
+        if similarity >= DUPLICATE_MIN_SIMILARITY and page not in confirmed:
+            confirmed[page] = earlier
+    for page in (screen["page"] for screen in inked if screen["page"] in confirmed): # In page order
+        original = confirmed[page]
+        original = plan.get(original, {}).get("duplicate_of", original) # Always point at a page that is OCR'd
+        plan[page] = {"duplicate_of": original}
+    return plan
+
+
+def render_page_clips(pdf_path, page_num, clips):
+    """
+    Renders several regions of one page to PNG bytes. The page content is
+    interpreted once (a display list) and each region rasterized from it.
+    Runs inside a render pool process.
+
+    Args:
+        clips (list of tuple): ((x0, y0, x1, y1) in PDF points, dpi) per region.
+
+    Returns:
+        list of bytes: One PNG per clip, in order.
+    """
+    pngs = []
+    with worker_document(pdf_path) as doc:
+        with metrics.span("page_display_list"):
+            display_list = doc.load_page(page_num).get_displaylist()
+        for rect, dpi in clips:
+            zoom = dpi / 72
+            with metrics.span("area_render"):
+                pix = display_list.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=fitz.Rect(rect), alpha=False)
+            with metrics.span("png_encode"):
+                pngs.append(pix.tobytes("png"))
+    return pngs
+
+
+def is_ocr_error(text):
+    """True if a GOT-OCR call returned nothing or one of its 'Error: ...' strings."""
+    return text is None or "Error:" in text
+
+
+def format_text_with_retries(image_bytes, label, page_timeout, retries, use_cache, priority, cancel=None):
+    """
+    Calls GOT-OCR Format Text, retrying failed calls with exponential backoff.
+
+    Returns:
+        tuple: (formatted text or error string, attempts made)
+
+    Raises:
+        OperationCancelled: If cancel was cancelled or its deadline passed.
+    """
+    formatted_text = None
+    attempts = 0
+    for attempt in range(retries + 1):
+        attempts = attempt + 1
+        formatted_text = call_got_ocr_format_text(image_bytes, timeout=page_timeout, use_cache=use_cache, priority=priority,
+                                                  cancel=cancel)
+        if not is_ocr_error(formatted_text):
+            break
+        if attempt < retries:
+            delay = ANALYZE_RETRY_BACKOFF * (2 ** attempt)
+            print(f"    - {label} failed ({formatted_text}), retrying in {delay:.1f}s")
+            if cancel is not None:
+                cancel.sleep(delay)
+            else:
+                time.sleep(delay)
+    return formatted_text, attempts
+
+
+def analyze_tiled_page(pdf_path, page_num, dpi, mode, page_timeout, retries, use_cache, priority, cancel=None):
+    """
+    Tiled variant of the GOT-OCR call in analyze_page: the page is cut into
+    tiles on the render pool, up to TILE_MAX_IN_FLIGHT tiles are OCR'd at
+    once, and their texts are stitched in reading order. A page that fits
+    in a single tile returns None so the caller analyzes it whole.
+
+    Returns:
+        tuple: (formatted text or error string, attempts, tiling info dict), or None
+    """
+    images, tiles = run_on_render_pool(render_page_tiles, pdf_path, page_num, dpi, mode, stage="page_tile_pool",
+                                       timeout=cancel.timeout(page_timeout) if cancel is not None else page_timeout)
+    tile_info = {"tiling": mode, "tiles": len(tiles), "dpi": dpi,
+                 "bytes": sum(len(image) for image in images), "bytes_saved": 0}
+    if not tiles:
+        return "", 0, tile_info # No ink on the page
+    if len(tiles) == 1:
+        return None
+    metrics.inc("ocr_image_bytes_total", tile_info["bytes"], kind="sent")
+    with cancellable_executor(max(1, TILE_MAX_IN_FLIGHT), "analyze-tile", cancel) as tile_pool:
+        futures = [tile_pool.submit(format_text_with_retries, image, f"Page {page_num} tile {index}", page_timeout, retries, use_cache,
+                                    priority, cancel) for index, image in enumerate(images)]
+        outcomes = [future.result() for future in futures]
+    attempts = max(tile_attempts for _, tile_attempts in outcomes)
+    for index, (text, _) in enumerate(outcomes):
+        if is_ocr_error(text):
+            return f"Error: Tile {index} of {len(tiles)}: {text or 'GOT-OCR Format call failed'}", attempts, tile_info
+    with metrics.span("tile_stitch"):
+        return stitch_tile_texts([text for text, _ in outcomes], tiles), attempts, tile_info
+
+
+def analyze_page(pdf_path, page_num, dpi=ANALYZE_DPI, page_timeout=REQUEST_TIMEOUT, retries=ANALYZE_PAGE_RETRIES, use_cache=True,
+                 priority=PRIORITY_INTERACTIVE, tiling=ANALYZE_TILING, cancel=None):
+    """
+    Renders a page on the render pool (preprocessed for the model, see
+    utils/preprocess.py) and sends it to GOT-OCR Format Text, retrying
+    failed calls with exponential backoff. priority orders the GOT-OCR call
+    against other callers. With tiling "grid" or "blocks" a page larger
+    than one tile is OCR'd in tiles at full resolution (see analyze_tiled_page).
+    cancel (a CancelToken) stops the page between and during GOT-OCR calls.
+
+    Returns:
+        dict: {"page": int, "formatted_text": str, "error": str or None,
+               "attempts": int, "elapsed": float seconds,
+               "image": preprocessing info (size, mode, format, bytes, bytes_saved),
+                        tiling info (tiling, tiles, dpi, bytes) for tiled pages, or None}
+
+    Raises:
+        OperationCancelled: If cancel was cancelled or its deadline passed.
+    """
+    started = time.time()
+    formatted_text = None
+    attempts = 0
+    image_info = None
+    try:
+        tiled = None
+        if tiling and tiling != "off":
+            tiled = analyze_tiled_page(pdf_path, page_num, dpi, tiling, page_timeout, retries, use_cache, priority, cancel)
+        if tiled is not None:
+            formatted_text, attempts, image_info = tiled
+        else:
+            image_bytes, image_info = render_ocr_image(pdf_path, page_num, dpi,
+                                                       timeout=cancel.timeout(page_timeout) if cancel is not None else page_timeout)
+            formatted_text, attempts = format_text_with_retries(image_bytes, f"Page {page_num}", page_timeout, retries, use_cache, priority,
+                                                                cancel)
+    except OperationCancelled:
+        raise
+    except Exception as page_err:
+        formatted_text = f"Error: Unexpected error processing page: {page_err}"
+
+    failed = is_ocr_error(formatted_text)
+    return {
+        "page": page_num,
+        "formatted_text": "" if failed else formatted_text,
+        "error": (formatted_text or "Unknown OCR error") if failed else None,
+        "attempts": attempts,
+        "elapsed": round(time.time() - started, 3),
+        "image": image_info,
+    }
+
+
+def iter_analyzed_pages(pdf_path, page_nums, max_in_flight=ANALYZE_MAX_IN_FLIGHT, skip_blank=ANALYZE_SKIP_BLANK,
+                        reuse_duplicates=ANALYZE_REUSE_DUPLICATES, cancel=None, **page_kwargs):
+    """
+    Analyzes pages concurrently and yields their results in page order.
+
+    At most max_in_flight pages are being rendered or OCR'd at once, and only
+    a small window of finished-but-not-yet-yielded results is held, so the
+    total time tracks the GOT-OCR server's throughput rather than the sum of
+    per-page latencies. Blank and repeated pages found by plan_page_analysis
+    are not sent to GOT-OCR. Once cancel is cancelled no further page is
+    started, queued pages are dropped and OperationCancelled is raised, also
+    when the consumer stops iterating early (the generator is closed);
+    pages already at GOT-OCR finish in the background, unwaited.
+
+    Args:
+        pdf_path (str): Path to the processed PDF.
+        page_nums (iterable of int): Pages to analyze, in the order to yield them.
+        max_in_flight (int): Maximum concurrent page analyses.
+        skip_blank (bool): Answer blank pages with empty text.
+        reuse_duplicates (bool): Answer a repeated page with the result of its first occurrence.
+        cancel (CancelToken, optional): Stops the analysis (see above).
+        **page_kwargs: Passed to analyze_page (dpi, page_timeout, retries, use_cache, priority, tiling).
+
+    Yields:
+        dict: One analyze_page result per page. "skipped" is "blank" for
+            skipped pages, "duplicate_of" the page whose result was reused.
+    """
+    page_nums = list(page_nums)
+    cancel = cancel or CancelToken() # Own token, so closing the generator still stops pages in flight
+    cancel.check()
+    try:
+        plan = plan_page_analysis(pdf_path, page_nums, skip_blank, reuse_duplicates)
+    except OperationCancelled:
+        raise
+    except Exception as plan_err: # Screening is an optimization; analyze every page without it
+        print(f"Page screening failed for {pdf_path}, analyzing all pages: {plan_err}")
+        plan = {}
+    originals = {entry["duplicate_of"] for entry in plan.values() if "duplicate_of" in entry}
+    original_results = {} # Results of pages that later pages repeat
+    if plan:
+        print(f"Screening {pdf_path}: {sum(1 for e in plan.values() if 'skipped' in e)} blank, "
+              f"{sum(1 for e in plan.values() if 'duplicate_of' in e)} repeated of {len(page_nums)} pages")
+
+    max_in_flight = max(1, int(max_in_flight))
+    window = max_in_flight * 2 # Pages submitted ahead of the one being yielded
+    pending = deque() # (page, future or None for planned pages)
+    page_iter = iter(page_nums)
+    exhausted = False # Every page submitted
+    with cancellable_executor(max_in_flight, "analyze-page", cancel) as ocr_pool:
+        def fill():
+            nonlocal exhausted
+            while len(pending) < window and not cancel.cancelled:
+                page_num = next(page_iter, None)
+                if page_num is None:
+                    exhausted = True
+                    return
+                future = None if page_num in plan else ocr_pool.submit(analyze_page, pdf_path, page_num, cancel=cancel, **page_kwargs)
+                pending.append((page_num, future))
+
+        try:
+            fill()
+            while pending:
+                page_num, future = pending.popleft()
+                if future is not None:
+                    result = {**future.result(), "skipped": None, "duplicate_of": None}
+                    if page_num in originals:
+                        original_results[page_num] = result
+                elif "skipped" in plan[page_num]:
+                    metrics.inc("analyze_pages_skipped_total", reason="blank")
+                    result = {"page": page_num, "formatted_text": "", "error": None, "attempts": 0, "elapsed": 0.0,
+                              "image": None, "skipped": "blank", "duplicate_of": None}
+                else:
+                    metrics.inc("analyze_pages_skipped_total", reason="duplicate")
+                    original = original_results[plan[page_num]["duplicate_of"]] # Yielded earlier, so already known
+                    result = {**original, "page": page_num, "attempts": 0, "elapsed": 0.0, "image": None,
+                              "duplicate_of": original["page"]}
+                fill()
+                yield result
+            if not exhausted:
+                cancel.check() # Stopped submitting because of the cancel
+        finally:
+            if pending: # Cancelled, failed, or closed by the consumer: stop the pages still in flight
+                cancel.cancel("analysis stopped")
+                for _, future in pending:
+                    if future is not None:
+                        future.cancel()
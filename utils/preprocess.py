@@ -0,0 +1,153 @@
+# utils/preprocess.py
+import os
+
+import cv2 # For thresholding and fast PNG / JPEG encoding
+import fitz # PyMuPDF - For rasterizing pages
+import numpy as np
+
+from utils.metrics import metrics
+
+# --- Configuration ---
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") != "0" # Off: full-colour PNG at the analysis DPI, as before
+# GOT-OCR resizes its input to 1024x1024, so pixels beyond that long edge are rendered, sent and thrown away
+OCR_TARGET_LONG_EDGE = int(os.getenv("OCR_TARGET_LONG_EDGE", "1024")) # 0 keeps the analysis DPI
+OCR_COLOR_MODE = os.getenv("OCR_COLOR_MODE", "auto").lower() # "auto" (grayscale unless the page has colour), "gray", "rgb"
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "0") == "1" # Otsu threshold grayscale pages to black and white
+OCR_IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "auto").lower() # "auto" (PNG if binarized, else JPEG), "png", "jpeg"
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "90"))
+PNG_COMPRESSION = 1 # zlib level: fast, and still small for flat text pages
+# Colour detection on a small probe render
+COLOR_PROBE_LONG_EDGE = 96
+COLOR_TOLERANCE = 24 # Max - min channel value above which a pixel counts as coloured
+COLOR_PIXEL_SHARE = 0.002 # Share of coloured probe pixels that makes a page colour
+
+
+def page_has_color(page):
+    """True if a small RGB probe render of the page has more than a trace of coloured pixels."""
+    zoom = COLOR_PROBE_LONG_EDGE / max(page.rect.width, page.rect.height)
+    with metrics.span("color_probe"):
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        rgb = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, 3)
+        spread = rgb.max(axis=2).astype(np.int16) - rgb.min(axis=2)
+        return np.count_nonzero(spread > COLOR_TOLERANCE) > COLOR_PIXEL_SHARE * spread.size
+
+
+def use_grayscale(page):
+    """Whether a page is sent to GOT-OCR in grayscale (OCR_COLOR_MODE; "auto" probes it for colour)."""
+    if OCR_COLOR_MODE == "auto":
+        return not page_has_color(page)
+    return OCR_COLOR_MODE == "gray"
+
+
+def ocr_render_dpi(page, max_dpi, target_long_edge=OCR_TARGET_LONG_EDGE):
+    """DPI that makes the page's long edge about target_long_edge pixels, never above max_dpi."""
+    if not target_long_edge:
+        return max_dpi
+    return min(max_dpi, target_long_edge * 72 / max(page.rect.width, page.rect.height))
+
+
+def encode_image(pixels, fmt, jpeg_quality=OCR_JPEG_QUALITY):
+    """Encodes a grayscale (HxW) or RGB (HxWx3) array as PNG or JPEG bytes."""
+    if pixels.ndim == 3:
+        pixels = cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR) # OpenCV channel order
+    if fmt == "jpeg":
+        ok, encoded = cv2.imencode(".jpg", pixels, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    else:
+        ok, encoded = cv2.imencode(".png", pixels, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+    if not ok:
+        raise ValueError(f"Could not encode page image as {fmt}")
+    return encoded.tobytes()
+
+
+def prepare_page_image(page, max_dpi):
+    """
+    Renders a page for GOT-OCR: downscaled to OCR_TARGET_LONG_EDGE, grayscale
+    (or binarized) unless the page has colour, and encoded compactly.
+
+    Args:
+        page (fitz.Page): Page to render.
+        max_dpi (int): Resolution used without preprocessing, and the upper bound with it.
+
+    Returns:
+        tuple: (image bytes, info dict) with info holding width, height, dpi,
+            mode ("rgb", "gray" or "binary"), format, bytes, and raw_bytes /
+            bytes_saved against an uncompressed RGB render at max_dpi (what
+            the model would otherwise have to receive and decode).
+    """
+    zoom = max_dpi / 72
+    raw_bytes = round(page.rect.width * zoom) * round(page.rect.height * zoom) * 3
+    if not OCR_PREPROCESS:
+        with metrics.span("page_render"):
+            pix = page.get_pixmap(dpi=max_dpi)
+        with metrics.span("png_encode"):
+            data = pix.tobytes("png")
+        info = {"width": pix.width, "height": pix.height, "dpi": max_dpi, "mode": "rgb", "format": "png"}
+    else:
+        gray = use_grayscale(page)
+        dpi = ocr_render_dpi(page, max_dpi)
+        with metrics.span("page_render"):
+            pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=fitz.csGRAY if gray else fitz.csRGB, alpha=False)
+            shape = (pix.height, pix.width) if gray else (pix.height, pix.width, 3)
+            pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(shape)
+        mode = "gray" if gray else "rgb"
+        if gray and OCR_BINARIZE:
+            with metrics.span("binarize"):
+                _, pixels = cv2.threshold(pixels, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            mode = "binary"
+        fmt = OCR_IMAGE_FORMAT if OCR_IMAGE_FORMAT in ("png", "jpeg") else ("png" if mode == "binary" else "jpeg")
+        with metrics.span(f"{fmt}_encode"):
+            data = encode_image(pixels, fmt)
+        info = {"width": pix.width, "height": pix.height, "dpi": round(dpi, 1), "mode": mode, "format": fmt}
+
+    info.update({"bytes": len(data), "raw_bytes": raw_bytes, "bytes_saved": max(0, raw_bytes - len(data))})
+    return data, info
+
+
+# --- Blank / Duplicate Page Screening ---
+SCREEN_LONG_EDGE = 256 # Probe render for the ink statistics and perceptual hash
+SCREEN_MARGIN_SHARE = 0.04 # Border ignored when measuring ink (scanner edges, punch holes)
+INK_LEVEL = 128 # Gray values below this count as ink
+BLANK_INK_SHARE = float(os.getenv("BLANK_INK_SHARE", "0.001")) # Pages with less ink than this share are blank
+DUPLICATE_HASH_DISTANCE = int(os.getenv("DUPLICATE_HASH_DISTANCE", "6")) # Max differing bits of the 64-bit dHash for a candidate
+DUPLICATE_VERIFY_LONG_EDGE = 768 # Candidates are confirmed on a sharper probe, where lines of different text differ
+DUPLICATE_MIN_SIMILARITY = float(os.getenv("DUPLICATE_MIN_SIMILARITY", "0.97")) # Ink-map cosine similarity that confirms a duplicate
+
+
+def gray_probe(page, long_edge):
+    """Renders a page in grayscale with its long edge at long_edge pixels. Returns an HxW uint8 array."""
+    zoom = long_edge / max(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+
+
+def dhash(gray, size=8):
+    """64-bit difference hash: brightness gradients of a (size+1) x size thumbnail, as an int."""
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = np.packbits((small[:, 1:] > small[:, :-1]).ravel())
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+def screen_page(page):
+    """
+    Cheap statistics for skipping a page before OCR.
+
+    Returns:
+        dict: {"ink": share of ink pixels inside the margins, "blank": bool,
+               "hash": 64-bit dHash, "size": (width, height) in points}
+    """
+    gray = gray_probe(page, SCREEN_LONG_EDGE)
+    margin_y, margin_x = int(gray.shape[0] * SCREEN_MARGIN_SHARE), int(gray.shape[1] * SCREEN_MARGIN_SHARE)
+    inner = gray[margin_y:gray.shape[0] - margin_y, margin_x:gray.shape[1] - margin_x]
+    ink = float(np.count_nonzero(inner < INK_LEVEL)) / max(1, inner.size)
+    return {"ink": round(ink, 5), "blank": ink < BLANK_INK_SHARE, "hash": dhash(gray),
+            "size": (round(page.rect.width), round(page.rect.height))}
+
+
+def ink_similarity(gray_a, gray_b):
+    """Cosine similarity (0..1) of two pages' lightly blurred ink maps; tolerant of scan noise and small shifts."""
+    if gray_b.shape != gray_a.shape:
+        gray_b = cv2.resize(gray_b, (gray_a.shape[1], gray_a.shape[0]), interpolation=cv2.INTER_AREA)
+    ink_a = 255.0 - cv2.GaussianBlur(gray_a, (5, 5), 0).astype(np.float32)
+    ink_b = 255.0 - cv2.GaussianBlur(gray_b, (5, 5), 0).astype(np.float32)
+    norm = float(np.linalg.norm(ink_a) * np.linalg.norm(ink_b))
+    return float(np.dot(ink_a.ravel(), ink_b.ravel()) / norm) if norm else 1.0
@@ -0,0 +1,205 @@
+# utils/renditions.py
+import io
+import json
+import os
+import shutil
+import uuid
+
+import fitz # PyMuPDF - For rasterizing pages
+from PIL import Image # For WebP / JPEG encoding
+
+from utils.metrics import metrics
+from utils.pipeline import get_render_pool, worker_document
+
+# --- Configuration ---
+RENDITIONS_DIR = os.getenv("RENDITIONS_DIR", "renditions") # One directory per processed PDF
+RENDITION_FORMAT = os.getenv("RENDITION_FORMAT", "webp").lower() # "webp" or "jpeg"
+RENDITION_QUALITY = int(os.getenv("RENDITION_QUALITY", "80"))
+THUMB_LONG_EDGE = int(os.getenv("THUMB_LONG_EDGE", "240")) # Pixels along the longer side of a thumbnail
+# Deep-zoom levels as DPIs (e.g. "300,600"); empty disables tiles
+TILE_DPIS = sorted(int(dpi) for dpi in os.getenv("RENDITION_TILE_DPIS", "").split(",") if dpi.strip())
+TILE_SIZE = 512 # Tile edge in pixels
+RENDITION_PAGES_PER_TASK = 8 # Pages rendered per render-pool task (the PDF is opened once per task)
+
+RENDITION_SIZES = ("thumb", "viewer")
+RENDITION_MIMETYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+MANIFEST_NAME = "manifest.json"
+
+
+def rendition_dir(pdf_path):
+    """Directory holding the renditions of a processed PDF (shared by every doc_id pointing at it)."""
+    return os.path.join(RENDITIONS_DIR, os.path.splitext(os.path.basename(pdf_path))[0])
+
+
+def rendition_path(pdf_path, page_num, size, fmt=RENDITION_FORMAT):
+    """Path of a page's thumb or viewer image."""
+    return os.path.join(rendition_dir(pdf_path), f"{page_num}_{size}.{fmt}")
+
+
+def tile_path(pdf_path, page_num, level, col, row, fmt=RENDITION_FORMAT):
+    """Path of one deep-zoom tile; level indexes the manifest's tile_levels."""
+    return os.path.join(rendition_dir(pdf_path), "tiles", str(level), f"{page_num}_{col}_{row}.{fmt}")
+
+
+def encode_pixmap(pix, fmt=RENDITION_FORMAT, quality=RENDITION_QUALITY):
+    """Encodes an RGB pixmap (no alpha) as WebP or JPEG bytes."""
+    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    out = io.BytesIO()
+    if fmt == "webp":
+        img.save(out, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def size_dpi(page, size, viewer_dpi):
+    """DPI at which a page is rendered for a size: thumbnails fit THUMB_LONG_EDGE, the viewer uses viewer_dpi."""
+    if size == "thumb":
+        return THUMB_LONG_EDGE * 72 / max(page.rect.width, page.rect.height)
+    return viewer_dpi
+
+
+def render_size(page, size, viewer_dpi, fmt=RENDITION_FORMAT):
+    """Renders and encodes one page at a named size. Returns (bytes, pixmap width, pixmap height)."""
+    zoom = size_dpi(page, size, viewer_dpi) / 72 # A matrix, since get_pixmap(dpi=) only takes an int
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return encode_pixmap(pix, fmt), pix.width, pix.height
+
+
+def render_page_rendition(pdf_path, page_num, size, viewer_dpi, fmt=RENDITION_FORMAT):
+    """Renders one page at a named size for on-demand serving. Runs inside a render pool process; returns the encoded bytes."""
+    with worker_document(pdf_path) as doc:
+        with metrics.span(f"rendition_render_{size}"):
+            return render_size(doc.load_page(page_num), size, viewer_dpi, fmt)[0]
+
+
+def render_pages(pdf_path, page_nums, out_dir, viewer_dpi, tile_dpis, fmt):
+    """
+    Writes the thumb/viewer images and tiles of some pages into out_dir.
+    Runs inside a render pool process, so it only takes and returns
+    picklable values.
+
+    Returns:
+        list of dict: Per page, {"page", "width", "height", "tiles": [[cols, rows] per level]}
+        with width/height of the viewer image.
+    """
+    doc = fitz.open(pdf_path)
+    pages = []
+    try:
+        for page_num in page_nums:
+            page = doc.load_page(page_num)
+            info = {"page": page_num, "tiles": []}
+            for size in RENDITION_SIZES:
+                data, width, height = render_size(page, size, viewer_dpi, fmt)
+                with open(os.path.join(out_dir, f"{page_num}_{size}.{fmt}"), "wb") as f_out:
+                    f_out.write(data)
+                if size == "viewer":
+                    info["width"], info["height"] = width, height
+
+            # Tiles are rendered as clips so a high-DPI page is never rasterized whole
+            for level, dpi in enumerate(tile_dpis):
+                level_dir = os.path.join(out_dir, "tiles", str(level))
+                os.makedirs(level_dir, exist_ok=True)
+                tile_points = TILE_SIZE * 72 / dpi
+                cols = max(1, int(-(-page.rect.width // tile_points)))
+                rows = max(1, int(-(-page.rect.height // tile_points)))
+                for row in range(rows):
+                    for col in range(cols):
+                        clip = fitz.Rect(col * tile_points, row * tile_points,
+                                         (col + 1) * tile_points, (row + 1) * tile_points) & page.rect
+                        pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), clip=clip, alpha=False)
+                        with open(os.path.join(level_dir, f"{page_num}_{col}_{row}.{fmt}"), "wb") as f_out:
+                            f_out.write(encode_pixmap(pix, fmt))
+                info["tiles"].append([cols, rows])
+            pages.append(info)
+    finally:
+        doc.close()
+    return pages
+
+
+def generate_renditions(pdf_path, viewer_dpi, tile_dpis=TILE_DPIS, fmt=RENDITION_FORMAT, progress=None):
+    """
+    Renders every page's thumbnail, viewer image and tiles on the render
+    pool and publishes them as one directory with a manifest.
+
+    The directory is built under a temporary name and renamed into place,
+    so readers see either the previous complete set or the new one. The
+    manifest records the PDF's mtime/size so a changed PDF invalidates it.
+
+    Args:
+        pdf_path (str): Processed PDF.
+        viewer_dpi (int): DPI of the viewer image (the app's EXTRACT_DPI,
+            so selection coordinates stay valid).
+        tile_dpis (list of int): Deep-zoom level DPIs, ascending.
+        fmt (str): "webp" or "jpeg".
+        progress (callable, optional): Called with the number of pages done.
+
+    Returns:
+        dict: The manifest.
+    """
+    pdf_stat = os.stat(pdf_path)
+    doc = fitz.open(pdf_path)
+    page_count = len(doc)
+    doc.close()
+
+    final_dir = rendition_dir(pdf_path)
+    work_dir = f"{final_dir}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(work_dir)
+    try:
+        chunks = [list(range(start, min(page_count, start + RENDITION_PAGES_PER_TASK)))
+                  for start in range(0, page_count, RENDITION_PAGES_PER_TASK)]
+        futures = [get_render_pool().submit(render_pages, pdf_path, chunk, work_dir, viewer_dpi, tile_dpis, fmt)
+                   for chunk in chunks]
+        pages = []
+        for future in futures: # In page order
+            pages += future.result()
+            if progress: progress(len(pages))
+
+        manifest = {
+            "source_mtime_ns": pdf_stat.st_mtime_ns,
+            "source_size": pdf_stat.st_size,
+            "page_count": page_count,
+            "format": fmt,
+            "viewer_dpi": viewer_dpi,
+            "thumb_long_edge": THUMB_LONG_EDGE,
+            "tile_size": TILE_SIZE,
+            "tile_levels": [{"dpi": dpi} for dpi in tile_dpis],
+            "pages": pages,
+        }
+        with open(os.path.join(work_dir, MANIFEST_NAME), "w", encoding="utf-8") as f_out:
+            json.dump(manifest, f_out)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(work_dir, final_dir)
+        return manifest
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True) # Only left behind on failure
+
+
+def load_manifest(pdf_path):
+    """Returns the renditions manifest of a PDF, or None if missing or made from an older version of it."""
+    try:
+        with open(os.path.join(rendition_dir(pdf_path), MANIFEST_NAME), encoding="utf-8") as f_in:
+            manifest = json.load(f_in)
+        pdf_stat = os.stat(pdf_path)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("source_mtime_ns") != pdf_stat.st_mtime_ns or manifest.get("source_size") != pdf_stat.st_size:
+        return None
+    return manifest
+
+
+def renditions_size(pdf_path):
+    """Bytes of every rendition of a PDF (counted against the document store quota)."""
+    total = 0
+    for dir_path, _, file_names in os.walk(rendition_dir(pdf_path)):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, file_name))
+            except OSError:
+                continue # Replaced by a concurrent generate_renditions
+    return total
+
+
+def remove_renditions(pdf_path):
+    """Deletes every rendition of a PDF (used when the PDF itself is removed)."""
+    shutil.rmtree(rendition_dir(pdf_path), ignore_errors=True)
@@ -0,0 +1,254 @@
+# utils/textindex.py
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import fitz # PyMuPDF - For reading the text layer
+
+# --- Configuration ---
+TEXT_INDEX_DB_PATH = os.getenv("TEXT_INDEX_DB_PATH", "text_index.sqlite3") # Page text, word boxes and search index
+TEXT_READ_BATCH_PAGES = 50 # Pages read per query when streaming a document's text
+SEARCH_SNIPPET_TOKENS = 12 # Words of context in search snippets
+SEARCH_TOKEN_RE = re.compile(r"\w+\*?", re.UNICODE)
+
+
+def _normalize(word):
+    """Lowercases a word and strips surrounding punctuation for matching against query tokens."""
+    return re.sub(r"^\W+|\W+$", "", word.lower())
+
+
+class TextIndex:
+    """
+    Persisted text layer of processed PDFs with a full-text search index.
+
+    Each PDF's page text and word boxes (get_text("words")) are extracted
+    once and stored in SQLite, so whole documents can be streamed without
+    opening the PDF and searched through an FTS5 table (falling back to
+    LIKE if the SQLite build lacks FTS5). Entries are keyed by the PDF's
+    file name and remember its mtime/size, so a replaced PDF is re-indexed.
+
+    page_fts is an external-content table over page_text, keyed by its id.
+    A PDF's pages are inserted in one transaction, so their ids form one
+    range and searching or deleting one PDF only touches that range instead
+    of every indexed document.
+    """
+
+    def __init__(self, db_path=TEXT_INDEX_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS text_sources (
+                    source TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    page_count INTEGER NOT NULL,
+                    indexed_at REAL NOT NULL
+                )"""
+            )
+            columns = [row["name"] for row in self._conn.execute("PRAGMA table_info(page_text)")]
+            if columns and "id" not in columns:
+                # Index from before page_fts became external-content; rebuilt as documents are read
+                print("Dropping text index in the old layout, PDFs are re-indexed on first use")
+                self._conn.execute("DROP TABLE IF EXISTS page_fts")
+                self._conn.execute("DROP TABLE page_text")
+                self._conn.execute("DELETE FROM text_sources")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS page_text (
+                    id INTEGER PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    words TEXT NOT NULL,
+                    UNIQUE (source, page)
+                )"""
+            )
+            try:
+                self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS page_fts USING fts5(text, content='page_text', content_rowid='id')")
+                self.fts = True
+            except sqlite3.OperationalError:
+                print("SQLite FTS5 not available, text search falls back to LIKE queries")
+                self.fts = False
+
+    @staticmethod
+    def source_key(pdf_path):
+        """Index key of a PDF (its file name without extension, shared by every doc_id pointing at it)."""
+        return os.path.splitext(os.path.basename(pdf_path))[0]
+
+    # --- Indexing ---
+    def is_current(self, pdf_path):
+        """True if pdf_path is indexed and has not changed since."""
+        pdf_stat = os.stat(pdf_path)
+        with self._lock:
+            row = self._conn.execute("SELECT mtime_ns, size FROM text_sources WHERE source = ?", (self.source_key(pdf_path),)).fetchone()
+        return row is not None and row["mtime_ns"] == pdf_stat.st_mtime_ns and row["size"] == pdf_stat.st_size
+
+    def build(self, pdf_path):
+        """
+        Extracts every page's text and word boxes and replaces the PDF's
+        index entries. Extraction happens before the write lock is taken.
+
+        Returns:
+            int: Page count.
+        """
+        started = time.time()
+        pdf_stat = os.stat(pdf_path)
+        source = self.source_key(pdf_path)
+        rows = []
+        doc = fitz.open(pdf_path)
+        try:
+            for page in doc:
+                # (x0, y0, x1, y1, word, block_no, line_no, word_no), coordinates in PDF points
+                words = [[round(w[0], 1), round(w[1], 1), round(w[2], 1), round(w[3], 1), w[4], w[5], w[6], w[7]]
+                         for w in page.get_text("words")]
+                rows.append((source, page.number, page.get_text("text"), json.dumps(words, separators=(",", ":"))))
+        finally:
+            doc.close()
+
+        with self._lock, self._conn:
+            self._delete(source)
+            self._conn.executemany("INSERT INTO page_text (source, page, text, words) VALUES (?, ?, ?, ?)", rows)
+            if self.fts:
+                self._conn.execute("INSERT INTO page_fts (rowid, text) SELECT id, text FROM page_text WHERE source = ?", (source,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO text_sources (source, mtime_ns, size, page_count, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (source, pdf_stat.st_mtime_ns, pdf_stat.st_size, len(rows), time.time()),
+            )
+        print(f"Indexed text layer of {pdf_path}: {len(rows)} pages in {time.time() - started:.2f}s")
+        return len(rows)
+
+    def ensure(self, pdf_path):
+        """Builds the index for pdf_path unless it is current."""
+        if not self.is_current(pdf_path):
+            self.build(pdf_path)
+
+    def _delete(self, source):
+        # Caller holds the lock and the transaction. External-content rows are
+        # deleted with the text they were indexed with, before page_text loses it.
+        if self.fts:
+            self._conn.execute("INSERT INTO page_fts (page_fts, rowid, text) SELECT 'delete', id, text FROM page_text WHERE source = ?",
+                               (source,))
+        self._conn.execute("DELETE FROM page_text WHERE source = ?", (source,))
+        self._conn.execute("DELETE FROM text_sources WHERE source = ?", (source,))
+
+    def remove(self, pdf_path):
+        """Drops the index entries of a PDF (used when the PDF is removed)."""
+        with self._lock, self._conn:
+            self._delete(self.source_key(pdf_path))
+
+    def source_size(self, pdf_path):
+        """Approximate bytes the index holds for a PDF (text and word boxes, text again in the FTS table)."""
+        with self._lock:
+            row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(text)), 0), COALESCE(SUM(LENGTH(words)), 0) FROM page_text WHERE source = ?",
+                                     (self.source_key(pdf_path),)).fetchone()
+        return row[0] * (2 if self.fts else 1) + row[1]
+
+    # --- Reading ---
+    def page_count(self, pdf_path):
+        """Number of indexed pages, or None if the PDF is not indexed."""
+        with self._lock:
+            row = self._conn.execute("SELECT page_count FROM text_sources WHERE source = ?", (self.source_key(pdf_path),)).fetchone()
+        return row["page_count"] if row else None
+
+    def page_text(self, pdf_path, page_num):
+        """Stored text of one page, or None if it is not indexed."""
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM page_text WHERE source = ? AND page = ?",
+                                     (self.source_key(pdf_path), page_num)).fetchone()
+        return row["text"] if row else None
+
+    def iter_pages(self, pdf_path, words=False):
+        """
+        Yields {"page", "text"} (or {"page", "words"}) for every indexed page
+        in order, reading TEXT_READ_BATCH_PAGES pages per query so the lock
+        is never held while the caller consumes results.
+        """
+        source = self.source_key(pdf_path)
+        column = "words" if words else "text"
+        next_page = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT page, {column} AS value FROM page_text WHERE source = ? AND page >= ? ORDER BY page LIMIT ?",
+                    (source, next_page, TEXT_READ_BATCH_PAGES),
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield {"page": row["page"], column: json.loads(row["value"]) if words else row["value"]}
+            next_page = rows[-1]["page"] + 1
+
+    # --- Search ---
+    def search(self, pdf_path, query, limit=50):
+        """
+        Finds pages containing every term of query (terms may end in * for a
+        prefix match) and the boxes of the matching words.
+
+        Returns:
+            list of dict: {"page", "snippet", "boxes": [[x0, y0, x1, y1], ...]}
+            in page order, boxes in PDF points. Phrase matches are boxed as
+            one run of words where the query's terms appear consecutively.
+        """
+        tokens = [t.lower() for t in SEARCH_TOKEN_RE.findall(query)]
+        if not tokens:
+            return []
+        source = self.source_key(pdf_path)
+        with self._lock:
+            if self.fts:
+                match = " ".join(f'"{t.rstrip("*")}"' + ("*" if t.endswith("*") else "") for t in tokens)
+                first_id, last_id = self._conn.execute("SELECT MIN(id), MAX(id) FROM page_text WHERE source = ?", (source,)).fetchone()
+                # The rowid range keeps FTS5 within this PDF's pages
+                rows = self._conn.execute(
+                    "SELECT p.page, p.text, p.words FROM page_fts f JOIN page_text p ON p.id = f.rowid "
+                    "WHERE page_fts MATCH ? AND f.rowid BETWEEN ? AND ? AND p.source = ? ORDER BY p.page LIMIT ?",
+                    (match, first_id, last_id, source, limit),
+                ).fetchall() if first_id is not None else []
+            else:
+                conditions = " AND ".join("text LIKE ?" for _ in tokens)
+                rows = self._conn.execute(
+                    f"SELECT page, text, words FROM page_text WHERE source = ? AND {conditions} ORDER BY page LIMIT ?",
+                    (source, *[f"%{t.rstrip('*')}%" for t in tokens], limit),
+                ).fetchall()
+
+        hits = []
+        for row in rows:
+            words = json.loads(row["words"])
+            boxes, first_index = self._match_boxes(words, tokens)
+            start = max(0, (first_index or 0) - SEARCH_SNIPPET_TOKENS // 2)
+            snippet = " ".join(w[4] for w in words[start:start + SEARCH_SNIPPET_TOKENS]) if words else row["text"][:200]
+            hits.append({"page": row["page"], "snippet": snippet, "boxes": boxes})
+        return hits
+
+    @staticmethod
+    def _match_boxes(words, tokens):
+        """Returns (boxes of matching words, index of the first match) for one page."""
+        def matches(word, token):
+            word = _normalize(word)
+            return word.startswith(token[:-1]) if token.endswith("*") else word == token
+
+        boxes, first_index = [], None
+        # Consecutive runs of the whole query first, one box per run
+        if len(tokens) > 1:
+            for i in range(len(words) - len(tokens) + 1):
+                if all(matches(words[i + j][4], token) for j, token in enumerate(tokens)):
+                    run = words[i:i + len(tokens)]
+                    boxes.append([min(w[0] for w in run), min(w[1] for w in run), max(w[2] for w in run), max(w[3] for w in run)])
+                    first_index = i if first_index is None else first_index
+        if not boxes: # Terms appear separately: box each occurrence
+            for i, word in enumerate(words):
+                if any(matches(word[4], token) for token in tokens):
+                    boxes.append(word[:4])
+                    first_index = i if first_index is None else first_index
+        return boxes, first_index
+
+    def stats(self):
+        """Returns indexed document/page counts and whether FTS5 is used."""
+        with self._lock:
+            sources = self._conn.execute("SELECT COUNT(*) FROM text_sources").fetchone()[0]
+            pages = self._conn.execute("SELECT COUNT(*) FROM page_text").fetchone()[0]
+        return {"documents": sources, "pages": pages, "fts5": self.fts}
@@ -0,0 +1,221 @@
+# utils/tiling.py
+import difflib
+import math
+import os
+import re
+
+import cv2 # For the ink mask used by block detection
+import fitz # PyMuPDF - For the full-resolution page render
+import numpy as np
+
+from utils.metrics import metrics
+from utils.preprocess import encode_image, use_grayscale, OCR_IMAGE_FORMAT
+
+# --- Configuration ---
+# Dense or oversized pages lose detail when GOT-OCR shrinks them to 1024x1024; tiling
+# OCRs pieces of a full-resolution render instead and stitches the texts back together
+TILING_MODES = ("off", "grid", "blocks") # grid: overlapping strips; blocks: whitespace-separated layout blocks
+ANALYZE_TILING = os.getenv("ANALYZE_TILING", "off").lower() # Default mode for /analyze_page and /analyze_document
+TILE_SIZE = int(os.getenv("TILE_SIZE", "1280")) # Pixels a tile's long edge may reach before it is split further
+TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", "96")) # Pixels shared by consecutive grid strips (a couple of text lines at 300 DPI)
+TILE_MAX_TILES = int(os.getenv("TILE_MAX_TILES", "24")) # More blocks than this fall back to grid strips
+TILE_MAX_IN_FLIGHT = int(os.getenv("TILE_MAX_IN_FLIGHT", "4")) # Concurrent GOT-OCR calls per tiled page
+TILE_MIN_GAP_INCHES = 0.12 # Whitespace run wide enough to cut between blocks
+TILE_NOISE_SHARE = 0.002 # Rows / columns with less ink than this share of their length count as whitespace
+TILE_PADDING = 8 # Pixels of margin kept around a block
+STITCH_MAX_LINES = 8 # Lines compared at each overlap
+STITCH_MATCH_RATIO = 0.8 # Similarity at which two OCR'd lines count as the same line
+
+
+# --- Tile Planning ---
+def ink_mask(gray):
+    """Boolean ink mask of a grayscale render: Otsu threshold, then an opening that drops scan specks."""
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+    return mask > 0
+
+
+def _whitespace_runs(profile, min_gap):
+    """(start, end) of runs of False in a boolean profile at least min_gap long, not touching either end."""
+    runs = []
+    start = None
+    for index, inked in enumerate(profile):
+        if not inked and start is None:
+            start = index
+        elif inked and start is not None:
+            if start > 0 and index - start >= min_gap:
+                runs.append((start, index))
+            start = None
+    return runs
+
+
+def grid_tiles(box, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Splits a box into overlapping horizontal strips (and into columns when it
+    is more than two tiles wide), column by column so each strip follows the
+    one above it.
+
+    Returns:
+        list of tuple: (x0, y0, x1, y1, overlaps_previous)
+    """
+    x0, y0, x1, y1 = box
+    columns = 1 if x1 - x0 <= 2 * tile_size else math.ceil((x1 - x0) / tile_size)
+    rows = max(1, math.ceil((y1 - y0 - overlap) / max(1, tile_size - overlap)))
+    strip = (y1 - y0 + (rows - 1) * overlap) / rows
+    tiles = []
+    for col in range(columns):
+        cx0 = x0 + round(col * (x1 - x0) / columns)
+        cx1 = x0 + round((col + 1) * (x1 - x0) / columns)
+        for row in range(rows):
+            top = y0 + round(row * (strip - overlap))
+            tiles.append((cx0, top, cx1, min(y1, round(top + strip)), row > 0))
+    return tiles
+
+
+def _xy_cut(mask, box, min_gap, tiles):
+    """
+    Recursive XY-cut: trims the box to its ink, and while it is larger than
+    TILE_SIZE cuts it through the widest whitespace run in either direction
+    (columns left to right, bands top to bottom, so tiles come out in reading
+    order). A box with no whitespace to cut through becomes grid strips.
+    """
+    x0, y0, x1, y1 = box
+    region = mask[y0:y1, x0:x1]
+    rows = region.sum(axis=1) > max(1, TILE_NOISE_SHARE * (x1 - x0))
+    cols = region.sum(axis=0) > max(1, TILE_NOISE_SHARE * (y1 - y0))
+    if not rows.any() or not cols.any():
+        return # No ink, nothing to OCR
+    inked_rows, inked_cols = np.flatnonzero(rows), np.flatnonzero(cols)
+    x0, x1 = x0 + int(inked_cols[0]), x0 + int(inked_cols[-1]) + 1
+    y0, y1 = y0 + int(inked_rows[0]), y0 + int(inked_rows[-1]) + 1
+    if max(x1 - x0, y1 - y0) <= TILE_SIZE:
+        height, width = mask.shape
+        tiles.append((max(0, x0 - TILE_PADDING), max(0, y0 - TILE_PADDING),
+                      min(width, x1 + TILE_PADDING), min(height, y1 + TILE_PADDING), False))
+        return
+
+    rows, cols = rows[inked_rows[0]:inked_rows[-1] + 1], cols[inked_cols[0]:inked_cols[-1] + 1]
+    cuts = [(end - start, 1, "x", (start + end) // 2) for start, end in _whitespace_runs(cols, min_gap)]
+    cuts += [(end - start, 0, "y", (start + end) // 2) for start, end in _whitespace_runs(rows, min_gap)]
+    if not cuts:
+        tiles.extend(grid_tiles((x0, y0, x1, y1)))
+        return
+    _, _, axis, offset = max(cuts) # Widest gap wins; on a tie, columns before bands
+    if axis == "x":
+        _xy_cut(mask, (x0, y0, x0 + offset, y1), min_gap, tiles)
+        _xy_cut(mask, (x0 + offset, y0, x1, y1), min_gap, tiles)
+    else:
+        _xy_cut(mask, (x0, y0, x1, y0 + offset), min_gap, tiles)
+        _xy_cut(mask, (x0, y0 + offset, x1, y1), min_gap, tiles)
+
+
+def plan_tiles(gray, dpi, mode):
+    """
+    Tiles of a full-resolution grayscale page render, in reading order.
+
+    Args:
+        gray (np.ndarray): HxW uint8 render.
+        dpi (float): Its resolution, which scales the whitespace gap for block detection.
+        mode (str): "grid" or "blocks".
+
+    Returns:
+        list of tuple: (x0, y0, x1, y1, overlaps_previous) in pixels. Blocks
+            never overlap; grid strips overlap the strip above them.
+    """
+    height, width = gray.shape[:2]
+    if mode == "blocks":
+        tiles = []
+        _xy_cut(ink_mask(gray), (0, 0, width, height), max(4, round(TILE_MIN_GAP_INCHES * dpi)), tiles)
+        if len(tiles) <= TILE_MAX_TILES:
+            return tiles
+    return grid_tiles((0, 0, width, height))
+
+
+def prepare_page_tiles(page, dpi, mode):
+    """
+    Renders a page at dpi and cuts it into tiles for GOT-OCR (see plan_tiles).
+    Tiles are grayscale unless the page has colour, and JPEG encoded unless
+    OCR_IMAGE_FORMAT asks for PNG.
+
+    Returns:
+        tuple: (list of image bytes, list of {"box": [x0, y0, x1, y1], "overlaps_previous": bool})
+    """
+    gray = use_grayscale(page)
+    with metrics.span("page_render"):
+        pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=fitz.csGRAY if gray else fitz.csRGB, alpha=False)
+        shape = (pix.height, pix.width) if gray else (pix.height, pix.width, 3)
+        pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(shape)
+    with metrics.span("tile_plan"):
+        tiles = plan_tiles(pixels if gray else cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY), dpi, mode)
+    fmt = "png" if OCR_IMAGE_FORMAT == "png" else "jpeg"
+    images = []
+    with metrics.span(f"{fmt}_encode"):
+        for x0, y0, x1, y1, _ in tiles:
+            images.append(encode_image(np.ascontiguousarray(pixels[y0:y1, x0:x1]), fmt))
+    return images, [{"box": [x0, y0, x1, y1], "overlaps_previous": overlaps} for x0, y0, x1, y1, overlaps in tiles]
+
+
+# --- Stitching ---
+def _normalize_line(line):
+    return re.sub(r"\s+", " ", line).strip().lower()
+
+
+def _lines_match(a, b):
+    a, b = _normalize_line(a), _normalize_line(b)
+    return a == b or difflib.SequenceMatcher(None, a, b).ratio() >= STITCH_MATCH_RATIO
+
+
+def _overlap(previous, current):
+    """
+    Finds the lines current repeats from the end of previous.
+
+    A strip boundary usually cuts through a text line, which then comes back
+    garbled at the bottom of one strip and the top of the next, so up to one
+    such partial line on either side is allowed around the matched run.
+
+    Returns:
+        tuple: (matched lines, partial lines after them at the end of previous,
+                partial lines before them at the start of current); (0, 0, 0) if nothing matches.
+    """
+    best = (0, 0, 0) # (matched lines, trailing partial lines of previous, leading partial lines of current)
+    for skip_previous in (0, 1):
+        tail = previous[:len(previous) - skip_previous]
+        for skip_current in (0, 1):
+            head = current[skip_current:]
+            for count in range(min(len(tail), len(head), STITCH_MAX_LINES), best[0], -1):
+                if all(_lines_match(a, b) for a, b in zip(tail[-count:], head[:count])):
+                    best = (count, skip_previous, skip_current)
+                    break
+    return best
+
+
+def stitch_tile_texts(texts, tiles):
+    """
+    Joins the OCR'd texts of a page's tiles in reading order. Text repeated
+    in the overlap of consecutive grid strips is kept once; separate blocks
+    are joined as paragraphs.
+
+    Args:
+        texts (list of str): One text per tile, in tile order.
+        tiles (list of dict): Tile info from prepare_page_tiles.
+
+    Returns:
+        str: The page text.
+    """
+    blocks = [] # Lists of lines, one per run of overlapping tiles
+    for text, tile in zip(texts, tiles):
+        lines = text.strip("\n").splitlines()
+        if tile["overlaps_previous"] and blocks:
+            previous = blocks[-1]
+            matched, skip_previous, skip_current = _overlap(previous, lines)
+            if skip_previous:
+                del previous[-skip_previous:]
+            if matched:
+                # Keep the longer reading of each repeated line: one strip may have seen it cut off
+                for offset in range(matched):
+                    index = len(previous) - matched + offset
+                    previous[index] = max(previous[index], lines[skip_current + offset], key=lambda line: len(line.strip()))
+            previous.extend(lines[skip_current + matched:] if matched else lines)
+        else:
+            blocks.append(lines)
+    return "\n\n".join("\n".join(lines) for lines in blocks if any(line.strip() for line in lines))